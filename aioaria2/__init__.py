@@ -2,10 +2,20 @@
 """
 本模块提供aria2 json rpc的异步io交互接口 和aria2进程的管理器
 """
-from aioaria2.client import Aria2HttpClient, Aria2WebsocketClient, Aria2WebsocketTrigger
+from aioaria2.client import (
+    Aria2HttpClient,
+    Aria2WebsocketClient,
+    Aria2WebsocketPool,
+    Aria2WebsocketTrigger,
+)
+from aioaria2.cluster import Aria2Cluster
 from aioaria2.exceptions import Aria2rpcException
+from aioaria2.metrics import MetricsCollector, MetricsHooks
 from aioaria2.parser import ControlFile, DHTFile
-from aioaria2.server import Aria2Server, AsyncAria2Server
+from aioaria2.records import DownloadStatus, FileInfo, GlobalStat, PeerInfo
+from aioaria2.scheduler import RequestScheduler
+from aioaria2.server import Aria2Server, AsyncAria2Server, AsyncAria2ServerPool
+from aioaria2.state import DownloadStateCache
 from aioaria2.utils import add_async_callback, run_sync
 
 __version__ = "1.3.6"
@@ -14,12 +24,23 @@ __author__ = "synodriver"
 __all__ = [
     "Aria2Server",
     "AsyncAria2Server",
+    "AsyncAria2ServerPool",
     "Aria2WebsocketTrigger",
+    "Aria2Cluster",
     "Aria2HttpClient",
     "Aria2WebsocketClient",
+    "Aria2WebsocketPool",
     "Aria2rpcException",
     "ControlFile",
     "DHTFile",
+    "DownloadStateCache",
+    "DownloadStatus",
+    "FileInfo",
+    "GlobalStat",
+    "MetricsCollector",
+    "MetricsHooks",
+    "PeerInfo",
+    "RequestScheduler",
     "run_sync",
     "add_async_callback",
 ]
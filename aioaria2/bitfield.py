@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+本模块提供bitfield的统计工具 适用于.aria2控制文件和tellStatus/getPeers返回的bitfield
+
+最高位对应下标0的分片 安装了numpy时使用向量化实现
+"""
+from typing import Any, List, Optional, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None  # type: ignore
+
+BitfieldLike = Union[bytes, bytearray, memoryview, str]
+
+_POPCOUNT = bytes(bin(i).count("1") for i in range(256))
+
+
+def _popcount_int(value: int) -> int:
+    try:
+        return value.bit_count()  # type: ignore
+    except AttributeError:  # python<3.10
+        return bin(value).count("1")
+
+
+class Bitfield:
+    """
+    只读的bitfield视图
+    """
+
+    __slots__ = ("data", "num_pieces")
+
+    def __init__(self, data: BitfieldLike, num_pieces: Optional[int] = None):
+        """
+        :param data: 原始bytes 或者aria2 rpc返回的十六进制字符串
+        :param num_pieces: 分片数量 超出的尾部位会被忽略 默认为len(data)*8
+        """
+        if isinstance(data, str):
+            data = bytes.fromhex(data)
+        self.data = data
+        if num_pieces is None:
+            num_pieces = len(data) * 8
+        self.num_pieces = min(num_pieces, len(data) * 8)
+
+    @classmethod
+    def from_status(cls, status: Any) -> "Bitfield":
+        """
+        从tellStatus的结果构建 支持字典和DownloadStatus记录
+        """
+        if isinstance(status, dict):
+            bitfield, num_pieces = status["bitfield"], status.get("numPieces")
+        else:
+            bitfield, num_pieces = status.bitfield, status.numPieces
+        return cls(bitfield, int(num_pieces) if num_pieces is not None else None)
+
+    def __len__(self) -> int:
+        return self.num_pieces
+
+    def __getitem__(self, index: int) -> bool:
+        if index < 0:
+            index += self.num_pieces
+        if not 0 <= index < self.num_pieces:
+            raise IndexError("piece index out of range")
+        return bool(self.data[index >> 3] & (0x80 >> (index & 7)))
+
+    def _bits(self) -> "np.ndarray":
+        return np.unpackbits(np.frombuffer(self.data, dtype=np.uint8))[
+            : self.num_pieces
+        ]
+
+    def count(self) -> int:
+        """
+        已完成的分片数
+        """
+        full, rest = divmod(self.num_pieces, 8)
+        data = self.data
+        if np is not None and full >= 64:
+            total = int(
+                np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=full)).sum(
+                    dtype=np.int64
+                )
+            )
+        else:
+            total = _popcount_int(int.from_bytes(data[:full], "big"))
+        if rest:
+            total += _POPCOUNT[data[full] & (0xFF << (8 - rest)) & 0xFF]
+        return total
+
+    def is_complete(self) -> bool:
+        return self.count() == self.num_pieces
+
+    def ranges(self, value: bool = True) -> List[Tuple[int, int]]:
+        """
+        连续的分片区间
+        :param value: True返回已完成的区间 False返回缺失的区间
+        :return: [(start, stop), ...] 左闭右开
+        """
+        if np is not None:
+            bits = self._bits().astype(np.int8)
+            if not value:
+                bits = 1 - bits
+            edges = np.diff(np.concatenate(([0], bits, [0])))
+            starts = np.flatnonzero(edges == 1)
+            stops = np.flatnonzero(edges == -1)
+            return list(zip(starts.tolist(), stops.tolist()))
+        result: List[Tuple[int, int]] = []
+        skip = 0x00 if value else 0xFF  # 整个字节都不在区间内 可以跳过
+        start = -1
+        data = self.data
+        num_pieces = self.num_pieces
+        for byte_index in range((num_pieces + 7) >> 3):
+            byte = data[byte_index]
+            base = byte_index << 3
+            if start < 0 and byte == skip:
+                continue
+            if start >= 0 and byte == 0xFF - skip:
+                continue
+            for bit in range(8):
+                index = base + bit
+                if index >= num_pieces:
+                    break
+                if bool(byte & (0x80 >> bit)) == value:
+                    if start < 0:
+                        start = index
+                elif start >= 0:
+                    result.append((start, index))
+                    start = -1
+        if start >= 0:
+            result.append((start, num_pieces))
+        return result
+
+    def missing(self) -> List[int]:
+        """
+        缺失的分片下标
+        """
+        if np is not None:
+            return np.flatnonzero(self._bits() == 0).tolist()
+        return [i for start, stop in self.ranges(False) for i in range(start, stop)]
+
+    def completed_length(self, piece_length: int, total_length: int) -> int:
+        """
+        已完成分片的总字节数 最后一个分片可能不足piece_length
+        :param piece_length: 分片长度
+        :param total_length: 文件总长度
+        """
+        if not self.num_pieces:
+            return 0
+        completed = self.count() * piece_length
+        last = self.num_pieces - 1
+        if self[last]:
+            completed -= piece_length * self.num_pieces - total_length
+        return completed
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.count()}/{self.num_pieces})"
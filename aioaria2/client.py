@@ -5,35 +5,196 @@
 参数参考 http://aria2.github.io/manual/en/html/aria2c.html#rpc-interface
 """
 import asyncio
+import os
+import random
+import re
+import sys
+import time
+import uuid
 import warnings
-from collections import defaultdict
-from inspect import stack
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from inspect import signature, stack
 from typing import (
     Any,
     AsyncGenerator,
+    AsyncIterable,
+    Awaitable,
+    Callable,
     DefaultDict,
+    Deque,
     Dict,
     Iterable,
     List,
     NoReturn,
     Optional,
+    Set,
+    Tuple,
     Union,
 )
 
 import aiohttp
 from typing_extensions import Literal
 
+from aioaria2.codec import CallableCodec, JsonCodec, get_codec
+from aioaria2.events import EventStream, NotificationDispatcher
 from aioaria2.exceptions import Aria2rpcException
+from aioaria2.metrics import InstrumentedCodec, MetricsHooks, instrument_codec
+from aioaria2.records import DownloadStatus, FileInfo, GlobalStat, PeerInfo
+from aioaria2.scheduler import RequestQueue, RequestScheduler
 from aioaria2.typing import CallBack, IdFactory
 from aioaria2.utils import (
-    DEFAULT_JSON_DECODER,
-    DEFAULT_JSON_ENCODER,
+    JSON_ENCODING,
     ResultStore,
     add_options_and_position,
+    aiter_b64_payload,
     b64encode_file,
+    b64encoded_length,
+    build_b64_payload,
     get_status,
+    read_b64encode_file,
+    unpack_batch,
 )
 
+_WS_SEND_FRAME = hasattr(aiohttp.ClientWebSocketResponse, "send_frame")
+_WS_DECODE_TEXT = (
+    "decode_text" in signature(aiohttp.ClientSession.ws_connect).parameters
+)
+_WS_CLOSING = (
+    aiohttp.WSMsgType.CLOSE,
+    aiohttp.WSMsgType.CLOSING,
+    aiohttp.WSMsgType.CLOSED,
+    aiohttp.WSMsgType.ERROR,
+)
+
+MAX_RESULTS = 2**31 - 1  # tellWaiting/tellStopped一次取完
+SNAPSHOT_CHUNK_SIZE = 1000  # snapshot一个multicall最多包含的gid数
+SNAPSHOT_GLOBAL_STAT = "aria2.getGlobalStat"  # snapshot.errors中getGlobalStat失败时的key
+DEFAULT_BATCH_BYTES = (2 << 20) - (64 << 10)  # aria2的--rpc-max-request-size默认为2M
+
+"""
+只读的rpc方法 断线时在途的这些请求可以安全地重发
+"""
+IDEMPOTENT_METHODS = frozenset(
+    (
+        "aria2.tellStatus",
+        "aria2.getUris",
+        "aria2.getFiles",
+        "aria2.getPeers",
+        "aria2.getServers",
+        "aria2.tellActive",
+        "aria2.tellWaiting",
+        "aria2.tellStopped",
+        "aria2.getOption",
+        "aria2.getGlobalOption",
+        "aria2.getGlobalStat",
+        "aria2.getVersion",
+        "aria2.getSessionInfo",
+        "system.listMethods",
+        "system.listNotifications",
+    )
+)
+
+"""
+websocket客户端重连成功后产生的事件 可以像aria2的通知一样注册回调
+"""
+RECONNECT_EVENT = "aioaria2.onReconnect"
+
+_STATUS_BY_NOTIFICATION = {
+    "aria2.onDownloadStart": "active",
+    "aria2.onDownloadPause": "paused",
+    "aria2.onDownloadStop": "removed",
+    "aria2.onDownloadComplete": "complete",
+    "aria2.onDownloadError": "error",
+}
+_NOTIFICATION_BY_STATUS = {
+    status: method for method, status in _STATUS_BY_NOTIFICATION.items()
+}
+
+
+def _call_count(req_obj: Dict[str, Any]) -> int:
+    """
+    请求中包含的调用数 multicall按其中的调用计算
+    """
+    if req_obj["method"] == "system.multicall":
+        return max(1, len(req_obj["params"][0]))
+    return 1
+
+
+def _is_idempotent(req_obj: Dict[str, Any]) -> bool:
+    method = req_obj["method"]
+    if method == "system.multicall":
+        return all(
+            call.get("methodName") in IDEMPOTENT_METHODS
+            for call in req_obj["params"][0]
+        )
+    return method in IDEMPOTENT_METHODS
+
+
+class Snapshot:
+    """
+    snapshot的结果 statuses和errors以gid为key
+    getGlobalStat失败时global_stat为None 错误在errors[SNAPSHOT_GLOBAL_STAT]
+    """
+
+    __slots__ = ("statuses", "errors", "global_stat")
+
+    def __init__(
+        self,
+        statuses: Dict[str, Dict[str, Any]],
+        errors: Dict[str, Aria2rpcException],
+        global_stat: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.statuses = statuses
+        self.errors = errors
+        self.global_stat = global_stat
+
+    def __getitem__(self, gid: str) -> Dict[str, Any]:
+        return self.statuses[gid]
+
+    def __contains__(self, gid: object) -> bool:
+        return gid in self.statuses
+
+    def __len__(self) -> int:
+        return len(self.statuses)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(statuses={len(self.statuses)}, "
+            f"errors={len(self.errors)}, global_stat={self.global_stat is not None})"
+        )
+
+
+def _fault(item: Any) -> Aria2rpcException:
+    """
+    multicall中失败的调用 {'faultCode':1,'faultString':'...'}
+    """
+    return Aria2rpcException(
+        (isinstance(item, dict) and item.get("faultString"))
+        or f"unexpected result: {item}"
+    )
+
+
+_TELL_STATUS_CALL = {"methodName": "aria2.tellStatus"}
+_GLOBAL_STAT_CALL = {"methodName": "aria2.getGlobalStat"}
+
+
+_PLAIN_GID = re.compile(r"[0-9A-Za-z]+")
+
+
+def _is_plain_gid(gid: str) -> bool:
+    """
+    不需要转义就能直接放进json字符串的gid
+    """
+    return _PLAIN_GID.fullmatch(gid) is not None
+
+
+def _defined_in(cls: type, name: str) -> type:
+    """
+    MRO中定义了name的类
+    """
+    return next(klass for klass in cls.__mro__ if name in vars(klass))
+
 
 class _Aria2BaseClient:
     """
@@ -47,6 +208,10 @@ class _Aria2BaseClient:
         mode: Literal["normal", "batch", "format"] = "normal",
         token: str = None,
         queue: asyncio.Queue = None,
+        coalesce_window: Optional[float] = None,
+        coalesce_max: int = 100,
+        metrics: Optional[MetricsHooks] = None,
+        scheduler: Optional[RequestScheduler] = None,
     ):
         """
         :param identity: 操作rpc接口的id 生成他的工厂函数
@@ -56,12 +221,71 @@ class _Aria2BaseClient:
             batch - 请求加入队列，由process_queue方法处理
             format - 返回rpc请求json结构
         :param token: rpc服务器密码 (用 `--rpc-secret`设置)
-        """
-        self.queue = asyncio.Queue() if queue is None else queue
-        self.identity = identity or ResultStore.get_id
+        :param coalesce_window: normal模式下合并请求的时间窗口(秒) None表示不合并
+            窗口内发起的请求作为一个jsonrpc batch发送 0表示合并同一轮事件循环中的请求
+        :param coalesce_max: 一个batch最多合并的请求数 达到后立即发送
+        :param metrics: 指标钩子 参考aioaria2.metrics None表示不记录
+        :param scheduler: 按优先级限制并发和速率 参考aioaria2.scheduler None表示不调度
+            同一个aria2的客户端可以共用一个
+            同时设置coalesce_window时先调度再合并 每个请求在所在的batch返回前都占用一个并发名额
+            所以一个batch最多只能合并到对应优先级的并发上限那么多请求 一般不需要同时使用
+        """
+        # 默认的队列记录入队时间 可以报告等待时间 也可以传入任意asyncio.Queue
+        self.queue = RequestQueue() if queue is None else queue
+        self._results = ResultStore()  # 本连接的请求表 id空间与其他客户端互不干扰
+        self.identity = identity or self._results.get_id
         self.url = url
         self.mode = mode
         self.token = token
+        self.coalesce_window = coalesce_window
+        self.coalesce_max = coalesce_max
+        self._coalesced: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._coalesce_handle: Optional[asyncio.TimerHandle] = None
+        self._coalesce_tasks: Set[asyncio.Task] = set()
+        self.metrics = metrics
+        self.scheduler = scheduler
+        if scheduler is not None and scheduler.metrics is None:
+            scheduler.metrics = metrics
+        # 预先编码好的请求片段 见_compile和_snapshot_templates
+        self._templates: Dict[Any, Any] = {}
+        # 子类覆盖了send_request(或者只实现了它)时请求都交给send_request
+        # 不走直接发送编码好的请求的快速路径
+        self._send_encoded_directly = issubclass(
+            _defined_in(type(self), "_send_encoded"),
+            _defined_in(type(self), "send_request"),
+        )
+
+    @property
+    def loads(self) -> Callable[[Union[bytes, str]], Any]:
+        """
+        兼容v1.3.7之前的loads属性 新代码请使用codec
+        """
+        return self.codec.loads
+
+    @loads.setter
+    def loads(self, loads: Callable[[str], Any]) -> None:
+        self._set_codec(CallableCodec(loads, self._raw_codec().dumps))
+
+    @property
+    def dumps(self) -> Callable[[Any], bytes]:
+        """
+        兼容v1.3.7之前的dumps属性 新代码请使用codec 注意返回的是bytes
+        """
+        return self.codec.dumps
+
+    @dumps.setter
+    def dumps(self, dumps: Callable[[Any], Union[str, bytes]]) -> None:
+        raw = self._raw_codec()
+        loads = raw._loads if isinstance(raw, CallableCodec) else None
+        self._set_codec(CallableCodec(loads, dumps))
+
+    def _raw_codec(self) -> JsonCodec:
+        codec = self.codec
+        return codec.codec if isinstance(codec, InstrumentedCodec) else codec
+
+    def _set_codec(self, codec: JsonCodec) -> None:
+        self.codec = instrument_codec(codec, self.metrics)
+        self._templates.clear()  # 模板中缓存了旧的dumps
 
     async def jsonrpc(
         self, method: str, params: Optional[List[Any]] = None, prefix: str = "aria2."
@@ -73,51 +297,334 @@ class _Aria2BaseClient:
         :param prefix: 请求的头部
         :return: 响应结果
         """
-        if not params:
-            params = []
+        if (
+            self.mode == "normal"
+            and self.coalesce_window is None
+            and method != "multicall"
+            and self._send_encoded_directly
+        ):
+            identity = self.identity()
+            if asyncio.iscoroutine(identity):
+                identity = await identity
+            if self.metrics is None and self.scheduler is None:
+                return await self._send_encoded(
+                    *self._compile(method, params, prefix, identity)
+                )
+            start = time.perf_counter()
+            req_obj, payload = self._compile(method, params, prefix, identity)
+            if self.metrics is not None:
+                self.metrics.on_encode(
+                    req_obj["method"], len(payload), time.perf_counter() - start
+                )
+            return await self._dispatch(req_obj, payload)
+        req_obj = await self._build_request(method, params, prefix)
+        if self.mode == "batch":
+            await self.queue.put(req_obj)
+            if self.metrics is not None:
+                self.metrics.on_queue_depth(self.queue.qsize())
+            return None
+        if self.mode == "format":
+            return req_obj
+        if self.metrics is not None or self.scheduler is not None:
+            return await self._dispatch(req_obj)
+        if self.coalesce_window is not None:
+            return await self._coalesce(req_obj)
+        return await self.send_request(req_obj)
+
+    def _compile(
+        self, method: str, params: Optional[List[Any]], prefix: str, identity: Any
+    ) -> Tuple[Dict[str, Any], bytes]:
+        """
+        直接编码请求 不构造带token的参数列表 也不修改调用者的参数
+        请求中固定的部分(版本 方法名 token)按方法编码一次并缓存 每次只需要编码params和id
+        :return: (请求 只用于id和判断能否重发, 编码好的请求)
+        """
+        full_method = prefix + method
+        template = self._templates.get(full_method)
+        if template is None or template[0] != self.token:
+            template = self._compile_template(full_method)
+        _, with_params, without_params, dumps = template
+        id_bytes = b"%d" % identity if type(identity) is int else dumps(identity)
+        if params:
+            payload = with_params % (dumps(params)[1:], id_bytes)
+        else:
+            payload = without_params % id_bytes
+        req_obj = {
+            "jsonrpc": "2.0",
+            "id": identity,
+            "method": full_method,
+            "params": params or [],
+        }
+        return req_obj, payload
+
+    def _compile_template(self, full_method: str) -> Tuple[Any, ...]:
+        """
+        :return: (token, 有参数时的模板, 没有参数时的模板, 编码params和id用的dumps)
+        """
+        codec = self.codec
+        # 整个请求的编码耗时和大小由_measure的调用者记录 这里绕过计数
+        raw = codec.codec if isinstance(codec, InstrumentedCodec) else codec
+        head = (
+            b'{"jsonrpc":"2.0","method":'
+            + raw.dumps(full_method).replace(b"%", b"%%")
+            + b',"params":['
+        )
+        if self.token is not None:
+            token = raw.dumps(f"token:{self.token}").replace(b"%", b"%%")
+            with_params = head + token + b',%s,"id":%s}'
+            without_params = head + token + b'],"id":%s}'
+        else:
+            with_params = head + b'%s,"id":%s}'
+            without_params = head + b'],"id":%s}'
+        template = (self.token, with_params, without_params, raw.dumps)
+        if len(self._templates) >= 256:  # 防止无限增长
+            self._templates.clear()
+        self._templates[full_method] = template
+        return template
+
+    async def _dispatch(
+        self,
+        req_obj: Dict[str, Any],
+        payload: Optional[bytes] = None,
+        send: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        """
+        经过调度器和指标发送一个请求
+        :param payload: 已经编码好的请求 参考_send_encoded
+        :param send: 代替默认发送方式的协程函数 不经过合并
+        """
+        if self.scheduler is not None:
+            return await self.scheduler.run(
+                req_obj,
+                lambda: self._measure(req_obj, payload, send),
+                _is_idempotent(req_obj),
+                _call_count(req_obj),
+            )
+        return await self._measure(req_obj, payload, send)
+
+    async def _measure(
+        self,
+        req_obj: Dict[str, Any],
+        payload: Optional[bytes] = None,
+        send: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        """
+        记录一次调用的耗时和结果 调度器中排队的时间不计入
+        """
+        metrics = self.metrics
+        if metrics is None:
+            return await self._send(req_obj, payload, send)
+        method = req_obj["method"]
+        metrics.on_request_start(method)
+        start = time.perf_counter()
+        error = False
+        try:
+            return await self._send(req_obj, payload, send)
+        except asyncio.CancelledError:
+            raise  # 被取消(比如close()时)不算请求出错
+        except BaseException:
+            error = True
+            raise
+        finally:
+            metrics.on_request_end(method, time.perf_counter() - start, error)
+
+    async def _send(
+        self,
+        req_obj: Dict[str, Any],
+        payload: Optional[bytes] = None,
+        send: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        if send is not None:
+            return await send()
+        if payload is not None:
+            return await self._send_encoded(req_obj, payload)
+        if self.coalesce_window is not None:
+            return await self._coalesce(req_obj)
+        return await self.send_request(req_obj)
+
+    async def _build_request(
+        self, method: str, params: Optional[List[Any]] = None, prefix: str = "aria2."
+    ) -> Dict[str, Any]:
+        """
+        加上token和id 组装jsonrpc请求
+        """
+        params = list(params) if params else []  # 不修改调用者的参数
 
         if self.token is not None:
             token_str = f"token:{self.token}"
             if method == "multicall":
-                for param in params[0]:
-                    try:
-                        param["params"].insert(0, token_str)
-                    except KeyError:
-                        param["params"] = [token_str]
+                params[0] = [
+                    {**param, "params": [token_str, *param.get("params", ())]}
+                    for param in params[0]
+                ]
             else:
                 params.insert(0, token_str)
 
         identity = self.identity()
         if asyncio.iscoroutine(identity):
             identity = await identity
-        req_obj = {
+        return {
             "jsonrpc": "2.0",
             "id": identity,
             "method": prefix + method,
             "params": params,
         }
-        if self.mode == "batch":
-            await self.queue.put(req_obj)
-            return None
-        if self.mode == "format":
-            return req_obj
-        return await self.send_request(req_obj)
+
+    async def _coalesce(self, req_obj: Dict[str, Any]) -> Any:
+        """
+        把请求放进当前窗口 等待所在的batch返回
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._coalesced.append((req_obj, future))
+        if len(self._coalesced) >= self.coalesce_max:
+            self._flush_coalesced()
+        elif self._coalesce_handle is None:
+            self._coalesce_handle = loop.call_later(
+                self.coalesce_window, self._flush_coalesced  # type: ignore
+            )
+        return await future
+
+    def _flush_coalesced(self) -> None:
+        if self._coalesce_handle is not None:
+            self._coalesce_handle.cancel()
+            self._coalesce_handle = None
+        pending, self._coalesced = self._coalesced, []
+        if pending:
+            task = asyncio.create_task(self._send_coalesced(pending))
+            self._coalesce_tasks.add(task)  # add a strong ref
+            task.add_done_callback(self._coalesce_tasks.discard)
+
+    async def _send_coalesced(
+        self, pending: List[Tuple[Dict[str, Any], asyncio.Future]]
+    ) -> None:
+        req_objs = [req_obj for req_obj, _ in pending]
+        try:
+            if len(req_objs) == 1:
+                results = [await self.send_request(req_objs[0])]
+            else:
+                results = await self.send_batch(req_objs)
+        except Exception as err:
+            results = [err] * len(pending)
+        except asyncio.CancelledError:  # close() 不要让调用者一直等下去
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(Aria2rpcException("client closed"))
+            raise
+        for (_, future), result in zip(pending, results):
+            if future.done():  # 调用者已经取消了
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
 
     async def send_request(self, req_obj: Dict[str, Any]) -> Union[Dict[str, Any], Any]:
         raise NotImplementedError
 
+    async def send_batch(
+        self, req_objs: List[Dict[str, Any]]
+    ) -> List[Union[Any, Aria2rpcException]]:
+        raise NotImplementedError
+
+    async def _send_encoded(self, req_obj: Dict[str, Any], payload: bytes) -> Any:
+        """
+        发送已经编码好的请求
+        :param req_obj: 只用到id 以及判断能否重发的method和multicall的methodName
+        :param payload: 编码好的请求
+        """
+        raise NotImplementedError
+
+    async def _send_file_request(
+        self, req_obj: Dict[str, Any], prefix: bytes, path: str, suffix: bytes
+    ) -> Any:
+        """
+        发送一个第一个参数为文件base64编码的请求 编码好的请求为prefix+文件编码+suffix
+        子类可以直接把文件流式地写进请求 默认实现先读出整个文件
+        """
+        params = req_obj["params"]
+        index = 1 if self.token is not None else 0
+        params[index] = await b64encode_file(path)
+        return await self.send_request(req_obj)
+
+    async def _add_file(self, method: str, path: str, params: List[Any]) -> Any:
+        """
+        以文件的base64编码作为第一个参数调用method 文件不会整个载入内存
+        :param params: 文件之后的参数
+        """
+        if (
+            self.mode != "normal"
+            or self.coalesce_window is not None
+            or not self._send_encoded_directly
+        ):
+            return await self.jsonrpc(method, [await b64encode_file(path), *params])
+        marker = f"@aioaria2-file-{uuid.uuid4().hex}@"  # 在编码结果中找到文件的位置
+        req_obj = await self._build_request(method, [marker, *params])
+        prefix, suffix = self.codec.dumps(req_obj).split(
+            marker.encode(JSON_ENCODING), 1
+        )
+        if self.metrics is None and self.scheduler is None:
+            return await self._send_file_request(req_obj, prefix, path, suffix)
+        return await self._dispatch(
+            req_obj,
+            send=lambda: self._send_file_request(req_obj, prefix, path, suffix),
+        )
+
     async def process_queue(self) -> List:
         """
         处理队列请求
+        队列中的请求作为一个jsonrpc batch数组一次性发送
+        :return: 与入队顺序一致的结果 失败的请求对应一个Aria2rpcException实例而不是抛出
         """
-        # req_obj = self.queue
-        # self.queue = []
-        # return await self.send_request(req_obj)
-        req_objs = []
-        while not self.queue.empty():
-            req_objs.append(await self.queue.get())
-
-        results = await asyncio.gather(*map(self.send_request, req_objs))
+        if isinstance(self.queue, RequestQueue):
+            entries = self.queue.drain()
+        else:
+            entries = []
+            while not self.queue.empty():
+                entries.append((0.0, self.queue.get_nowait()))
+        if self.metrics is not None:
+            self.metrics.on_queue_depth(self.queue.qsize())
+            for wait, _ in entries:
+                self.metrics.on_queue_wait("batch", wait)
+        if not entries:
+            return []
+        if self.scheduler is None:
+            return await self.send_batch([req_obj for _, req_obj in entries])
+        return await self._schedule_batch(entries)
+
+    async def _schedule_batch(
+        self, entries: List[Tuple[float, Dict[str, Any]]]
+    ) -> List[Union[Any, Aria2rpcException]]:
+        """
+        在队列中等待超过期限的只读请求直接失败 剩下的作为一个batch经过调度器发送
+        batch的优先级取其中最低的
+        """
+        scheduler: RequestScheduler = self.scheduler  # type: ignore
+        results: List[Any] = [None] * len(entries)
+        send: List[Tuple[int, Dict[str, Any]]] = []
+        priority = None
+        for i, (wait, req_obj) in enumerate(entries):
+            idempotent = _is_idempotent(req_obj)
+            req_priority = scheduler.priority_of(req_obj, idempotent)
+            deadline = scheduler.deadlines.get(req_priority)
+            if idempotent and deadline is not None and wait > deadline:
+                scheduler.record_dropped(req_priority)
+                results[i] = Aria2rpcException(
+                    f"request dropped after waiting {wait:.3f}s in the batch queue"
+                )
+                continue
+            send.append((i, req_obj))
+            priority = req_priority if priority is None else max(priority, req_priority)
+        if send:
+            await scheduler.acquire(
+                priority, sum(_call_count(r) for _, r in send)  # type: ignore
+            )
+            try:
+                sent = await self.send_batch([req_obj for _, req_obj in send])
+            finally:
+                scheduler.release(priority)  # type: ignore
+            for (i, _), result in zip(send, sent):
+                results[i] = result
         return results
 
     async def addUri(
@@ -684,8 +1191,8 @@ class _Aria2BaseClient:
         :param position: 参考addTorrent方法
         :return:包含结果的json   gid
         """
-        torrent = await b64encode_file(path)
-        return await self.addTorrent(torrent, uris, options, position)
+        params = add_options_and_position([uris or []], options, position)
+        return await self._add_file("addTorrent", path, params)
 
     async def add_metalink(
         self, path, options: Dict[str, Any] = None, position: int = None
@@ -697,8 +1204,188 @@ class _Aria2BaseClient:
         :param position: 参考addMetalink方法
         :return:
         """
-        metalink = await b64encode_file(path)
-        return await self.addMetalink(metalink, options, position)  # type: ignore
+        params = add_options_and_position([], options, position)
+        return await self._add_file("addMetalink", path, params)
+
+    async def add_torrents(
+        self,
+        paths: Union[Iterable[str], AsyncIterable[str]],
+        uris: List[str] = None,
+        options: Dict[str, Any] = None,
+        workers: int = 4,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        max_calls: int = 100,
+        queue_size: int = None,
+        in_flight: int = 2,
+    ) -> AsyncGenerator[Union[str, Aria2rpcException], None]:
+        """
+        批量添加种子 按输入顺序逐个产出gid 失败的种子产出Aria2rpcException而不是抛出
+        文件在线程池中读取和编码 按编码后的大小打包成system.multicall
+        请求直接发送 不受mode和coalesce_window影响
+        :param paths: 种子路径 可以是异步迭代器
+        :param uris: 参考addTorrent方法 对所有种子相同
+        :param options: 参考addTorrent方法 对所有种子相同
+        :param workers: 读取文件的线程数
+        :param batch_bytes: 一个multicall的大致字节数上限 超过单个请求上限的种子单独发送
+        :param max_calls: 一个multicall最多包含的种子数
+        :param queue_size: 最多有多少个已编码的文件在内存中等待发送 默认为workers*4
+        :param in_flight: 最多同时在途的multicall数
+        """
+        params = add_options_and_position([uris or []], options)
+        async for result in self._add_files(
+            "aria2.addTorrent",
+            paths,
+            params,
+            workers,
+            batch_bytes,
+            max_calls,
+            queue_size,
+            in_flight,
+        ):
+            yield result
+
+    async def add_metalinks(
+        self,
+        paths: Union[Iterable[str], AsyncIterable[str]],
+        options: Dict[str, Any] = None,
+        workers: int = 4,
+        batch_bytes: int = DEFAULT_BATCH_BYTES,
+        max_calls: int = 100,
+        queue_size: int = None,
+        in_flight: int = 2,
+    ) -> AsyncGenerator[Union[List[str], Aria2rpcException], None]:
+        """
+        批量添加metalink 每个输入产出一个gid列表 参数参考add_torrents
+        """
+        params = add_options_and_position([], options)
+        async for result in self._add_files(
+            "aria2.addMetalink",
+            paths,
+            params,
+            workers,
+            batch_bytes,
+            max_calls,
+            queue_size,
+            in_flight,
+        ):
+            yield result
+
+    async def _add_files(
+        self,
+        method: str,
+        paths: Union[Iterable[str], AsyncIterable[str]],
+        params: List[Any],
+        workers: int,
+        batch_bytes: int,
+        max_calls: int,
+        queue_size: Optional[int],
+        in_flight: int,
+    ) -> AsyncGenerator[Any, None]:
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(workers)
+        # 有界队列 读取速度超过发送速度时暂停读取
+        queue: asyncio.Queue = asyncio.Queue(queue_size or workers * 4)
+        overhead = len(self.codec.dumps(params)) + len(method) + 64
+        failure: List[BaseException] = []
+
+        async def produce() -> None:
+            try:
+                if hasattr(paths, "__aiter__"):
+                    async for path in paths:  # type: ignore
+                        await queue.put(
+                            loop.run_in_executor(executor, read_b64encode_file, path)
+                        )
+                else:
+                    for path in paths:  # type: ignore
+                        await queue.put(
+                            loop.run_in_executor(executor, read_b64encode_file, path)
+                        )
+            except Exception as err:
+                failure.append(err)
+            await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        # (multicall任务, 每个输入对应的结果下标或者异常)
+        batches: Deque[Tuple[Optional[asyncio.Task], List[Any]]] = deque()
+        pending: Optional[str] = None  # 上一批放不下的文件
+        exhausted = False
+        try:
+            while not exhausted or pending is not None or batches:
+                calls: List[Dict[str, Any]] = []
+                slots: List[Any] = []
+                size = 0
+                while len(calls) < max_calls:
+                    if pending is None:
+                        if exhausted:
+                            break
+                        future = await queue.get()
+                        if future is None:
+                            exhausted = True
+                            break
+                        try:
+                            pending = await future
+                        except OSError as err:
+                            slots.append(Aria2rpcException(str(err)))
+                            continue
+                    cost = len(pending) + overhead  # type: ignore
+                    if calls and size + cost > batch_bytes:
+                        break
+                    calls.append({"methodName": method, "params": [pending, *params]})
+                    slots.append(len(calls) - 1)
+                    size += cost
+                    pending = None
+                if slots:
+                    task = (
+                        asyncio.create_task(self._send_calls(calls)) if calls else None
+                    )
+                    batches.append((task, slots))
+                while batches and (
+                    len(batches) >= in_flight or (exhausted and pending is None)
+                ):
+                    task, slots = batches.popleft()
+                    results = await task if task is not None else []
+                    for slot in slots:
+                        if isinstance(slot, Exception):
+                            yield slot
+                        elif isinstance(results, Exception):
+                            yield results
+                        elif isinstance(results[slot], list):
+                            yield results[slot][0]
+                        else:  # {'faultCode':1,'faultString':'...'}
+                            yield Aria2rpcException(
+                                results[slot].get("faultString")
+                                or f"unexpected result: {results[slot]}"
+                            )
+            if failure:
+                raise failure[0]
+        finally:
+            producer.cancel()
+            for task, _ in batches:
+                if task is not None:
+                    task.cancel()
+            # 提前退出时 还没开始读的文件不再读取
+            while not queue.empty():
+                future = queue.get_nowait()
+                if future is not None:
+                    future.cancel()
+            if sys.version_info >= (3, 9):
+                executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                executor.shutdown(wait=False)
+
+    async def _send_calls(self, calls: List[Dict[str, Any]]) -> Any:
+        """
+        直接发送一个system.multicall 失败时返回异常而不是抛出
+        """
+        try:
+            req_obj = await self._build_request("multicall", [calls], "system.")
+            if self.metrics is None and self.scheduler is None:
+                return await self.send_request(req_obj)
+            return await self._dispatch(
+                req_obj, send=lambda: self.send_request(req_obj)
+            )
+        except Exception as err:
+            return err
 
     async def get_status(self, gid: str) -> Dict[str, str]:
         """
@@ -734,7 +1421,285 @@ class _Aria2BaseClient:
             for gid in gids:
                 yield "error"
 
+    async def snapshot(
+        self,
+        gids: Iterable[str],
+        keys: Optional[List[str]] = None,
+        global_stat: bool = False,
+        chunk_size: int = SNAPSHOT_CHUNK_SIZE,
+    ) -> Snapshot:
+        """
+        用一次system.multicall取得多个下载的状态 不经过batch和合并
+        gid很多时拆成多个multicall并发发送 每个最多chunk_size个gid
+        调用的json片段按keys缓存 每次只需要拼接gid
+        :param gids: 要查询的gid 重复的只查询一次
+        :param keys: 参考tellStatus None表示全部字段
+        :param global_stat: 同时取得getGlobalStat
+        :param chunk_size: 一个multicall最多包含的gid数
+        :return: 不存在的gid等错误放在errors中
+        """
+        gids = list(dict.fromkeys(gids))
+        if not gids and not global_stat:
+            return Snapshot({}, {})
+        prefix, suffix, stat_call = self._snapshot_templates(keys)
+        chunks = [
+            gids[i : i + chunk_size] for i in range(0, len(gids), chunk_size)
+        ] or [[]]
+        results = await asyncio.gather(
+            *[
+                self._send_snapshot(
+                    chunk, prefix, suffix, stat_call if global_stat and not i else None
+                )
+                for i, chunk in enumerate(chunks)
+            ]
+        )
+        statuses: Dict[str, Dict[str, Any]] = {}
+        errors: Dict[str, Aria2rpcException] = {}
+        stat = None
+        if global_stat:
+            item = results[0][-1] if results[0] else None
+            if isinstance(item, list):
+                stat = item[0]
+            else:
+                errors[SNAPSHOT_GLOBAL_STAT] = _fault(item)
+        for chunk, result in zip(chunks, results):
+            for gid, item in zip(chunk, result):
+                if isinstance(item, list):
+                    statuses[gid] = item[0]
+                else:
+                    errors[gid] = _fault(item)
+        return Snapshot(statuses, errors, stat)
+
+    def _snapshot_templates(
+        self, keys: Optional[List[str]]
+    ) -> Tuple[bytes, bytes, bytes]:
+        """
+        tellStatus调用在gid前后的json片段 以及完整的getGlobalStat调用
+        """
+        cache_key = (None, self.token, tuple(keys) if keys is not None else None)
+        templates = self._templates.get(cache_key)
+        if templates is not None:
+            return templates
+        dumps = self.codec.dumps
+        token = dumps(f"token:{self.token}") + b"," if self.token is not None else b""
+        templates = (
+            b'{"methodName":"aria2.tellStatus","params":[' + token,
+            (b"," + dumps(keys) if keys else b"") + b"]}",
+            b'{"methodName":"aria2.getGlobalStat","params":['
+            + token.rstrip(b",")
+            + b"]}",
+        )
+        if len(self._templates) >= 256:  # 防止无限增长
+            self._templates.clear()
+        self._templates[cache_key] = templates
+        return templates
+
+    async def _send_snapshot(
+        self,
+        gids: List[str],
+        prefix: bytes,
+        suffix: bytes,
+        stat_call: Optional[bytes],
+    ) -> List[Any]:
+        start = time.perf_counter()
+        dumps = self.codec.dumps
+        calls = [
+            prefix
+            + (f'"{gid}"'.encode() if _is_plain_gid(gid) else dumps(gid))
+            + suffix
+            for gid in gids
+        ]
+        if stat_call is not None:
+            calls.append(stat_call)
+        identity = self.identity()
+        if asyncio.iscoroutine(identity):
+            identity = await identity
+        payload = b"".join(
+            (
+                b'{"jsonrpc":"2.0","id":',
+                str(identity).encode() if type(identity) is int else dumps(identity),
+                b',"method":"system.multicall","params":[[',
+                b",".join(calls),
+                b"]]}",
+            )
+        )
+        # 只用于id和判断能否重发
+        req_obj = {
+            "jsonrpc": "2.0",
+            "id": identity,
+            "method": "system.multicall",
+            "params": [
+                [_TELL_STATUS_CALL] * len(gids)
+                + [_GLOBAL_STAT_CALL] * (stat_call is not None)
+            ],
+        }
+        if not self._send_encoded_directly:
+            req_obj = self.codec.loads(payload)
+            if self.metrics is None and self.scheduler is None:
+                return await self.send_request(req_obj)
+            return await self._dispatch(
+                req_obj, send=lambda: self.send_request(req_obj)
+            )
+        if self.metrics is None and self.scheduler is None:
+            return await self._send_encoded(req_obj, payload)
+        if self.metrics is not None:
+            self.metrics.on_encode(
+                "system.multicall", len(payload), time.perf_counter() - start
+            )
+        return await self._dispatch(req_obj, payload)
+
+    async def status_record(self, gid: str, keys: List[str] = None) -> DownloadStatus:
+        """
+        tellStatus的类型化版本 数字字段在访问时才转换
+        :param gid: 参考tellStatus
+        :param keys: 参考tellStatus
+        """
+        return DownloadStatus.from_dict(await self.tellStatus(gid, keys))
+
+    async def active_records(self, keys: List[str] = None) -> List[DownloadStatus]:
+        """
+        tellActive的类型化版本
+        """
+        return DownloadStatus.from_list(await self.tellActive(keys))
+
+    async def file_records(self, gid: str) -> List[FileInfo]:
+        """
+        getFiles的类型化版本
+        """
+        return FileInfo.from_list(await self.getFiles(gid))
+
+    async def peer_records(self, gid: str) -> List[PeerInfo]:
+        """
+        getPeers的类型化版本
+        """
+        return PeerInfo.from_list(await self.getPeers(gid))
+
+    async def global_stat_record(self) -> GlobalStat:
+        """
+        getGlobalStat的类型化版本
+        """
+        return GlobalStat.from_dict(await self.getGlobalStat())
+
+    async def iter_waiting(
+        self,
+        keys: List[str] = None,
+        page_size: int = 100,
+        min_page_size: int = 10,
+        max_page_size: int = 1000,
+        target_latency: Optional[float] = 0.1,
+        prefetch: bool = False,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        分页遍历等待队列 是一个异步生成器 参数参考_paginate
+        """
+        async for status in self._paginate(
+            "tellWaiting",
+            keys,
+            page_size,
+            min_page_size,
+            max_page_size,
+            target_latency,
+            prefetch,
+        ):
+            yield status
+
+    async def iter_stopped(
+        self,
+        keys: List[str] = None,
+        page_size: int = 100,
+        min_page_size: int = 10,
+        max_page_size: int = 1000,
+        target_latency: Optional[float] = 0.1,
+        prefetch: bool = False,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        分页遍历已停止的下载 是一个异步生成器 参数参考_paginate
+        """
+        async for status in self._paginate(
+            "tellStopped",
+            keys,
+            page_size,
+            min_page_size,
+            max_page_size,
+            target_latency,
+            prefetch,
+        ):
+            yield status
+
+    async def _paginate(
+        self,
+        method: str,
+        keys: Optional[List[str]],
+        page_size: int,
+        min_page_size: int,
+        max_page_size: int,
+        target_latency: Optional[float],
+        prefetch: bool,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        逐页调用tellWaiting/tellStopped 避免一次返回巨大的json阻塞事件循环
+        遍历期间队列发生变化时 可能重复或遗漏个别下载
+        :param method: tellWaiting或tellStopped
+        :param keys: 参考tellStatus
+        :param page_size: 第一页的大小
+        :param min_page_size: 页大小下限
+        :param max_page_size: 页大小上限
+        :param target_latency: 每页期望的耗时(秒 包含解析) 根据实际耗时调整下一页大小 None表示固定页大小
+        :param prefetch: 在调用者处理当前页时并发请求下一页
+        """
+
+        async def fetch(offset: int, num: int) -> Tuple[List[Dict[str, Any]], float]:
+            params: List[Any] = [offset, num]
+            if keys:
+                params.append(keys)
+            start = time.perf_counter()
+            page = await self.jsonrpc(method, params)
+            return page, time.perf_counter() - start  # type: ignore
+
+        offset = 0
+        size = page_size
+        pending: Optional[asyncio.Task] = None
+        try:
+            while True:
+                if pending is not None:
+                    page, elapsed = await pending
+                    pending = None
+                else:
+                    page, elapsed = await fetch(offset, size)
+                more = len(page) >= size
+                offset += len(page)
+                if target_latency and elapsed > 0:
+                    # 每次最多放大或缩小一倍 防止抖动
+                    scale = min(2.0, max(0.5, target_latency / elapsed))
+                    size = max(min_page_size, min(max_page_size, int(size * scale)))
+                if more and prefetch:
+                    pending = asyncio.create_task(fetch(offset, size))
+                for status in page:
+                    yield status
+                if not more:
+                    return
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def _cancel_coalesced(self) -> None:
+        """
+        让窗口内还没发出的请求失败 取消已经发出的batch并等待它们结束
+        """
+        if self._coalesce_handle is not None:
+            self._coalesce_handle.cancel()
+            self._coalesce_handle = None
+        pending, self._coalesced = self._coalesced, []
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(Aria2rpcException("client closed"))
+        tasks = list(self._coalesce_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
     async def close(self) -> None:
+        await self._cancel_coalesced()
         await self.client_session.close()  # type: ignore
 
 
@@ -747,6 +1712,11 @@ class Aria2HttpClient(_Aria2BaseClient):
         token: str = None,
         queue=None,
         client_session: aiohttp.ClientSession = None,
+        coalesce_window: Optional[float] = None,
+        coalesce_max: int = 100,
+        codec: JsonCodec = None,
+        metrics: Optional[MetricsHooks] = None,
+        scheduler: Optional[RequestScheduler] = None,
         **kw,
     ):
         """
@@ -758,38 +1728,90 @@ class Aria2HttpClient(_Aria2BaseClient):
             format - 返回rpc请求json结构
         :param token: rpc服务器密码 (用 `--rpc-secret`设置)
         :param queue: 请求队列
-        :param client_session: aiohttp的session
+        :param client_session: 共用的aiohttp session 由传入者负责关闭 None时自己创建并在close()时关闭
+        :param coalesce_window: 合并请求的时间窗口 参考_Aria2BaseClient
+        :param coalesce_max: 一个batch最多合并的请求数
+        :param codec: json编解码器 默认自动选择 参考aioaria2.codec
+        :param metrics: 指标钩子 参考aioaria2.metrics
+        :param scheduler: 请求调度器 参考aioaria2.scheduler
         :param kw: aiohttp.session.post的相关参数
             new in v1.3.1 loads: DEFAULT_JSON_DECODER   json.loads
             dumps json.dumps
-        """
-        super().__init__(url, identity, mode, token, queue)
+            new in v1.3.7 推荐使用codec参数代替loads dumps
+        """
+        super().__init__(
+            url,
+            identity,
+            mode,
+            token,
+            queue,
+            coalesce_window,
+            coalesce_max,
+            metrics,
+            scheduler,
+        )
         self.kw = kw
-        self.loads = (
-            self.kw.pop("loads") if "loads" in self.kw else DEFAULT_JSON_DECODER
-        )  # json serialize
-        self.dumps = (
-            self.kw.pop("dumps") if "dumps" in self.kw else DEFAULT_JSON_ENCODER
+        self.codec = instrument_codec(
+            get_codec(codec, self.kw.pop("loads", None), self.kw.pop("dumps", None)),
+            metrics,
         )
-        self.client_session = client_session or aiohttp.ClientSession(
-            json_serialize=self.dumps
-        )  # aiohttp的会话
+        self.headers = {
+            **(self.kw.pop("headers", None) or {}),
+            "Content-Type": "application/json",
+        }
+        self.client_session = client_session or aiohttp.ClientSession()  # aiohttp的会话
+        self._owns_session = client_session is None  # 只关闭自己创建的session
 
-    async def send_request(self, req_obj: Dict[str, Any]) -> Union[Dict[str, Any], Any]:
+    async def _post(self, payload: Any, headers: Dict[str, str] = None) -> Any:
+        """
+        发送编码好的请求体 返回解码后的响应
+        """
         try:
             async with self.client_session.post(
-                self.url, json=req_obj, **self.kw
+                self.url, data=payload, headers=headers or self.headers, **self.kw
             ) as response:
-                try:
-                    data = self.loads(await response.text())
-                    return data["result"]
-                except KeyError:
-                    raise Aria2rpcException(f"unexpected result: {data}")
+                return self.codec.loads(await response.read())
         except aiohttp.ClientConnectionError as err:
             raise Aria2rpcException(
                 str(err), connection_error=("Cannot connect" in str(err))
             ) from err
 
+    async def send_request(self, req_obj: Dict[str, Any]) -> Union[Dict[str, Any], Any]:
+        return await self._send_encoded(req_obj, self.codec.dumps(req_obj))
+
+    async def _send_encoded(self, req_obj: Dict[str, Any], payload: bytes) -> Any:
+        data = await self._post(payload)
+        try:
+            return data["result"]
+        except KeyError:
+            raise Aria2rpcException(f"unexpected result: {data}")
+
+    async def _send_file_request(
+        self, req_obj: Dict[str, Any], prefix: bytes, path: str, suffix: bytes
+    ) -> Any:
+        # 请求体边读边编码边发送 长度事先算好 不使用chunked编码
+        # 文件大小变了就中断请求 不会发出与Content-Length不符的请求体
+        size = os.path.getsize(path)
+        length = len(prefix) + b64encoded_length(size) + len(suffix)
+        data = await self._post(
+            aiter_b64_payload(prefix, path, suffix, size=size),
+            {**self.headers, "Content-Length": str(length)},
+        )
+        try:
+            return data["result"]
+        except KeyError:
+            raise Aria2rpcException(f"unexpected result: {data}")
+
+    async def send_batch(
+        self, req_objs: List[Dict[str, Any]]
+    ) -> List[Union[Any, Aria2rpcException]]:
+        return unpack_batch(req_objs, await self._post(self.codec.dumps(req_objs)))
+
+    async def close(self) -> None:
+        await self._cancel_coalesced()
+        if self._owns_session:
+            await self.client_session.close()
+
     async def __aenter__(self):
         return self
 
@@ -797,7 +1819,149 @@ class Aria2HttpClient(_Aria2BaseClient):
         await self.close()
 
 
-class Aria2WebsocketClient(_Aria2BaseClient):
+class _Aria2NotificationMixin:
+    """
+    aria2通知回调的注册接口 子类需要提供functions字典
+    """
+
+    functions: DefaultDict[str, List[CallBack]]
+    streams: List[EventStream]
+
+    def events(
+        self,
+        types: Optional[Iterable[str]] = None,
+        gids: Optional[Iterable[str]] = None,
+        maxsize: int = 1024,
+        overflow: Literal["drop_oldest", "coalesce", "block"] = "drop_oldest",
+    ) -> EventStream:
+        """
+        订阅通知 返回的流用async for消费 用完之后调用close或者用async with
+
+            async with client.events(types=["onDownloadComplete"]) as stream:
+                async for event in stream:
+                    ...
+
+        :param types: 只接收这些通知 可以省略aria2.前缀 None表示全部
+        :param gids: 只接收这些gid的通知 None表示全部
+        :param maxsize: 队列长度 超出时按overflow处理
+        :param overflow: 参考EventStream
+            drop_oldest - 丢弃最旧的通知
+            coalesce - 同一个gid只保留最新的通知
+            block - 暂停读取websocket 消费者处理通知时不能等待同一连接上的请求 否则会死锁
+        """
+        stream = EventStream(types, gids, maxsize, overflow, self.streams.remove)
+        self.streams.append(stream)
+        return stream
+
+    async def _publish(self, data: Dict[str, Any]) -> None:
+        """
+        把通知放入匹配的流 block策略的流满了会在这里等待
+        """
+        for stream in list(self.streams):  # 等待时流可能被关闭并移除
+            if stream.matches(data):
+                await stream.put(data)
+
+    def _close_streams(self) -> None:
+        for stream in list(self.streams):
+            stream.close()
+
+    async def _call_callbacks(self, data: Dict[str, Any]) -> None:
+        """
+        调用通知对应的回调 只有一个回调时不经过gather
+        """
+        callbacks = self.functions.get(data["method"])
+        if not callbacks:
+            return
+        if len(callbacks) == 1:
+            await callbacks[0](self, data)
+        else:
+            await asyncio.gather(*[func(self, data) for func in callbacks])
+
+    def register(self, func: CallBack, type_: str) -> None:
+        """
+        注册响应websocket的事件
+        :return:
+        """
+        self.functions[type_].append(func)
+
+    def unregister(self, func: CallBack, type_: str) -> None:
+        """
+        取消注册响应websocket的事件
+        :return:
+        """
+        try:
+            self.functions[type_].remove(func)
+        except ValueError:
+            pass
+
+    # ----------以下这些推荐作为装饰器使用---------------------
+
+    def onDownloadStart(self, func: CallBack) -> CallBack:
+        """
+        注册回调事件
+        func的第二个参数的task.result()型如{'jsonrpc': '2.0', 'method': 'aria2.onDownloadStart', 'params': [{'gid': '5de52dc4eba048ca'}]}
+        :param func:
+        :return:
+        """
+        self.register(func, "aria2.onDownloadStart")
+        return func
+
+    def onDownloadPause(self, func: CallBack) -> CallBack:
+        """
+        注册回调事件
+        :param func:
+        :return:
+        """
+        self.register(func, "aria2.onDownloadPause")
+        return func
+
+    def onDownloadStop(self, func: CallBack) -> CallBack:
+        """
+        注册回调事件
+        :param func:
+        :return:
+        """
+        self.register(func, "aria2.onDownloadStop")
+        return func
+
+    def onDownloadComplete(self, func: CallBack) -> CallBack:
+        """
+        注册回调事件
+        :param func:
+        :return:
+        """
+        self.register(func, "aria2.onDownloadComplete")
+        return func
+
+    def onDownloadError(self, func: CallBack) -> CallBack:
+        """
+        注册回调事件
+        :param func:
+        :return:
+        """
+        self.register(func, "aria2.onDownloadError")
+        return func
+
+    def onBtDownloadComplete(self, func: CallBack) -> CallBack:
+        """
+        注册回调事件
+        :param func:
+        :return:
+        """
+        self.register(func, "aria2.onBtDownloadComplete")
+        return func
+
+    def onReconnect(self, func: CallBack) -> CallBack:
+        """
+        注册回调事件 websocket断线重连成功并补发完错过的通知后调用
+        :param func:
+        :return:
+        """
+        self.register(func, RECONNECT_EVENT)
+        return func
+
+
+class Aria2WebsocketClient(_Aria2NotificationMixin, _Aria2BaseClient):
     def __init__(
         self,
         url: str,
@@ -807,6 +1971,18 @@ class Aria2WebsocketClient(_Aria2BaseClient):
         queue: asyncio.Queue = None,
         client_session: aiohttp.ClientSession = None,
         reconnect_interval: int = 1,
+        coalesce_window: Optional[float] = None,
+        coalesce_max: int = 100,
+        codec: JsonCodec = None,
+        auto_reconnect: bool = False,
+        max_reconnect_interval: float = 30.0,
+        replay: bool = True,
+        max_replays: int = 3,
+        resync: bool = False,
+        notification_workers: Optional[int] = None,
+        notification_coalesce: Optional[float] = None,
+        metrics: Optional[MetricsHooks] = None,
+        scheduler: Optional[RequestScheduler] = None,
         **kw,
     ):
         """
@@ -818,9 +1994,31 @@ class Aria2WebsocketClient(_Aria2BaseClient):
             format - 返回rpc请求json结构
         :param token: rpc服务器密码 (用 `--rpc-secret`设置)
         :param queue: 请求队列
+        :param client_session: 共用的aiohttp session 由传入者负责关闭 None时自己创建并在close()时关闭
+        :param coalesce_window: 合并请求的时间窗口 参考_Aria2BaseClient
+        :param coalesce_max: 一个batch最多合并的请求数
+        :param codec: json编解码器 默认自动选择 参考aioaria2.codec
+        :param auto_reconnect: 断线后自动重连 间隔从reconnect_interval开始指数增长并带有随机抖动
+            断线期间发起的请求会等待重连
+        :param max_reconnect_interval: 重连间隔的上限
+        :param replay: 断线或者超时时在途的只读请求(参考IDEMPOTENT_METHODS)重发 否则立即失败
+            其他请求总是立即失败 因为无法知道aria2是否已经执行
+        :param max_replays: 一个请求最多重发几次
+        :param resync: 记录每个下载的状态 重连后与aria2对比 为断线期间错过的状态变化补发通知
+            补发的通知带有"synthesized": True
+            启动和每次重连时都会取一次所有下载(包括已停止的)的状态 下载很多时开销较大 默认关闭
+        :param notification_workers: 用这么多个worker处理通知 同一个gid的通知按顺序处理
+            None表示每条通知创建一个任务 回调之间互不等待
+            worker的队列没有上限 回调一直跟不上时通知会在内存中堆积
+            需要有界队列和溢出策略时用events()消费通知
+        :param notification_coalesce: 同一个gid的同一种通知在这么多秒内只处理第一条
+            需要设置notification_workers
+        :param metrics: 指标钩子 参考aioaria2.metrics 还会记录在途的请求数 通知的处理延迟和重连次数
+        :param scheduler: 请求调度器 参考aioaria2.scheduler
         :param kw: ws_connect()的相关参数
             new in v1.3.1 loads: DEFAULT_JSON_DECODER   json.loads
             dumps json.dumps
+            new in v1.3.7 推荐使用codec参数代替loads dumps
         """
         if (stack()[1].function) not in ("new", "eval_in_context"):
             warnings.warn(
@@ -829,23 +2027,57 @@ class Aria2WebsocketClient(_Aria2BaseClient):
                 )
             )
 
-        super().__init__(url, identity, mode, token, queue)
+        super().__init__(
+            url,
+            identity,
+            mode,
+            token,
+            queue,
+            coalesce_window,
+            coalesce_max,
+            metrics,
+            scheduler,
+        )
         self.kw = kw
-        self.loads = (
-            self.kw.pop("loads") if "loads" in self.kw else DEFAULT_JSON_DECODER
-        )  # json serialize
-        self.dumps = (
-            self.kw.pop("dumps") if "dumps" in self.kw else DEFAULT_JSON_ENCODER
+        self.codec = instrument_codec(
+            get_codec(codec, self.kw.pop("loads", None), self.kw.pop("dumps", None)),
+            metrics,
         )
-        self._client_session = client_session or aiohttp.ClientSession(
-            json_serialize=self.dumps
+        if _WS_DECODE_TEXT and self.codec.accepts_bytes:
+            self.kw.setdefault("decode_text", False)  # 收到的文本帧保持bytes 直接交给codec
+        self._client_session = (
+            client_session or aiohttp.ClientSession()
         )  # type: aiohttp.ClientSession
+        self._owns_session = client_session is None  # 只关闭自己创建的session
         self.reconnect_interval = reconnect_interval
         self.functions: DefaultDict[str, List[CallBack]] = defaultdict(
             list
         )  # 存放各个notice的回调
+        self.streams: List[EventStream] = []  # events()返回的通知流
         self._listen_task = None  # type: asyncio.Task
         self._pending_tasks = set()
+        # 子类覆盖了handle_event时响应也交给它 和以前一样
+        self._responses_to_handler = (
+            type(self).handle_event is not Aria2WebsocketClient.handle_event
+        )
+        self.auto_reconnect = auto_reconnect
+        self.max_reconnect_interval = max_reconnect_interval
+        self.replay = replay
+        self.max_replays = max_replays
+        self.resync = resync
+        self.reconnects = 0  # 自动重连成功的次数
+        self._connected = asyncio.Event()
+        self._closing = False
+        self._statuses: Optional[Dict[str, str]] = None  # gid -> status
+        self._notified: Optional[Set[str]] = None  # 重连后已经收到真实通知的gid
+        self._dispatcher: Optional[NotificationDispatcher] = None
+        if notification_workers is not None:
+            self._dispatcher = NotificationDispatcher(
+                lambda data: self.handle_event(data),  # 运行时查找 允许替换handle_event
+                notification_workers,
+                notification_coalesce,
+                metrics.on_dispatch_lag if metrics is not None else None,
+            )
 
     @classmethod
     async def new(
@@ -857,6 +2089,18 @@ class Aria2WebsocketClient(_Aria2BaseClient):
         queue: asyncio.Queue = None,
         client_session: aiohttp.ClientSession = None,
         reconnect_interval: int = 1,
+        coalesce_window: Optional[float] = None,
+        coalesce_max: int = 100,
+        codec: JsonCodec = None,
+        auto_reconnect: bool = False,
+        max_reconnect_interval: float = 30.0,
+        replay: bool = True,
+        max_replays: int = 3,
+        resync: bool = False,
+        notification_workers: Optional[int] = None,
+        notification_coalesce: Optional[float] = None,
+        metrics: Optional[MetricsHooks] = None,
+        scheduler: Optional[RequestScheduler] = None,
         **kw,
     ) -> "Aria2WebsocketClient":
         """
@@ -878,50 +2122,228 @@ class Aria2WebsocketClient(_Aria2BaseClient):
                 queue,
                 client_session,
                 reconnect_interval,
+                coalesce_window,
+                coalesce_max,
+                codec,
+                auto_reconnect,
+                max_reconnect_interval,
+                replay,
+                max_replays,
+                resync,
+                notification_workers,
+                notification_coalesce,
+                metrics,
+                scheduler,
                 **kw,
             )
-            self.client_session = await self._client_session.ws_connect(
-                self.url, **self.kw
-            )
-            self._listen_task = asyncio.create_task(self.listen())
+            await self._start()
             return self
         except aiohttp.ClientError as err:
-            await self._client_session.close()
+            if self._owns_session:
+                await self._client_session.close()
             raise Aria2rpcException(
                 str(err), connection_error=("Cannot connect" in str(err))
             ) from err
 
     async def send_request(self, req_obj: Dict[str, Any]) -> Union[Dict[str, Any], str, NoReturn]:  # type: ignore
+        return await self._send_request(req_obj)
+
+    async def _send_file_request(
+        self, req_obj: Dict[str, Any], prefix: bytes, path: str, suffix: bytes
+    ) -> Any:
+        # 整个帧在线程池中一次写进预先分配的内存
+        payload = await asyncio.get_running_loop().run_in_executor(
+            None, build_b64_payload, prefix, path, suffix
+        )
+        return await self._send_request(req_obj, payload)
+
+    async def _send_encoded(self, req_obj: Dict[str, Any], payload: bytes) -> Any:
+        return await self._send_request(req_obj, payload)
+
+    async def _send_request(
+        self, req_obj: Dict[str, Any], payload: Optional[bytes] = None
+    ) -> Any:
+        """
+        :param payload: 已经编码好的请求 为None时编码req_obj
+        """
+        if self.metrics is not None:
+            self.metrics.on_pending(1)
+            try:
+                return await self._do_send_request(req_obj, payload)
+            finally:
+                self.metrics.on_pending(-1)
+        return await self._do_send_request(req_obj, payload)
+
+    async def _do_send_request(
+        self, req_obj: Dict[str, Any], payload: Optional[bytes] = None
+    ) -> Any:
+        identity = req_obj["id"]
+        replays = 0
+        while True:
+            self._results.register(identity)  # 先登记再发送 响应不会早于future到达
+            try:
+                await self._send_payload(
+                    self.codec.dumps(req_obj) if payload is None else payload
+                )
+            except Exception as err:
+                self._results.discard(identity)
+                if self._can_resend(err, replays):
+                    replays += 1  # 没有发出去 任何请求都可以重发
+                    continue
+                if isinstance(err, Aria2rpcException):
+                    raise
+                raise Aria2rpcException(
+                    str(err), connection_error=("Cannot connect" in str(err))
+                ) from err
+            try:
+                data = await self._results.fetch(
+                    identity, self.kw.get("timeout", None) or 10.0
+                )
+                return data["result"]
+            except KeyError:  # 'error':xxx
+                raise Aria2rpcException(f"unexpected result: {data}")
+            except Aria2rpcException as err:
+                if (
+                    err.connection_error
+                    and replays < self.max_replays
+                    and self._replayable(req_obj)
+                ):
+                    replays += 1
+                    continue
+                if (
+                    not self.closed
+                    and "timeout" in err.msg
+                    and replays < self.max_replays
+                    and self._replayable(req_obj)
+                ):
+                    # 超时的请求可能已经被执行 只重发只读请求
+                    replays += 1
+                    await asyncio.sleep(self.reconnect_interval)
+                    continue
+                raise
+
+    def _replayable(self, req_obj: Dict[str, Any]) -> bool:
+        """
+        断线时在途的请求能否重发
+        """
+        return (
+            self.auto_reconnect
+            and self.replay
+            and not self._closing
+            and _is_idempotent(req_obj)
+        )
+
+    def _can_resend(self, err: Exception, replays: int) -> bool:
+        """
+        发送时连接已经断开 请求没有到达aria2
+        """
+        return (
+            self.auto_reconnect
+            and not self._closing
+            and replays < self.max_replays
+            and isinstance(err, (ConnectionError, aiohttp.ClientConnectionError))
+        )
+
+    async def _send_payload(self, payload: bytes) -> None:
+        """
+        把编码好的请求作为文本帧发送 重连期间先等待连接恢复
+        """
+        if self.auto_reconnect and not self._connected.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._connected.wait(), self.kw.get("timeout", None) or 10.0
+                )
+            except asyncio.TimeoutError:
+                raise Aria2rpcException(
+                    "websocket reconnect timeout", connection_error=True
+                ) from None
+        if self._closing:
+            raise Aria2rpcException("client closed", connection_error=True)
+        if _WS_SEND_FRAME:
+            await self.client_session.send_frame(payload, aiohttp.WSMsgType.TEXT)
+        else:
+            await self.client_session.send_str(payload.decode(JSON_ENCODING))
+
+    async def send_batch(
+        self, req_objs: List[Dict[str, Any]]
+    ) -> List[Union[Any, Aria2rpcException]]:
+        results = await self._send_batch_once(req_objs)
+        for _ in range(self.max_replays):
+            retry = [
+                i
+                for i, result in enumerate(results)
+                if isinstance(result, Aria2rpcException)
+                and result.connection_error
+                and self._replayable(req_objs[i])
+            ]
+            if not retry:
+                break
+            try:
+                replayed = await self._send_batch_once([req_objs[i] for i in retry])
+            except Aria2rpcException as err:
+                replayed = [err] * len(retry)
+            for i, result in zip(retry, replayed):
+                results[i] = result
+        return results
+
+    async def _send_batch_once(
+        self, req_objs: List[Dict[str, Any]]
+    ) -> List[Union[Any, Aria2rpcException]]:
+        if self.metrics is not None:
+            self.metrics.on_pending(len(req_objs))
+            try:
+                return await self._do_send_batch(req_objs)
+            finally:
+                self.metrics.on_pending(-len(req_objs))
+        return await self._do_send_batch(req_objs)
+
+    async def _do_send_batch(
+        self, req_objs: List[Dict[str, Any]]
+    ) -> List[Union[Any, Aria2rpcException]]:
+        for req_obj in req_objs:
+            self._results.register(req_obj["id"])
         try:
-            await self.client_session.send_json(req_obj, dumps=self.dumps)
-            data = await ResultStore.fetch(
-                req_obj["id"], self.kw.get("timeout", None) or 10.0
-            )
-            return data["result"]
-        except KeyError:  # 'error':xxx
-            raise Aria2rpcException(f"unexpected result: {data}")
-        except Aria2rpcException as err:
-            if not self.closed and "timeout" in err.msg:
-                await asyncio.sleep(self.reconnect_interval)
-                return await self.send_request(req_obj)
+            await self._send_payload(self.codec.dumps(req_objs))
         except Exception as err:
+            for req_obj in req_objs:
+                self._results.discard(req_obj["id"])
+            if isinstance(err, Aria2rpcException):
+                raise
             raise Aria2rpcException(
                 str(err), connection_error=("Cannot connect" in str(err))
             ) from err
+        timeout = self.kw.get("timeout", None) or 10.0
+        responses = await asyncio.gather(
+            *[self._results.fetch(req_obj["id"], timeout) for req_obj in req_objs],
+            return_exceptions=True,
+        )
+        results = unpack_batch(
+            req_objs, [r for r in responses if not isinstance(r, BaseException)]
+        )
+        return [
+            r if isinstance(r, BaseException) else results[i]
+            for i, r in enumerate(responses)
+        ]
 
     @property
     def closed(self) -> bool:
         return self.client_session.closed
 
     async def close(self) -> None:
+        self._closing = True
+        self._connected.set()  # 唤醒等待重连的请求
         if self._listen_task and not self._listen_task.cancelled():
             self._listen_task.cancel()
             try:
                 await self._listen_task
             except asyncio.CancelledError:
                 pass
+        if self._dispatcher is not None:
+            await self._dispatcher.close()
+        self._close_streams()
         await super().close()
-        await self._client_session.close()
+        if self._owns_session:
+            await self._client_session.close()
 
     async def listen(self) -> None:
         """
@@ -929,119 +2351,443 @@ class Aria2WebsocketClient(_Aria2BaseClient):
         """
         try:
             while not self.closed:
-                try:
-                    data = await self.client_session.receive_json(loads=self.loads)
-                except TypeError:  # aria2抽了
+                msg = await self.client_session.receive()
+                if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                    try:
+                        data = self.codec.loads(msg.data)
+                    except Exception:  # aria2抽了
+                        continue
+                elif msg.type in _WS_CLOSING:
+                    break
+                else:
+                    continue
+                if isinstance(data, list):
+                    # jsonrpc batch的响应 只会包含结果 直接交给请求表
+                    for item in data:
+                        if isinstance(item, dict):
+                            self._results.add_result(item)
                     continue
                 if not data or not isinstance(data, dict):
                     continue
-                task = asyncio.create_task(self.handle_event(data))
+                if "method" not in data:
+                    if self._responses_to_handler:
+                        task = asyncio.create_task(self.handle_event(data))
+                        self._pending_tasks.add(task)
+                        task.add_done_callback(self._pending_tasks.discard)
+                        continue
+                    # 响应只需要完成对应的future 不必创建任务
+                    self._results.add_result(data)
+                    continue
+                if self._statuses is not None:
+                    self._track(data)
+                if self.streams:
+                    await self._publish(data)
+                if self._dispatcher is not None:
+                    self._dispatcher.put_nowait(data)
+                    continue
+                if self.metrics is not None:
+                    task = asyncio.create_task(
+                        self._handle_measured(data, time.perf_counter())
+                    )
+                else:
+                    task = asyncio.create_task(self.handle_event(data))
                 self._pending_tasks.add(task)  # add a strong ref
                 task.add_done_callback(self._pending_tasks.discard)
         except asyncio.CancelledError:
             pass
+        finally:
+            # 连接断了 还在等待的请求不会再有响应了
+            self._results.fail_all(
+                Aria2rpcException("websocket connection closed", connection_error=True)
+            )
+
+    async def _handle_measured(self, data: Dict[str, Any], received: float) -> None:
+        self.metrics.on_dispatch_lag(  # type: ignore
+            data["method"], time.perf_counter() - received
+        )
+        await self.handle_event(data)
+
+    async def _connect(self) -> None:
+        self.client_session = await self._client_session.ws_connect(self.url, **self.kw)
+        self._connected.set()
+
+    async def _start(self) -> None:
+        await self._connect()
+        if self._dispatcher is not None:
+            self._dispatcher.start()
+        self._listen_task = asyncio.create_task(self._run())
+        if self.auto_reconnect and self.resync:
+            try:
+                self._statuses = await self._fetch_statuses()
+            except Aria2rpcException:
+                pass  # 第一次重连后再开始记录
+
+    async def _run(self) -> None:
+        """
+        监听连接 开启auto_reconnect时断线后自动重连
+        """
+        while True:
+            await self.listen()
+            self._connected.clear()
+            if not self.auto_reconnect or self._closing:
+                return
+            previous = None if self._statuses is None else dict(self._statuses)
+            if not await self._reconnect():
+                return
+            self.reconnects += 1
+            if self.metrics is not None:
+                self.metrics.on_reconnect()
+            if self.resync:
+                self._notified = set()
+            task = asyncio.create_task(self._after_reconnect(previous))
+            self._pending_tasks.add(task)  # add a strong ref
+            task.add_done_callback(self._pending_tasks.discard)
+
+    async def _reconnect(self) -> bool:
+        """
+        指数退避重连 直到成功或者客户端被关闭
+        """
+        attempt = 0
+        while not self._closing:
+            delay = min(
+                self.max_reconnect_interval,
+                self.reconnect_interval * 2 ** min(attempt, 32),
+            )
+            await asyncio.sleep(random.uniform(delay / 2, delay))  # 抖动 避免一起重连
+            attempt += 1
+            try:
+                await self._connect()
+                return True
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError):
+                continue
+        return False
+
+    async def _after_reconnect(self, previous: Optional[Dict[str, str]]) -> None:
+        if self.resync:
+            try:
+                await self._resync(previous)
+            except Aria2rpcException:
+                pass
+            finally:
+                self._notified = None
+        await self._notify({"jsonrpc": "2.0", "method": RECONNECT_EVENT, "params": []})
+
+    async def _notify(self, data: Dict[str, Any]) -> None:
+        """
+        不是从websocket收到的通知 同样交给通知流和回调
+        """
+        if self.streams:
+            await self._publish(data)
+        await self.handle_event(data)
+
+    async def _fetch_statuses(self) -> Dict[str, str]:
+        """
+        用一次multicall取得所有下载的状态 不经过batch和合并
+        """
+        token = [f"token:{self.token}"] if self.token is not None else []
+        keys = [["gid", "status"]]
+        calls = [
+            {"methodName": "aria2.tellActive", "params": [*token, *keys]},
+            {
+                "methodName": "aria2.tellWaiting",
+                "params": [*token, 0, MAX_RESULTS, *keys],
+            },
+            {
+                "methodName": "aria2.tellStopped",
+                "params": [*token, 0, MAX_RESULTS, *keys],
+            },
+        ]
+        identity = self.identity()
+        if asyncio.iscoroutine(identity):
+            identity = await identity
+        req_obj = {
+            "jsonrpc": "2.0",
+            "id": identity,
+            "method": "system.multicall",
+            "params": [calls],
+        }
+        if self.metrics is None and self.scheduler is None:
+            results = await self.send_request(req_obj)
+        else:
+            results = await self._dispatch(
+                req_obj, send=lambda: self.send_request(req_obj)
+            )
+        statuses = {}
+        for result in results:  # type: ignore
+            if isinstance(result, list):
+                for status in result[0]:
+                    statuses[status["gid"]] = status["status"]
+        return statuses
+
+    def _track(self, data: Dict[str, Any]) -> None:
+        status = _STATUS_BY_NOTIFICATION.get(data["method"])
+        if status is None:
+            return
+        for param in data.get("params", ()):
+            self._statuses[param["gid"]] = status  # type: ignore
+            if self._notified is not None:
+                self._notified.add(param["gid"])
+
+    async def _resync(self, previous: Optional[Dict[str, str]]) -> None:
+        """
+        对比断线前后的状态 补发错过的通知
+        """
+        current = await self._fetch_statuses()
+        notified = self._notified or set()
+        for gid in notified:  # 重连后收到的真实通知比快照新
+            if gid in self._statuses:  # type: ignore
+                current[gid] = self._statuses[gid]  # type: ignore
+        self._statuses = current
+        if previous is None:
+            return
+        events = []
+        for gid, status in current.items():
+            if gid not in notified and previous.get(gid) != status:
+                method = _NOTIFICATION_BY_STATUS.get(status)
+                if method is not None:
+                    events.append((method, gid))
+        for gid, status in previous.items():
+            # 断线期间停止并且已经被清除了
+            if gid not in current and status in ("active", "waiting", "paused"):
+                events.append(("aria2.onDownloadStop", gid))
+        for method, gid in events:
+            await self._notify(
+                {
+                    "jsonrpc": "2.0",
+                    "method": method,
+                    "params": [{"gid": gid}],
+                    "synthesized": True,
+                }
+            )
 
     async def handle_event(self, data: dict) -> None:
         """
         基础回调函数 当websocket服务器向客户端发送数据时候 此方法会自动调用
+        new in v1.3.7 响应在读取循环中直接交给请求表 只有通知会调用这里
+            子类覆盖了这个方法时响应仍然会交给它 但是每个响应都要创建一个任务
         :param data: receive_json包装对象 显然,与http不同,你得自己过滤出result字段,因为这个是完整的jsonrpc响应
         :return:
         """
         # 1.2.3更新:回调只能是异步函数了,同一种可以注册多个方法,同步的需要用run_sync包装
         if "result" in data or "error" in data:
             # 等效于post数据的结果
-            ResultStore.add_result(data)
+            self._results.add_result(data)
             # if "result" in self.functions:
             #     await asyncio.gather(*map(lambda x: x(self, future), self.functions["result"]))
         if "method" in data:
             # 来自aria2的notice信息
-            method = data["method"]
-            if method in self.functions:  # TODO 有鬼
-                await asyncio.gather(
-                    *map(lambda x: x(self, data), self.functions[method])
-                )
+            await self._call_callbacks(data)
 
-    def register(self, func: CallBack, type_: str) -> None:
-        """
-        注册响应websocket的事件
-        :return:
-        """
-        self.functions[type_].append(func)
+    async def __aenter__(self):
+        if not hasattr(self, "client_session"):
+            await self._start()
+        return self
 
-    def unregister(self, func: CallBack, type_: str) -> None:
-        """
-        取消注册响应websocket的事件
-        :return:
-        """
-        try:
-            self.functions[type_].remove(func)
-        except ValueError:
-            pass
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
 
-    # ----------以下这些推荐作为装饰器使用---------------------
 
-    def onDownloadStart(self, func: CallBack) -> CallBack:
-        """
-        注册回调事件
-        func的第二个参数的task.result()型如{'jsonrpc': '2.0', 'method': 'aria2.onDownloadStart', 'params': [{'gid': '5de52dc4eba048ca'}]}
-        :param func:
-        :return:
-        """
-        self.register(func, "aria2.onDownloadStart")
-        return func
+class Aria2WebsocketPool(_Aria2NotificationMixin, _Aria2BaseClient):
+    """
+    同一个aria2的多条websocket连接
+    请求分配给在途请求最少的连接 通知由单独的一条连接接收 大的响应不会阻塞其他请求和通知
+    """
 
-    def onDownloadPause(self, func: CallBack) -> CallBack:
+    def __init__(
+        self,
+        url: str,
+        identity: IdFactory = None,
+        mode: Literal["normal", "batch", "format"] = "normal",
+        token=None,
+        queue: asyncio.Queue = None,
+        client_session: aiohttp.ClientSession = None,
+        size: int = 4,
+        reconnect_interval: int = 1,
+        coalesce_window: Optional[float] = None,
+        coalesce_max: int = 100,
+        codec: JsonCodec = None,
+        metrics: Optional[MetricsHooks] = None,
+        scheduler: Optional[RequestScheduler] = None,
+        **kw,
+    ):
         """
-        注册回调事件
-        :param func:
-        :return:
+        :param size: 用于请求的连接数 另外还有一条专门接收通知的连接
+        其他参数参考Aria2WebsocketClient 所有连接共用一个ClientSession和id工厂
         """
-        self.register(func, "aria2.onDownloadPause")
-        return func
+        if (stack()[1].function) not in ("new", "eval_in_context"):
+            warnings.warn(
+                "do not init directly,use {0} instead".format(
+                    f"await {self.__class__.__name__}.new"
+                )
+            )
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        super().__init__(
+            url,
+            identity,
+            mode,
+            token,
+            queue,
+            coalesce_window,
+            coalesce_max,
+            metrics,
+            scheduler,
+        )
+        self.kw = kw
+        self.codec = instrument_codec(
+            get_codec(codec, self.kw.pop("loads", None), self.kw.pop("dumps", None)),
+            metrics,
+        )
+        self._client_session = (
+            client_session or aiohttp.ClientSession()
+        )  # type: aiohttp.ClientSession
+        self._owns_session = client_session is None  # 只关闭自己创建的session
+        self.size = size
+        self.reconnect_interval = reconnect_interval
+        # 只有通知连接需要补发和分发通知
+        self._notifier_kw = {
+            key: self.kw.pop(key)
+            for key in ("resync", "notification_workers", "notification_coalesce")
+            if key in self.kw
+        }
+        self.functions: DefaultDict[str, List[CallBack]] = defaultdict(list)
+        self.streams: List[EventStream] = []
+        self.notifier: Optional[Aria2WebsocketClient] = None  # 接收通知的连接
+        self.connections: List[Aria2WebsocketClient] = []  # 发送请求的连接
 
-    def onDownloadStop(self, func: CallBack) -> CallBack:
+    @classmethod
+    async def new(
+        cls,
+        url: str,
+        identity: IdFactory = None,
+        mode: Literal["normal", "batch", "format"] = "normal",
+        token: str = None,
+        queue: asyncio.Queue = None,
+        client_session: aiohttp.ClientSession = None,
+        size: int = 4,
+        reconnect_interval: int = 1,
+        coalesce_window: Optional[float] = None,
+        coalesce_max: int = 100,
+        codec: JsonCodec = None,
+        metrics: Optional[MetricsHooks] = None,
+        scheduler: Optional[RequestScheduler] = None,
+        **kw,
+    ) -> "Aria2WebsocketPool":
+        """
+        创建实例并建立所有连接 参考_start
+        """
+        self = cls(
+            url,
+            identity,
+            mode,
+            token,
+            queue,
+            client_session,
+            size,
+            reconnect_interval,
+            coalesce_window,
+            coalesce_max,
+            codec,
+            metrics,
+            scheduler,
+            **kw,
+        )
+        await self._start()
+        return self
+
+    async def _start(self) -> None:
         """
-        注册回调事件
-        :param func:
-        :return:
+        建立所有连接 任意一条连接失败都会关闭已建立的连接并抛出异常
         """
-        self.register(func, "aria2.onDownloadStop")
-        return func
+        results = await asyncio.gather(
+            self._connect(**self._notifier_kw),
+            *[self._connect(resync=False) for _ in range(self.size)],
+            return_exceptions=True,
+        )
+        connections = [r for r in results if isinstance(r, Aria2WebsocketClient)]
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            for connection in connections:
+                await connection.close()
+            if self._owns_session:
+                await self._client_session.close()
+            raise errors[0]
+        self.notifier, *self.connections = connections
+        self.notifier.handle_event = self.handle_event  # type: ignore
+        self.notifier.streams = self.streams  # 通知流由连接池持有
+
+    async def _connect(self, **notifier_kw: Any) -> "Aria2WebsocketClient":
+        return await Aria2WebsocketClient.new(
+            self.url,
+            self.identity,
+            "normal",
+            self.token,
+            client_session=self._client_session,
+            reconnect_interval=self.reconnect_interval,
+            codec=self.codec,
+            metrics=self.metrics,
+            **notifier_kw,
+            **self.kw,
+        )
 
-    def onDownloadComplete(self, func: CallBack) -> CallBack:
+    def _pick(self) -> "Aria2WebsocketClient":
         """
-        注册回调事件
-        :param func:
-        :return:
+        选出在途请求最少的连接
         """
-        self.register(func, "aria2.onDownloadComplete")
-        return func
+        connections = [c for c in self.connections if not c.closed] or [
+            c for c in self.connections if c.auto_reconnect and not c._closing
+        ]  # 都在重连的话 请求会等待连接恢复
+        if not connections:
+            raise Aria2rpcException(
+                "no websocket connection available", connection_error=True
+            )
+        return min(connections, key=lambda c: len(c._results))
 
-    def onDownloadError(self, func: CallBack) -> CallBack:
+    async def send_request(self, req_obj: Dict[str, Any]) -> Union[Dict[str, Any], Any]:
+        return await self._pick().send_request(req_obj)
+
+    async def send_batch(
+        self, req_objs: List[Dict[str, Any]]
+    ) -> List[Union[Any, Aria2rpcException]]:
+        return await self._pick().send_batch(req_objs)
+
+    async def _send_file_request(
+        self, req_obj: Dict[str, Any], prefix: bytes, path: str, suffix: bytes
+    ) -> Any:
+        return await self._pick()._send_file_request(req_obj, prefix, path, suffix)
+
+    async def _send_encoded(self, req_obj: Dict[str, Any], payload: bytes) -> Any:
+        return await self._pick()._send_encoded(req_obj, payload)
+
+    @property
+    def outstanding(self) -> List[int]:
         """
-        注册回调事件
-        :param func:
-        :return:
+        每条请求连接上等待响应的请求数
         """
-        self.register(func, "aria2.onDownloadError")
-        return func
+        return [len(c._results) for c in self.connections]
 
-    def onBtDownloadComplete(self, func: CallBack) -> CallBack:
+    async def handle_event(self, data: dict) -> None:
         """
-        注册回调事件
-        :param func:
-        :return:
+        通知连接收到的消息 回调的第一个参数是连接池本身
         """
-        self.register(func, "aria2.onBtDownloadComplete")
-        return func
+        if "method" in data:
+            await self._call_callbacks(data)
+
+    @property
+    def closed(self) -> bool:
+        return all(c.closed for c in (self.notifier, *self.connections) if c)
+
+    async def close(self) -> None:
+        await self._cancel_coalesced()
+        self._close_streams()
+        connections = [c for c in (self.notifier, *self.connections) if c]
+        await asyncio.gather(*[c.close() for c in connections])
+        if self._owns_session:
+            await self._client_session.close()
 
     async def __aenter__(self):
-        if not hasattr(self, "client_session"):
-            self.client_session: aiohttp.ClientWebSocketResponse = (
-                await self._client_session.ws_connect(self.url, **self.kw)
-            )
-            self._listen_task = asyncio.create_task(self.listen())
-            return self
+        if self.notifier is None:
+            await self._start()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+本模块把多个aria2进程组合成一个集群
+
+新下载按放置策略分配到某个节点 之后针对这个gid的请求都发往同一个节点
+汇总类请求并发地发往所有节点 单个节点超时或失败不影响其他节点的结果
+"""
+import asyncio
+import bisect
+import hashlib
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from aioaria2.client import _Aria2BaseClient
+from aioaria2.exceptions import Aria2rpcException
+
+
+class ClusterResult:
+    """
+    一次扇出请求的结果 results和errors以节点名为key
+    """
+
+    __slots__ = ("results", "errors")
+
+    def __init__(
+        self, results: Dict[str, Any], errors: Dict[str, BaseException]
+    ) -> None:
+        self.results = results
+        self.errors = errors
+
+    @property
+    def partial(self) -> bool:
+        """
+        是否有节点没有返回结果
+        """
+        return bool(self.errors)
+
+    def merged(self) -> List[Any]:
+        """
+        把各节点返回的列表拼接起来 适用于tellActive tellWaiting tellStopped
+        """
+        return [item for result in self.results.values() for item in result]
+
+    def total(self) -> Dict[str, int]:
+        """
+        把各节点返回的数字字段相加 适用于getGlobalStat
+        """
+        total: Dict[str, int] = {}
+        for result in self.results.values():
+            for key, value in result.items():
+                try:
+                    total[key] = total.get(key, 0) + int(value)
+                except (TypeError, ValueError):
+                    continue
+        return total
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(nodes={list(self.results)}, "
+            f"errors={list(self.errors)})"
+        )
+
+
+class Placement:
+    """
+    放置策略的基类 决定新下载放到哪个节点
+    """
+
+    async def select(self, cluster: "Aria2Cluster", key: str) -> str:
+        """
+        :param cluster: 集群
+        :param key: 下载的标识 uri或者种子内容的摘要
+        :return: 节点名
+        """
+        raise NotImplementedError
+
+
+class _LoadPlacement(Placement):
+    """
+    根据getGlobalStat选择负载最小的节点 结果缓存ttl秒
+    缓存期间每放置一个下载 就给对应节点的负载加上一个估计值 避免所有下载涌向同一个节点
+    """
+
+    def __init__(self, ttl: float = 1.0) -> None:
+        self.ttl = ttl
+        self._loads: Dict[str, float] = {}
+        self._expires = 0.0
+
+    def load(self, stat: Dict[str, Any]) -> float:
+        raise NotImplementedError
+
+    def penalty(self, load: float) -> float:
+        """
+        放置一个下载后负载的估计增量
+        """
+        return 1.0
+
+    async def select(self, cluster: "Aria2Cluster", key: str) -> str:
+        now = time.monotonic()
+        if now >= self._expires or not self._loads:
+            stats = await cluster.getGlobalStat()
+            self._loads = {
+                node: self.load(stat) for node, stat in stats.results.items()
+            }
+            self._expires = now + self.ttl
+        if not self._loads:
+            raise Aria2rpcException("no aria2 node available", connection_error=True)
+        node = min(self._loads, key=self._loads.__getitem__)
+        self._loads[node] += self.penalty(self._loads[node])
+        return node
+
+
+class LeastActive(_LoadPlacement):
+    """
+    活动和等待中的下载最少的节点
+    """
+
+    def load(self, stat: Dict[str, Any]) -> float:
+        return int(stat["numActive"]) + int(stat["numWaiting"])
+
+
+class LeastBandwidth(_LoadPlacement):
+    """
+    下载速度最低的节点
+    """
+
+    def load(self, stat: Dict[str, Any]) -> float:
+        return int(stat["downloadSpeed"])
+
+    def penalty(self, load: float) -> float:
+        # 新下载的速度未知 按当前平均到每个活动下载的速度估计 至少1KiB/s
+        return max(load / 8, 1024.0)
+
+
+class ConsistentHash(Placement):
+    """
+    按uri的一致性哈希选择节点 同一个uri总是落到同一个节点 增减节点只影响少量uri
+    """
+
+    def __init__(self, replicas: int = 100) -> None:
+        """
+        :param replicas: 每个节点在哈希环上的虚拟节点数
+        """
+        self.replicas = replicas
+        self._ring: List[Tuple[int, str]] = []
+        self._hashes: List[int] = []
+        self._nodes: Tuple[str, ...] = ()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def _build(self, nodes: Tuple[str, ...]) -> None:
+        self._ring = sorted(
+            (self._hash(f"{node}#{i}"), node)
+            for node in nodes
+            for i in range(self.replicas)
+        )
+        self._hashes = [h for h, _ in self._ring]
+        self._nodes = nodes
+
+    async def select(self, cluster: "Aria2Cluster", key: str) -> str:
+        nodes = tuple(cluster.nodes)
+        if nodes != self._nodes:
+            self._build(nodes)
+        if not self._ring:
+            raise Aria2rpcException("no aria2 node available", connection_error=True)
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class Aria2Cluster:
+    """
+    多个aria2进程的门面 方法名与客户端保持一致
+    """
+
+    def __init__(
+        self,
+        clients: Union[Mapping[str, _Aria2BaseClient], Iterable[_Aria2BaseClient]],
+        placement: Optional[Placement] = None,
+        timeout: float = 5.0,
+        owns_clients: bool = True,
+    ):
+        """
+        :param clients: 节点名到客户端的映射 或者客户端列表(以url作为节点名)
+            客户端应当是normal模式
+        :param placement: 放置策略 默认为LeastActive
+        :param timeout: 扇出请求时每个节点的超时
+        :param owns_clients: close()时是否关闭这些客户端 包装别处管理的客户端时传入False
+        """
+        if isinstance(clients, Mapping):
+            self.nodes: Dict[str, _Aria2BaseClient] = dict(clients)
+        else:
+            self.nodes = {client.url: client for client in clients}
+        self.placement = placement or LeastActive()
+        self.timeout = timeout
+        self.owns_clients = owns_clients
+        self._gids: Dict[str, str] = {}  # gid -> 节点名
+
+    # ----------------------路由----------------------------
+
+    def node_of(self, gid: str) -> Optional[str]:
+        """
+        gid所在的节点 未知时返回None
+        """
+        return self._gids.get(gid)
+
+    def remember(self, gid: str, node: str) -> None:
+        self._gids[gid] = node
+
+    def forget(self, gid: str) -> None:
+        self._gids.pop(gid, None)
+
+    async def locate(self, gid: str) -> str:
+        """
+        找到gid所在的节点 未知的gid会询问所有节点
+        """
+        node = self._gids.get(gid)
+        if node is not None:
+            return node
+        found = await self.scatter(lambda client: client.tellStatus(gid, ["gid"]))
+        for node in found.results:
+            self._gids[gid] = node
+            return node
+        raise Aria2rpcException(f"GID {gid} is not found")
+
+    async def client_of(self, gid: str) -> _Aria2BaseClient:
+        return self.nodes[await self.locate(gid)]
+
+    async def scatter(
+        self,
+        call: Callable[[_Aria2BaseClient], Awaitable[Any]],
+        nodes: Optional[Iterable[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> ClusterResult:
+        """
+        并发地对每个节点调用call
+        :param call: 接受客户端 返回awaitable的函数 例如lambda c: c.tellActive()
+        :param nodes: 只请求这些节点 默认为全部
+        :param timeout: 每个节点的超时 默认为self.timeout
+        """
+        names = list(self.nodes if nodes is None else nodes)
+        timeout = self.timeout if timeout is None else timeout
+        responses = await asyncio.gather(
+            *[asyncio.wait_for(call(self.nodes[name]), timeout) for name in names],
+            return_exceptions=True,
+        )
+        results: Dict[str, Any] = {}
+        errors: Dict[str, BaseException] = {}
+        for name, response in zip(names, responses):
+            if isinstance(response, asyncio.TimeoutError):
+                errors[name] = Aria2rpcException(
+                    f"node {name} timeout", connection_error=True
+                )
+            elif isinstance(response, Exception):
+                errors[name] = response
+            elif isinstance(response, BaseException):  # CancelledError
+                raise response
+            else:
+                results[name] = response
+        return ClusterResult(results, errors)
+
+    # ----------------------新增下载----------------------------
+
+    async def _place(
+        self, key: str, call: Callable[[_Aria2BaseClient], Awaitable[str]]
+    ) -> str:
+        node = await self.placement.select(self, key)
+        gid = await call(self.nodes[node])
+        self._gids[gid] = node  # type: ignore
+        return gid
+
+    async def addUri(
+        self, uris: List[str], options: Dict[str, Any] = None, position: int = None
+    ) -> str:
+        """
+        按放置策略选择节点添加下载 参考Aria2HttpClient.addUri
+        :return: gid
+        """
+        return await self._place(
+            uris[0] if uris else "",
+            lambda client: client.addUri(uris, options, position),  # type: ignore
+        )
+
+    async def addTorrent(
+        self,
+        torrent: str,
+        uris: List[str] = None,
+        options: Dict[str, Any] = None,
+        position: int = None,
+    ) -> str:
+        """
+        按种子内容选择节点 参考Aria2HttpClient.addTorrent
+        :return: gid
+        """
+        return await self._place(
+            hashlib.sha1(torrent.encode()).hexdigest(),
+            lambda client: client.addTorrent(torrent, uris, options, position),  # type: ignore
+        )
+
+    async def addMetalink(
+        self, metalink: str, options: Dict[str, Any] = None, position: int = None
+    ) -> List[str]:
+        """
+        metalink的所有下载放在同一个节点
+        :return: gid列表
+        """
+        node = await self.placement.select(
+            self, hashlib.sha1(metalink.encode()).hexdigest()
+        )
+        gids = await self.nodes[node].addMetalink(metalink, options, position)  # type: ignore
+        for gid in gids:  # type: ignore
+            self._gids[gid] = node
+        return gids  # type: ignore
+
+    # ----------------------单个下载----------------------------
+
+    async def tellStatus(self, gid: str, keys: List[str] = None) -> Dict[str, Any]:
+        return await (await self.client_of(gid)).tellStatus(gid, keys)  # type: ignore
+
+    async def getFiles(self, gid: str) -> Any:
+        return await (await self.client_of(gid)).getFiles(gid)
+
+    async def getUris(self, gid: str) -> Any:
+        return await (await self.client_of(gid)).getUris(gid)
+
+    async def getPeers(self, gid: str) -> Any:
+        return await (await self.client_of(gid)).getPeers(gid)
+
+    async def getOption(self, gid: str) -> Any:
+        return await (await self.client_of(gid)).getOption(gid)
+
+    async def changeOption(self, gid: str, options: Dict[str, Any]) -> Any:
+        return await (await self.client_of(gid)).changeOption(gid, options)
+
+    async def pause(self, gid: str) -> Any:
+        return await (await self.client_of(gid)).pause(gid)
+
+    async def forcePause(self, gid: str) -> Any:
+        return await (await self.client_of(gid)).forcePause(gid)
+
+    async def unpause(self, gid: str) -> Any:
+        return await (await self.client_of(gid)).unpause(gid)
+
+    async def remove(self, gid: str) -> Any:
+        return await (await self.client_of(gid)).remove(gid)
+
+    async def forceRemove(self, gid: str) -> Any:
+        return await (await self.client_of(gid)).forceRemove(gid)
+
+    async def removeDownloadResult(self, gid: str) -> Any:
+        result = await (await self.client_of(gid)).removeDownloadResult(gid)
+        self.forget(gid)
+        return result
+
+    # ----------------------汇总----------------------------
+
+    def _learn(self, result: ClusterResult) -> ClusterResult:
+        for node, statuses in result.results.items():
+            for status in statuses:
+                if "gid" in status:
+                    self._gids[status["gid"]] = node
+        return result
+
+    async def tellActive(self, keys: List[str] = None) -> ClusterResult:
+        return self._learn(await self.scatter(lambda client: client.tellActive(keys)))
+
+    async def tellWaiting(
+        self, offset: int, num: int, keys: List[str] = None
+    ) -> ClusterResult:
+        """
+        每个节点各自取offset和num
+        """
+        return self._learn(
+            await self.scatter(lambda client: client.tellWaiting(offset, num, keys))
+        )
+
+    async def tellStopped(
+        self, offset: int, num: int, keys: List[str] = None
+    ) -> ClusterResult:
+        return self._learn(
+            await self.scatter(lambda client: client.tellStopped(offset, num, keys))
+        )
+
+    async def getGlobalStat(self) -> ClusterResult:
+        return await self.scatter(lambda client: client.getGlobalStat())
+
+    async def getVersion(self) -> ClusterResult:
+        return await self.scatter(lambda client: client.getVersion())
+
+    async def pauseAll(self) -> ClusterResult:
+        return await self.scatter(lambda client: client.pauseAll())
+
+    async def forcePauseAll(self) -> ClusterResult:
+        return await self.scatter(lambda client: client.forcePauseAll())
+
+    async def unpauseAll(self) -> ClusterResult:
+        return await self.scatter(lambda client: client.unpauseAll())
+
+    async def purgeDownloadResult(self) -> ClusterResult:
+        result = await self.scatter(lambda client: client.purgeDownloadResult())
+        self._gids.clear()  # 已停止的下载都没了 其他的需要时再找
+        return result
+
+    async def saveSession(self) -> ClusterResult:
+        return await self.scatter(lambda client: client.saveSession())
+
+    # ----------------------生命周期----------------------------
+
+    async def close(self) -> None:
+        if not self.owns_clients:
+            return
+        await asyncio.gather(
+            *[client.close() for client in self.nodes.values()],
+            return_exceptions=True,
+        )
+
+    async def __aenter__(self) -> "Aria2Cluster":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+本模块提供json编解码器 客户端在两端都直接处理bytes
+
+安装了orjson msgspec ujson之一时自动使用 否则使用标准库json
+"""
+import json
+from typing import Any, Callable, Optional, Union
+
+from aioaria2.utils import JSON_ENCODING
+
+
+class JsonCodec:
+    """
+    标准库json 也是其他编解码器的基类
+    """
+
+    name = "json"
+    accepts_bytes = True  # loads可以直接解析bytes 否则客户端会先解码为str
+
+    def __init__(self) -> None:
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(self, obj: Any) -> bytes:
+        """
+        序列化为bytes 可以直接作为http body或websocket帧发送
+        """
+        return self._encoder.encode(obj).encode(JSON_ENCODING)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self.dumps = orjson.dumps  # type: ignore
+        self.loads = orjson.loads  # type: ignore
+
+
+class MsgspecCodec(JsonCodec):
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        import msgspec
+
+        self.dumps = msgspec.json.Encoder().encode  # type: ignore
+        self.loads = msgspec.json.Decoder().decode  # type: ignore
+
+
+class UjsonCodec(JsonCodec):
+    name = "ujson"
+
+    def __init__(self) -> None:
+        import ujson
+
+        self._dumps = ujson.dumps
+        self.loads = ujson.loads  # type: ignore
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._dumps(obj, ensure_ascii=False).encode(JSON_ENCODING)
+
+
+class CallableCodec(JsonCodec):
+    """
+    包装用户提供的loads/dumps 兼容旧的关键字参数
+    用户的loads和以前一样只会收到str
+    """
+
+    name = "callable"
+
+    def __init__(
+        self,
+        loads: Optional[Callable[..., Any]] = None,
+        dumps: Optional[Callable[..., Union[str, bytes]]] = None,
+    ) -> None:
+        super().__init__()
+        self._loads = loads
+        self._dumps = dumps
+        self.accepts_bytes = loads is None
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        if self._loads is None:
+            return super().loads(data)
+        if not isinstance(data, str):
+            data = bytes(data).decode(JSON_ENCODING)
+        return self._loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        if self._dumps is None:
+            return super().dumps(obj)
+        data = self._dumps(obj)
+        return data.encode(JSON_ENCODING) if isinstance(data, str) else data
+
+
+_default_codec: Optional[JsonCodec] = None
+
+
+def get_default_codec() -> JsonCodec:
+    """
+    按orjson msgspec ujson json的顺序选择第一个可用的编解码器
+    """
+    global _default_codec
+    if _default_codec is None:
+        for class_ in (OrjsonCodec, MsgspecCodec, UjsonCodec):
+            try:
+                _default_codec = class_()
+                break
+            except ImportError:
+                continue
+        else:
+            _default_codec = JsonCodec()
+    return _default_codec
+
+
+def get_codec(
+    codec: Optional[JsonCodec] = None,
+    loads: Optional[Callable[..., Any]] = None,
+    dumps: Optional[Callable[..., Union[str, bytes]]] = None,
+) -> JsonCodec:
+    """
+    客户端用来决定使用哪个编解码器
+    :param codec: 显式指定的编解码器 优先级最高
+    :param loads: 旧的loads关键字参数
+    :param dumps: 旧的dumps关键字参数
+    """
+    if codec is not None:
+        return codec
+    if loads is not None or dumps is not None:
+        return CallableCodec(loads, dumps)
+    return get_default_codec()
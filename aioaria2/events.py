@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+本模块负责websocket通知的分发
+"""
+import asyncio
+import time
+from collections import deque
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from typing_extensions import Literal
+
+
+def notification_gid(data: Dict[str, Any]) -> Optional[str]:
+    """
+    通知对应的gid aria2的每个通知只有一个参数
+    """
+    try:
+        return data["params"][0]["gid"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+class NotificationDispatcher:
+    """
+    用固定数量的worker处理通知 不再为每条通知创建任务
+    同一个gid的通知总是交给同一个worker 按到达顺序处理
+    worker的队列没有上限: 等待会暂停读取websocket 回调中等待同一连接上的请求时会死锁
+    丢弃又会丢失通知 需要有界队列时用EventStream
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        workers: int = 4,
+        coalesce_window: Optional[float] = None,
+        on_lag: Optional[Callable[[str, float], Any]] = None,
+    ):
+        """
+        :param handler: 处理一条通知的协程函数
+        :param workers: worker数量 也就是最多同时处理多少条通知
+        :param coalesce_window: 同一个gid的同一种通知在这么多秒内只处理第一条 None表示不合并
+        :param on_lag: 开始处理一条通知时以(method, 排队的秒数)调用 用于记录指标
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.handler = handler
+        self.coalesce_window = coalesce_window
+        self.coalesced = 0  # 被合并掉的通知数
+        self.on_lag = on_lag
+        self._queues: List[asyncio.Queue] = [asyncio.Queue() for _ in range(workers)]
+        self._tasks: List[asyncio.Task] = []
+        self._last: Dict[Tuple[str, str], float] = {}  # (method, gid) -> 上次处理的时间
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._work(queue)) for queue in self._queues
+            ]
+
+    def __len__(self) -> int:
+        """
+        等待处理的通知数
+        """
+        return sum(queue.qsize() for queue in self._queues)
+
+    def put_nowait(self, data: Dict[str, Any]) -> None:
+        """
+        交给对应的worker 不会阻塞读取循环
+        """
+        gid = notification_gid(data)
+        if self.coalesce_window is not None and gid is not None:
+            now = asyncio.get_running_loop().time()
+            key = (data["method"], gid)
+            last = self._last.get(key)
+            if last is not None and now - last < self.coalesce_window:
+                self.coalesced += 1
+                return
+            self._last[key] = now
+            if len(self._last) > 4096:  # 清理过期的记录
+                self._last = {
+                    k: t
+                    for k, t in self._last.items()
+                    if now - t < self.coalesce_window
+                }
+        # 只在需要记录延迟时带上收到的时间
+        self._queues[hash(gid) % len(self._queues)].put_nowait(
+            data if self.on_lag is None else (time.perf_counter(), data)
+        )
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            data = await queue.get()
+            if self.on_lag is not None:
+                received, data = data
+                self.on_lag(data["method"], time.perf_counter() - received)
+            try:
+                await self.handler(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                asyncio.get_running_loop().call_exception_handler(
+                    {
+                        "message": "unhandled exception in notification callback",
+                        "exception": err,
+                        "notification": data,
+                    }
+                )
+
+    async def close(self) -> None:
+        """
+        停止所有worker 还没处理的通知会被丢弃
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class EventStream:
+    """
+    由有界队列支持的通知流 用async for消费
+
+    队列满时的策略:
+        drop_oldest - 丢弃最旧的通知
+        coalesce - 新通知替换队列中同一个gid最近的一条 位置不变 没有可合并的则丢弃最旧的
+            没有gid的通知(例如重连后补发的事件)不会被合并
+        block - 暂停读取websocket 直到消费者取走通知
+            此时同一连接上的请求也收不到响应 消费者在处理通知时不要等待同一连接上的请求
+    """
+
+    def __init__(
+        self,
+        types: Optional[Iterable[str]] = None,
+        gids: Optional[Iterable[str]] = None,
+        maxsize: int = 1024,
+        overflow: Literal["drop_oldest", "coalesce", "block"] = "drop_oldest",
+        on_close: Optional[Callable[["EventStream"], Any]] = None,
+    ):
+        """
+        :param types: 只接收这些通知 例如aria2.onDownloadComplete 可以省略aria2.前缀 None表示全部
+        :param gids: 只接收这些gid的通知 None表示全部
+        :param maxsize: 队列长度
+        :param overflow: 队列满时的策略
+        :param on_close: 关闭时调用 用于从客户端注销
+        """
+        if overflow not in ("drop_oldest", "coalesce", "block"):
+            raise ValueError(f"unknown overflow policy {overflow!r}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.types = (
+            frozenset(t if "." in t else f"aria2.{t}" for t in types)
+            if types is not None
+            else None
+        )
+        self.gids = frozenset(gids) if gids is not None else None
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0  # 因为队列满而丢弃的通知数
+        self.coalesced = 0  # 被同一个gid的新通知替换掉的通知数
+        self.closed = False
+        self._on_close = on_close
+        self._items: Deque[List[Any]] = deque()  # [data] 方便原地替换
+        self._by_gid: Dict[str, List[Any]] = {}
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def matches(self, data: Dict[str, Any]) -> bool:
+        if self.types is not None and data.get("method") not in self.types:
+            return False
+        if self.gids is not None and notification_gid(data) not in self.gids:
+            return False
+        return True
+
+    def _pop(self) -> Dict[str, Any]:
+        item = self._items.popleft()
+        if self.overflow == "coalesce":
+            gid = notification_gid(item[0])
+            if gid is not None and self._by_gid.get(gid) is item:
+                del self._by_gid[gid]
+        if not self._items:
+            self._readable.clear()
+        self._writable.set()
+        return item[0]
+
+    async def put(self, data: Dict[str, Any]) -> None:
+        """
+        放入一条通知 只有block策略会等待
+        """
+        if self.closed:
+            return
+        gid = None
+        if self.overflow == "coalesce":
+            gid = notification_gid(data)
+            if gid is not None and len(self._items) >= self.maxsize:
+                item = self._by_gid.get(gid)
+                if item is not None:
+                    item[0] = data
+                    self.coalesced += 1
+                    return
+        elif self.overflow == "block":
+            while len(self._items) >= self.maxsize and not self.closed:
+                self._writable.clear()
+                await self._writable.wait()
+            if self.closed:
+                return
+        if len(self._items) >= self.maxsize:
+            self._pop()
+            self.dropped += 1
+        item = [data]
+        self._items.append(item)
+        if gid is not None:
+            self._by_gid[gid] = item
+        self._readable.set()
+
+    async def get(self) -> Dict[str, Any]:
+        """
+        取出下一条通知 流关闭并且取完后抛出StopAsyncIteration
+        """
+        while not self._items:
+            if self.closed:
+                raise StopAsyncIteration
+            await self._readable.wait()
+        return self._pop()
+
+    def __aiter__(self) -> "EventStream":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        return await self.get()
+
+    def close(self) -> None:
+        """
+        不再接收新通知 已经在队列中的通知仍然可以取出
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._readable.set()
+        self._writable.set()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    async def aclose(self) -> None:
+        self.close()
+
+    async def __aenter__(self) -> "EventStream":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
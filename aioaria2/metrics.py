@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+本模块提供客户端的指标钩子 和一个内存中的收集器
+
+客户端只在设置了metrics时调用钩子 没有设置时热路径上只多一次判断
+"""
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, List, Optional, Sequence, Tuple, Union
+
+from aioaria2.codec import JsonCodec
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class MetricsHooks:
+    """
+    指标钩子 所有方法默认什么都不做 继承后覆盖需要的方法
+    钩子在事件循环中同步调用 不要在里面做耗时的操作
+    """
+
+    def on_request_start(self, method: str) -> None:
+        """
+        一个rpc调用开始 batch模式下不会调用
+        """
+
+    def on_request_end(self, method: str, seconds: float, error: bool) -> None:
+        """
+        一个rpc调用结束
+        :param seconds: 从发起到收到结果的时间
+        :param error: 是否抛出了异常 被取消的调用不算
+        """
+
+    def on_encode(self, method: str, size: int, seconds: float) -> None:
+        """
+        编码了一个请求
+        :param method: 请求的方法 jsonrpc batch为"batch"
+        :param size: 编码后的字节数
+        """
+
+    def on_decode(self, size: int, seconds: float) -> None:
+        """
+        解码了一条收到的消息 包括响应和通知
+        """
+
+    def on_queue_depth(self, depth: int) -> None:
+        """
+        batch模式下队列中的请求数变化
+        """
+
+    def on_pending(self, delta: int) -> None:
+        """
+        等待websocket响应的请求数增加或者减少了delta
+        """
+
+    def on_dispatch_lag(self, method: str, seconds: float) -> None:
+        """
+        一条通知从收到到开始处理所等待的时间
+        """
+
+    def on_reconnect(self) -> None:
+        """
+        websocket重连成功
+        """
+
+    def on_queue_wait(self, priority: str, seconds: float) -> None:
+        """
+        一个请求在调度器或者batch队列中等待的时间
+        :param priority: 优先级的名字 batch队列为"batch"
+        """
+
+
+class InstrumentedCodec(JsonCodec):
+    """
+    包装另一个编解码器 记录编解码的耗时和字节数
+    """
+
+    def __init__(self, codec: JsonCodec, metrics: MetricsHooks) -> None:
+        self.codec = codec
+        self.metrics = metrics
+        self.name = codec.name
+        self.accepts_bytes = codec.accepts_bytes
+
+    def dumps(self, obj: Any) -> bytes:
+        start = time.perf_counter()
+        data = self.codec.dumps(obj)
+        elapsed = time.perf_counter() - start
+        method = obj.get("method", "") if isinstance(obj, dict) else "batch"
+        self.metrics.on_encode(method, len(data), elapsed)
+        return data
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        start = time.perf_counter()
+        obj = self.codec.loads(data)
+        self.metrics.on_decode(len(data), time.perf_counter() - start)
+        return obj
+
+
+def instrument_codec(codec: JsonCodec, metrics: Optional[MetricsHooks]) -> JsonCodec:
+    """
+    metrics为None或者codec已经包装过时原样返回
+    """
+    if metrics is None or (
+        isinstance(codec, InstrumentedCodec) and codec.metrics is metrics
+    ):
+        return codec
+    return InstrumentedCodec(codec, metrics)
+
+
+class Histogram:
+    """
+    固定分桶的直方图
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个是+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        估计分位数 返回所在分桶的上界 落在+Inf桶时返回最大的有限上界
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """
+        prometheus格式的累计计数 [(上界, 计数), ...] 最后一个上界是inf
+        """
+        result = []
+        seen = 0
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            seen += count
+            result.append((bound, seen))
+        return result
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(count={self.count}, sum={self.sum:.6f})"
+
+
+# 指标名 -> (类型, 标签名, 说明)
+_METRICS: Dict[str, Tuple[str, Optional[str], str]] = {
+    "request_duration_seconds": ("histogram", "method", "rpc call latency"),
+    "request_errors_total": ("counter", "method", "rpc calls that raised"),
+    "requests_in_flight": ("gauge", "method", "rpc calls waiting for a result"),
+    "request_bytes": ("histogram", "method", "encoded request size"),
+    "encode_duration_seconds": ("histogram", None, "json encode time"),
+    "received_bytes": ("histogram", None, "decoded response/notification size"),
+    "decode_duration_seconds": ("histogram", None, "json decode time"),
+    "queue_depth": ("gauge", None, "requests queued in batch mode"),
+    "pending_responses": ("gauge", None, "websocket requests awaiting a response"),
+    "notification_lag_seconds": (
+        "histogram",
+        "method",
+        "time between receiving a notification and handling it",
+    ),
+    "reconnects_total": ("counter", None, "successful websocket reconnects"),
+    "queue_wait_seconds": (
+        "histogram",
+        "priority",
+        "time a request waited in the scheduler or the batch queue",
+    ),
+}
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsCollector(MetricsHooks):
+    """
+    在内存中汇总指标 可以导出为prometheus文本格式
+
+        metrics = MetricsCollector()
+        client = Aria2HttpClient(url, metrics=metrics)
+        ...
+        print(metrics.to_prometheus())
+    """
+
+    def __init__(
+        self,
+        latency_buckets: Sequence[float] = LATENCY_BUCKETS,
+        size_buckets: Sequence[float] = SIZE_BUCKETS,
+        namespace: str = "aioaria2",
+    ) -> None:
+        """
+        :param latency_buckets: 时间类直方图的分桶 单位秒
+        :param size_buckets: 字节数直方图的分桶
+        :param namespace: 导出时指标名的前缀
+        """
+        self.latency_buckets = tuple(latency_buckets)
+        self.size_buckets = tuple(size_buckets)
+        self.namespace = namespace
+        # 指标名 -> 标签值 -> 值 没有标签的指标标签值为""
+        self.histograms: DefaultDict[str, Dict[str, Histogram]] = defaultdict(dict)
+        self.counters: DefaultDict[str, DefaultDict[str, int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self.gauges: DefaultDict[str, DefaultDict[str, int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+
+    def _observe(self, name: str, label: str, value: float) -> None:
+        series = self.histograms[name]
+        histogram = series.get(label)
+        if histogram is None:
+            histogram = series[label] = Histogram(
+                self.size_buckets if name.endswith("_bytes") else self.latency_buckets
+            )
+        histogram.observe(value)
+
+    def histogram(self, name: str, label: str = "") -> Optional[Histogram]:
+        return self.histograms.get(name, {}).get(label)
+
+    def on_request_start(self, method: str) -> None:
+        self.gauges["requests_in_flight"][method] += 1
+
+    def on_request_end(self, method: str, seconds: float, error: bool) -> None:
+        self.gauges["requests_in_flight"][method] -= 1
+        self._observe("request_duration_seconds", method, seconds)
+        if error:
+            self.counters["request_errors_total"][method] += 1
+
+    def on_encode(self, method: str, size: int, seconds: float) -> None:
+        self._observe("request_bytes", method, size)
+        self._observe("encode_duration_seconds", "", seconds)
+
+    def on_decode(self, size: int, seconds: float) -> None:
+        self._observe("received_bytes", "", size)
+        self._observe("decode_duration_seconds", "", seconds)
+
+    def on_queue_depth(self, depth: int) -> None:
+        self.gauges["queue_depth"][""] = depth
+
+    def on_pending(self, delta: int) -> None:
+        self.gauges["pending_responses"][""] += delta
+
+    def on_dispatch_lag(self, method: str, seconds: float) -> None:
+        self._observe("notification_lag_seconds", method, seconds)
+
+    def on_reconnect(self) -> None:
+        self.counters["reconnects_total"][""] += 1
+
+    def on_queue_wait(self, priority: str, seconds: float) -> None:
+        self._observe("queue_wait_seconds", priority, seconds)
+
+    def reset(self) -> None:
+        self.histograms.clear()
+        self.counters.clear()
+        self.gauges.clear()
+
+    def to_prometheus(self) -> str:
+        """
+        prometheus文本格式(0.0.4)
+        """
+        lines: List[str] = []
+        for name, (type_, label_name, help_) in _METRICS.items():
+            if type_ == "histogram":
+                series: Dict[str, Any] = self.histograms.get(name, {})
+            elif type_ == "counter":
+                series = self.counters.get(name, {})
+            else:
+                series = self.gauges.get(name, {})
+            if not series:
+                continue
+            full_name = f"{self.namespace}_{name}" if self.namespace else name
+            lines.append(f"# HELP {full_name} {help_}")
+            lines.append(f"# TYPE {full_name} {type_}")
+            for label, value in sorted(series.items()):
+                labels = (
+                    f'{label_name}="{_escape(label)}"' if label_name is not None else ""
+                )
+                if type_ != "histogram":
+                    suffix = f"{{{labels}}}" if labels else ""
+                    lines.append(f"{full_name}{suffix} {_format_value(value)}")
+                    continue
+                sep = "," if labels else ""
+                for bound, count in value.cumulative():
+                    lines.append(
+                        f'{full_name}_bucket{{{labels}{sep}le="{_format_value(bound)}"}} {count}'
+                    )
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{full_name}_sum{suffix} {_format_value(value.sum)}")
+                lines.append(f"{full_name}_count{suffix} {value.count}")
+        return "\n".join(lines) + "\n" if lines else ""
@@ -2,10 +2,53 @@
 """
 See https://aria2.github.io/manual/en/html/technical-notes.html
 """
+import mmap
+import os
+import struct
+import traceback
 from dataclasses import dataclass
 from ipaddress import IPv4Address, IPv6Address
 from pathlib import Path
-from typing import IO, List, Union
+from typing import (
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    overload,
+)
+
+from aioaria2.bitfield import Bitfield, np
+
+BLOCK_LENGTH = 16 * 1024  # aria2分片内的块大小
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class _Layout:
+    """
+    预编译的struct 版本1为大端 版本0为小端
+    """
+
+    __slots__ = ("u32", "lengths", "piece")
+
+    def __init__(self, endian: str) -> None:
+        self.u32 = struct.Struct(endian + "I")
+        # piece_length total_length upload_length bitfield_length
+        self.lengths = struct.Struct(endian + "IQQI")
+        # index length piece_bitfield_length
+        self.piece = struct.Struct(endian + "III")
+
+
+_LAYOUTS = {1: _Layout(">"), 0: _Layout("<")}
+_VERSION = struct.Struct(">H")
+
+
+def _layout(version: int) -> _Layout:
+    return _LAYOUTS[1 if version == 1 else 0]
 
 
 @dataclass
@@ -13,7 +56,33 @@ class InFlightPiece:
     index: int
     length: int
     piece_bitfield_length: int
-    piece_bitfield: bytes
+    piece_bitfield: BytesLike
+
+    @classmethod
+    def from_buffer(
+        cls, buffer: BytesLike, version: int, offset: int = 0
+    ) -> Tuple["InFlightPiece", int]:
+        """
+        从内存中解析 piece_bitfield是buffer的切片而不是拷贝
+        :param buffer: bytes或memoryview
+        :param version: 控制文件的版本
+        :param offset: 起始位置
+        :return: (InFlightPiece, 结束位置)
+        """
+        view = buffer if isinstance(buffer, memoryview) else memoryview(buffer)
+        layout = _layout(version)
+        index, length, piece_bitfield_length = layout.piece.unpack_from(view, offset)
+        offset += layout.piece.size
+        end = offset + piece_bitfield_length
+        return (
+            cls(
+                index=index,
+                length=length,
+                piece_bitfield_length=piece_bitfield_length,
+                piece_bitfield=view[offset:end],  # type: ignore
+            ),
+            end,
+        )
 
     @classmethod
     def from_file(cls, file: IO[bytes], version: int) -> "InFlightPiece":
@@ -31,13 +100,102 @@ class InFlightPiece:
         )
 
     def save(self, file: IO[bytes], version: int) -> None:
-        file.write(self.index.to_bytes(4, "big" if version == 1 else "little"))
-        file.write(self.length.to_bytes(4, "big" if version == 1 else "little"))
         file.write(
-            len(self.piece_bitfield).to_bytes(4, "big" if version == 1 else "little")
+            _layout(version).piece.pack(
+                self.index, self.length, len(self.piece_bitfield)
+            )
         )
         file.write(self.piece_bitfield)
 
+    @property
+    def blocks(self) -> Bitfield:
+        """
+        分片内已完成的块
+        """
+        return Bitfield(self.piece_bitfield, -(-self.length // BLOCK_LENGTH))
+
+    @property
+    def completed_length(self) -> int:
+        return self.blocks.completed_length(BLOCK_LENGTH, self.length)
+
+
+class LazyInFlightPieces(Sequence):
+    """
+    第一次访问时才解析的inflight_pieces
+    由ControlFile.from_file(path, lazy=True)创建时持有文件的映射 解析完或者close()后释放
+    """
+
+    __slots__ = ("_buffer", "_version", "_offset", "_count", "_pieces", "_mapping")
+
+    def __init__(
+        self, buffer: memoryview, version: int, offset: int, count: int
+    ) -> None:
+        self._buffer: Optional[memoryview] = buffer
+        self._version = version
+        self._offset = offset
+        self._count = count
+        self._pieces: Optional[List[InFlightPiece]] = None
+        self._mapping: Optional[mmap.mmap] = None  # 需要关闭的映射
+
+    @property
+    def loaded(self) -> bool:
+        return self._pieces is not None
+
+    def _load(self) -> List[InFlightPiece]:
+        if self._pieces is None:
+            if self._buffer is None:
+                raise ValueError("inflight pieces were closed before being loaded")
+            pieces = []
+            offset = self._offset
+            for _ in range(self._count):
+                piece, offset = InFlightPiece.from_buffer(
+                    self._buffer, self._version, offset
+                )
+                if self._mapping is not None:  # 映射马上要关闭
+                    piece.piece_bitfield = bytes(piece.piece_bitfield)
+                pieces.append(piece)
+            self._pieces = pieces
+            self.close()
+        return self._pieces
+
+    def close(self) -> None:
+        """
+        释放底层的buffer和文件映射 还没解析时之后就不能再访问了
+        """
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    @overload
+    def __getitem__(self, index: int) -> InFlightPiece:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[InFlightPiece]:
+        ...
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __iter__(self) -> Iterator[InFlightPiece]:
+        return iter(self._load())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (list, LazyInFlightPieces)):
+            return self._load() == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        if self._pieces is None:
+            return f"<{self.__class__.__name__} count={self._count} not loaded>"
+        return repr(self._pieces)
+
 
 @dataclass
 class ControlFile:
@@ -53,51 +211,94 @@ class ControlFile:
     total_length: int
     upload_length: int
     bitfield_length: int
-    bitfield: bytes
+    bitfield: BytesLike
     num_inflight_piece: int
-    inflight_pieces: List[InFlightPiece]
+    inflight_pieces: Sequence[InFlightPiece]
 
     @classmethod
-    def from_file(cls, file: Union[str, Path, IO[bytes]]) -> "ControlFile":
-        should_close: bool = False
-        try:
-            if isinstance(file, (str, Path)):
-                file_ = open(file, "rb")
-                should_close = True
+    def from_file(
+        cls, file: Union[str, Path, IO[bytes]], lazy: bool = False
+    ) -> "ControlFile":
+        """
+        路径会被mmap后解析 bitfield拷贝出来 映射随即关闭
+        lazy时映射在inflight_pieces解析完或者close()之后才关闭 可以用with语句
+        :param file: 路径或二进制文件对象
+        :param lazy: 只解析头部 inflight_pieces在第一次访问时才解析 仅对路径有效
+        """
+        if isinstance(file, (str, Path)):
+            with open(file, "rb") as file_:
+                if not os.fstat(file_.fileno()).st_size:
+                    return cls._from_buffer(b"", lazy)[0]
+                mapping = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                control = cls._from_buffer(mapping, lazy)[0]
+            except ValueError as err:
+                traceback.clear_frames(err.__traceback__)  # 释放解析时创建的切片
+                mapping.close()
+                raise
+            control.bitfield = bytes(control.bitfield)
+            pieces = control.inflight_pieces
+            if isinstance(pieces, LazyInFlightPieces):
+                pieces._mapping = mapping
             else:
-                file_ = file  # type: ignore
-            version = int.from_bytes(file_.read(2), "big")
-            ext = file_.read(4)
-            info_hash_length = int.from_bytes(
-                file_.read(4), "big" if version == 1 else "little"
-            )
+                for piece in pieces:
+                    piece.piece_bitfield = bytes(piece.piece_bitfield)
+                mapping.close()
+            return control
+        data = file.read()
+        control, end = cls._from_buffer(data, False)
+        if end < len(data) and file.seekable():
+            file.seek(end - len(data), os.SEEK_CUR)  # 和逐字段读取一样停在文件末尾
+        return control
+
+    @classmethod
+    def from_buffer(cls, buffer: BytesLike, lazy: bool = False) -> "ControlFile":
+        """
+        从内存中解析 bitfield是buffer的切片而不是拷贝
+        :param buffer: bytes mmap或memoryview
+        :param lazy: inflight_pieces在第一次访问时才解析
+        """
+        return cls._from_buffer(buffer, lazy)[0]
+
+    @classmethod
+    def _from_buffer(cls, buffer: BytesLike, lazy: bool) -> Tuple["ControlFile", int]:
+        view = memoryview(buffer)
+        try:
+            (version,) = _VERSION.unpack_from(view, 0)
+            ext = bytes(view[2:6])
+            layout = _layout(version)
+            (info_hash_length,) = layout.u32.unpack_from(view, 6)
             if info_hash_length == 0 and ext[3] & 1 == 1:
                 raise ValueError(
                     '"infoHashCheck" extension is enabled but info hash length is 0'
                 )
-            info_hash = file_.read(info_hash_length)
-            piece_length = int.from_bytes(
-                file_.read(4), "big" if version == 1 else "little"
-            )
-            total_length = int.from_bytes(
-                file_.read(8), "big" if version == 1 else "little"
-            )
-            upload_length = int.from_bytes(
-                file_.read(8), "big" if version == 1 else "little"
-            )
-            bitfield_length = int.from_bytes(
-                file_.read(4), "big" if version == 1 else "little"
-            )
-            bitfield = file_.read(bitfield_length)
-            num_inflight_piece = int.from_bytes(
-                file_.read(4), "big" if version == 1 else "little"
-            )
-            inflight_pieces = [
-                InFlightPiece.from_file(file_, version)
-                for _ in range(num_inflight_piece)
-            ]
-
-            return cls(
+            offset = 10 + info_hash_length
+            info_hash = bytes(view[10:offset])
+            (
+                piece_length,
+                total_length,
+                upload_length,
+                bitfield_length,
+            ) = layout.lengths.unpack_from(view, offset)
+            offset += layout.lengths.size
+            bitfield = view[offset : offset + bitfield_length]
+            offset += bitfield_length
+            (num_inflight_piece,) = layout.u32.unpack_from(view, offset)
+            offset += 4
+            inflight_pieces: Sequence[InFlightPiece]
+            if lazy:
+                inflight_pieces = LazyInFlightPieces(
+                    view, version, offset, num_inflight_piece
+                )
+            else:
+                inflight_pieces = []
+                for _ in range(num_inflight_piece):
+                    piece, offset = InFlightPiece.from_buffer(view, version, offset)
+                    inflight_pieces.append(piece)
+        except struct.error as err:
+            raise ValueError(f"truncated control file: {err}") from err
+        return (
+            cls(
                 version=version,
                 ext=ext,
                 info_hash_length=info_hash_length,
@@ -106,45 +307,65 @@ class ControlFile:
                 total_length=total_length,
                 upload_length=upload_length,
                 bitfield_length=bitfield_length,
-                bitfield=bitfield,
+                bitfield=bitfield,  # type: ignore
                 num_inflight_piece=num_inflight_piece,
-                inflight_pieces=inflight_pieces,
-            )
-        finally:
-            if should_close:
-                try:
-                    file_.close()
-                except:
-                    pass
+                inflight_pieces=inflight_pieces,  # type: ignore
+            ),
+            offset,
+        )
+
+    def close(self) -> None:
+        """
+        释放lazy解析时持有的文件映射 已经解析的字段仍然可以访问
+        """
+        if isinstance(self.inflight_pieces, LazyInFlightPieces):
+            self.inflight_pieces.close()
+
+    def __enter__(self) -> "ControlFile":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
 
     def save(self, file: IO[bytes]) -> None:
+        layout = _layout(self.version)
         file.write(self.version.to_bytes(2, "big" if self.version == 1 else "little"))
         file.write(self.ext)
-        file.write(
-            len(self.info_hash).to_bytes(4, "big" if self.version == 1 else "little")
-        )
+        file.write(layout.u32.pack(len(self.info_hash)))
         file.write(self.info_hash)
         file.write(
-            self.piece_length.to_bytes(4, "big" if self.version == 1 else "little")
-        )
-        file.write(
-            self.total_length.to_bytes(8, "big" if self.version == 1 else "little")
-        )
-        file.write(
-            self.upload_length.to_bytes(8, "big" if self.version == 1 else "little")
-        )
-        file.write(
-            len(self.bitfield).to_bytes(4, "big" if self.version == 1 else "little")
-        )
-        file.write(self.bitfield)
-        file.write(
-            len(self.inflight_pieces).to_bytes(
-                4, "big" if self.version == 1 else "little"
+            layout.lengths.pack(
+                self.piece_length,
+                self.total_length,
+                self.upload_length,
+                len(self.bitfield),
             )
         )
+        file.write(self.bitfield)
+        file.write(layout.u32.pack(len(self.inflight_pieces)))
         for piece in self.inflight_pieces:
             piece.save(file, self.version)
 
+    @property
+    def num_pieces(self) -> int:
+        if not self.piece_length:
+            return 0
+        return -(-self.total_length // self.piece_length)
+
+    @property
+    def pieces(self) -> Bitfield:
+        """
+        已校验的分片
+        """
+        return Bitfield(self.bitfield, self.num_pieces)
+
+    @property
+    def completed_length(self) -> int:
+        """
+        已校验分片的总字节数 不包括下载中的分片
+        """
+        return self.pieces.completed_length(self.piece_length, self.total_length)
+
 
 @dataclass
 class NodeInfo:
@@ -152,6 +373,16 @@ class NodeInfo:
     compact_peer_info: tuple
     node_id: bytes
 
+    @classmethod
+    def from_buffer(cls, buffer: BytesLike, offset: int = 0) -> "NodeInfo":
+        """
+        从一条56字节的定长记录解析
+        """
+        plen, peer, node_id = _NODE.unpack_from(buffer, offset)
+        return cls(
+            plen=plen, compact_peer_info=_unpack_peer(plen, peer), node_id=node_id
+        )
+
     @classmethod
     def from_file(cls, file: IO[bytes]) -> "NodeInfo":
         plen = int.from_bytes(file.read(1), "big")
@@ -164,16 +395,146 @@ class NodeInfo:
         file.read(4)
         return cls(plen=plen, compact_peer_info=compact_peer_info, node_id=node_id)
 
+    def pack(self) -> bytes:
+        """
+        打包为56字节的定长记录
+        """
+        return _NODE.pack(
+            self.plen,
+            self.compact_peer_info[0].packed
+            + self.compact_peer_info[1].to_bytes(2, "big"),
+            self.node_id,
+        )
+
     def save(self, file: IO[bytes]) -> None:
-        file.write(self.plen.to_bytes(1, "big"))
-        file.write(b"\x00" * 7)
+        file.write(self.pack())
+
+
+# plen 7字节保留 24字节compact peer info 20字节node id 4字节保留
+_NODE = struct.Struct(">B7x24s20s4x")
+_DHT_HEADER = struct.Struct(">2s1s2s3xQ8x20s4xI4x")
+
+
+def _unpack_peer(plen: int, peer: bytes) -> tuple:
+    class_ = IPv4Address if plen == 6 else IPv6Address
+    return class_(peer[: plen - 2]), int.from_bytes(peer[plen - 2 : plen], "big")
+
+
+class NodeTable(Sequence):
+    """
+    dht节点表的列式视图 所有节点保存在一块连续的56字节定长记录中
+    访问元素时才构建NodeInfo和ip对象 去重合并都在整块数据上完成 安装了numpy时向量化
+    """
+
+    RECORD_SIZE = _NODE.size
+
+    __slots__ = ("_data",)
 
-        file.write(self.compact_peer_info[0].packed)
-        file.write(self.compact_peer_info[1].to_bytes(2, "big"))
+    def __init__(self, data: BytesLike = b"") -> None:
+        """
+        :param data: 若干条56字节的节点记录
+        """
+        if len(data) % self.RECORD_SIZE:
+            raise ValueError("node table size is not a multiple of 56")
+        self._data = memoryview(data)
 
-        file.write(b"\x00" * (24 - self.plen))
-        file.write(self.node_id)
-        file.write(b"\x00" * 4)
+    @classmethod
+    def from_nodes(cls, nodes: Iterable[NodeInfo]) -> "NodeTable":
+        return cls(b"".join(node.pack() for node in nodes))
+
+    def __len__(self) -> int:
+        return len(self._data) // self.RECORD_SIZE
+
+    @overload
+    def __getitem__(self, index: int) -> NodeInfo:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "NodeTable":
+        ...
+
+    def __getitem__(self, index):
+        size = self.RECORD_SIZE
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return NodeTable(self._data[start * size : stop * size])
+            return self.take(range(start, stop, step))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("node index out of range")
+        return NodeInfo.from_buffer(self._data, index * size)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, NodeTable):
+            return self._data == other._data
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} nodes={len(self)}>"
+
+    def _array(self) -> "np.ndarray":
+        return np.frombuffer(self._data, dtype=np.uint8).reshape(-1, self.RECORD_SIZE)
+
+    def node_id(self, index: int) -> bytes:
+        offset = index * self.RECORD_SIZE + 32
+        return self._data[offset : offset + 20].tobytes()
+
+    def node_ids(self) -> List[bytes]:
+        return [self.node_id(i) for i in range(len(self))]
+
+    def peer(self, index: int) -> tuple:
+        """
+        只构建一个节点的(ip, port)
+        """
+        plen, peer, _ = _NODE.unpack_from(self._data, index * self.RECORD_SIZE)
+        return _unpack_peer(plen, peer)
+
+    def take(self, indices: Iterable[int]) -> "NodeTable":
+        """
+        按下标挑选节点 生成新表
+        """
+        if np is not None:
+            return NodeTable(
+                self._array()[np.fromiter(indices, dtype=np.intp)].tobytes()
+            )
+        size = self.RECORD_SIZE
+        data = self._data
+        return NodeTable(b"".join(data[i * size : (i + 1) * size] for i in indices))
+
+    def dedupe(self) -> "NodeTable":
+        """
+        按node id去重 同一个id保留最后出现的记录 其余保持原有顺序
+        """
+        count = len(self)
+        if not count:
+            return self
+        if np is not None:
+            ids = np.ascontiguousarray(self._array()[:, 32:52]).view("V20").ravel()
+            _, index = np.unique(ids[::-1], return_index=True)
+            keep = np.sort(count - 1 - index)
+            if len(keep) == count:
+                return self
+            return NodeTable(self._array()[keep].tobytes())
+        last = {self.node_id(i): i for i in range(count)}
+        if len(last) == count:
+            return self
+        return self.take(sorted(last.values()))
+
+    def merge(self, *others: "NodeTable") -> "NodeTable":
+        """
+        合并多张表并去重 后面的表优先
+        """
+        data = bytearray(self._data)
+        for other in others:
+            data += other._data
+        return NodeTable(bytes(data)).dedupe()
+
+    def to_bytes(self) -> bytes:
+        return self._data.tobytes()
 
 
 @dataclass
@@ -188,57 +549,74 @@ class DHTFile:
     mtime: int
     localnode_id: bytes
     num_node: int
-    nodes: List[NodeInfo]
+    nodes: Sequence[NodeInfo]
 
     @classmethod
-    def from_file(cls, file: Union[str, Path, IO[bytes]]) -> "DHTFile":
-        should_close: bool = False
-        try:
-            if isinstance(file, (str, Path)):
-                file_ = open(file, "rb")
-                should_close = True
-            else:
-                file_ = file  # type: ignore
-            mgc = file_.read(2)
-            assert mgc == b"\xa1\xa2", "wrong magic number"
-            fmt = file_.read(1)
-            assert fmt == b"\x02", "wrong format idr"
-            ver = file_.read(2)
-            # assert ver == b'\x00\x03', "wrong version number"
-            file_.read(3)
-            mtime = int.from_bytes(file_.read(8), "big")
-            file_.read(8)
-            localnode_id = file_.read(20)
-            file_.read(4)
-            num_node = int.from_bytes(file_.read(4), "big")
-            file_.read(4)
-            nodes = [NodeInfo.from_file(file_) for _ in range(num_node)]
-            return cls(
-                mgc=mgc,
-                fmt=fmt,
-                ver=ver,
-                mtime=mtime,
-                localnode_id=localnode_id,
-                num_node=num_node,
-                nodes=nodes,
-            )
-        finally:
-            if should_close:
-                try:
-                    file_.close()
-                except:
-                    pass
+    def from_file(
+        cls, file: Union[str, Path, IO[bytes]], lazy: bool = False
+    ) -> "DHTFile":
+        """
+        一次读取整个文件
+        :param file: 路径或二进制文件对象
+        :param lazy: nodes为NodeTable 访问时才构建NodeInfo 适合批量合并和修剪
+        """
+        if isinstance(file, (str, Path)):
+            with open(file, "rb") as file_:
+                data = file_.read()
+        else:
+            data = file.read()
+        return cls.from_buffer(data, lazy)
+
+    @classmethod
+    def from_buffer(cls, buffer: BytesLike, lazy: bool = False) -> "DHTFile":
+        view = memoryview(buffer)
+        mgc, fmt, ver, mtime, localnode_id, num_node = _DHT_HEADER.unpack_from(view)
+        assert mgc == b"\xa1\xa2", "wrong magic number"
+        assert fmt == b"\x02", "wrong format idr"
+        # assert ver == b'\x00\x03', "wrong version number"
+        start = _DHT_HEADER.size
+        table = NodeTable(view[start : start + num_node * NodeTable.RECORD_SIZE])
+        if len(table) != num_node:
+            raise ValueError("truncated dht file")
+        nodes: Sequence[NodeInfo]
+        if lazy:
+            nodes = table
+        else:
+            nodes = [
+                NodeInfo(
+                    plen=plen,
+                    compact_peer_info=_unpack_peer(plen, peer),
+                    node_id=node_id,
+                )
+                for plen, peer, node_id in _NODE.iter_unpack(table._data)
+            ]
+        return cls(
+            mgc=mgc,
+            fmt=fmt,
+            ver=ver,
+            mtime=mtime,
+            localnode_id=localnode_id,
+            num_node=num_node,
+            nodes=nodes,
+        )
+
+    @property
+    def table(self) -> NodeTable:
+        """
+        节点的列式视图
+        """
+        if isinstance(self.nodes, NodeTable):
+            return self.nodes
+        return NodeTable.from_nodes(self.nodes)
 
     def save(self, file: IO[bytes]) -> None:
-        file.write(self.mgc)
-        file.write(self.fmt)
-        file.write(self.ver)
-        file.write(b"\x00" * 3)
-        file.write(self.mtime.to_bytes(8, "big"))
-        file.write(b"\x00" * 8)
-        file.write(self.localnode_id)
-        file.write(b"\x00" * 4)
-        file.write(len(self.nodes).to_bytes(4, "big"))
-        file.write(b"\x00" * 4)
-        for node in self.nodes:
-            node.save(file)
+        """
+        整个文件只调用一次write
+        """
+        table = self.table
+        file.write(
+            _DHT_HEADER.pack(
+                self.mgc, self.fmt, self.ver, self.mtime, self.localnode_id, len(table)
+            )
+            + table.to_bytes()
+        )
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+本模块提供aria2返回结果的类型化记录
+
+aria2把所有数字都以字符串返回 记录类只保存原始值 第一次访问时才转换为int/bool并缓存
+使用__slots__ 比字典小得多 适合大量缓存
+"""
+from typing import Any, Dict, Iterable, List, Optional, Type, TypeVar, Union
+
+from aioaria2.codec import JsonCodec, get_default_codec
+
+R = TypeVar("R", bound="Record")
+
+
+class _Field:
+    """
+    原样返回的字段 缺失时为None
+    """
+
+    __slots__ = ("slot",)
+
+    def __init__(self, slot: str) -> None:
+        self.slot = slot
+
+    def __get__(self, obj: Any, objtype: Any = None) -> Any:
+        if obj is None:
+            return self
+        return getattr(obj, self.slot, None)
+
+
+class _IntField(_Field):
+    __slots__ = ()
+
+    def __get__(self, obj: Any, objtype: Any = None) -> Any:
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot, None)
+        if isinstance(value, str):
+            value = int(value)
+            setattr(obj, self.slot, value)
+        return value
+
+
+class _BoolField(_Field):
+    __slots__ = ()
+
+    def __get__(self, obj: Any, objtype: Any = None) -> Any:
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot, None)
+        if isinstance(value, str):
+            value = value == "true"
+            setattr(obj, self.slot, value)
+        return value
+
+
+class _RecordListField(_Field):
+    """
+    嵌套的记录列表 比如tellStatus中的files
+    """
+
+    __slots__ = ("record",)
+
+    def __init__(self, slot: str, record: Type["Record"]) -> None:
+        super().__init__(slot)
+        self.record = record
+
+    def __get__(self, obj: Any, objtype: Any = None) -> Any:
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot, None)
+        if value and isinstance(value[0], dict):
+            value = self.record.from_list(value)
+            setattr(obj, self.slot, value)
+        return value
+
+
+class _RecordMeta(type):
+    """
+    根据_raw_fields _int_fields _bool_fields _record_fields生成槽位和描述符
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        fields: Dict[str, _Field] = {}
+        for key in namespace.get("_raw_fields", ()):
+            fields[key] = _Field("_" + key)
+        for key in namespace.get("_int_fields", ()):
+            fields[key] = _IntField("_" + key)
+        for key in namespace.get("_bool_fields", ()):
+            fields[key] = _BoolField("_" + key)
+        for key, record in namespace.get("_record_fields", {}).items():
+            fields[key] = _RecordListField("_" + key, record)
+        namespace["__slots__"] = tuple(field.slot for field in fields.values())
+        namespace.update(fields)
+        namespace["_fields"] = fields
+        namespace["_slots"] = {key: field.slot for key, field in fields.items()}
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class Record(metaclass=_RecordMeta):
+    """
+    记录类的基类 未知的key会被忽略
+    """
+
+    _fields: Dict[str, _Field]
+    _slots: Dict[str, str]
+
+    @classmethod
+    def from_dict(cls: Type[R], data: Dict[str, Any]) -> R:
+        self = cls.__new__(cls)
+        slots = cls._slots
+        for key, value in data.items():
+            slot = slots.get(key)
+            if slot is not None:
+                setattr(self, slot, value)
+        return self
+
+    @classmethod
+    def from_list(cls: Type[R], data: Iterable[Dict[str, Any]]) -> List[R]:
+        from_dict = cls.from_dict
+        return [from_dict(item) for item in data]
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        转换为字典 数字和布尔值已转换
+        """
+        result = {}
+        for key, field in self._fields.items():
+            value = getattr(self, key)
+            if value is None and not hasattr(self, field.slot):
+                continue
+            if isinstance(value, list) and value and isinstance(value[0], Record):
+                value = [item.as_dict() for item in value]
+            result[key] = value
+        return result
+
+    def __eq__(self, other: Any) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.as_dict()!r})"
+
+
+class FileInfo(Record):
+    """
+    aria2.getFiles的元素
+    """
+
+    _raw_fields = ("path", "uris")
+    _int_fields = ("index", "length", "completedLength")
+    _bool_fields = ("selected",)
+
+
+class PeerInfo(Record):
+    """
+    aria2.getPeers的元素
+    """
+
+    _raw_fields = ("peerId", "ip", "bitfield")
+    _int_fields = ("port", "downloadSpeed", "uploadSpeed")
+    _bool_fields = ("amChoking", "peerChoking", "seeder")
+
+
+class GlobalStat(Record):
+    """
+    aria2.getGlobalStat的结果
+    """
+
+    _int_fields = (
+        "downloadSpeed",
+        "uploadSpeed",
+        "numActive",
+        "numWaiting",
+        "numStopped",
+        "numStoppedTotal",
+    )
+
+
+class DownloadStatus(Record):
+    """
+    aria2.tellStatus的结果 也是tellActive tellWaiting tellStopped的元素
+    """
+
+    _raw_fields = (
+        "gid",
+        "status",
+        "bitfield",
+        "infoHash",
+        "errorMessage",
+        "followedBy",
+        "following",
+        "belongsTo",
+        "dir",
+        "bittorrent",
+    )
+    _int_fields = (
+        "totalLength",
+        "completedLength",
+        "uploadLength",
+        "downloadSpeed",
+        "uploadSpeed",
+        "numSeeders",
+        "pieceLength",
+        "numPieces",
+        "connections",
+        "errorCode",
+        "verifiedLength",
+    )
+    _bool_fields = ("seeder", "verifyIntegrityPending")
+    _record_fields = {"files": FileInfo}
+
+
+def decode_record(
+    data: Union[bytes, str], record: Type[R], codec: Optional[JsonCodec] = None
+) -> Union[R, List[R]]:
+    """
+    直接从jsonrpc响应的bytes构建记录
+    :param data: 完整的jsonrpc响应 或者result部分
+    :param record: 记录类
+    :param codec: json编解码器 默认自动选择
+    :return: result是数组时返回记录列表
+    """
+    result = (codec or get_default_codec()).loads(data)
+    if isinstance(result, dict) and "jsonrpc" in result:
+        result = result["result"]
+    if isinstance(result, list):
+        return record.from_list(result)
+    return record.from_dict(result)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+本模块用于批量扫描目录下的.aria2控制文件
+"""
+import os
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+from typing_extensions import Literal
+
+from aioaria2.parser import ControlFile
+
+CONTROL_FILE_SUFFIX = ".aria2"
+
+
+class ControlFileSummary(NamedTuple):
+    """
+    一个控制文件的摘要 error不为None时其他字段无意义
+    """
+
+    path: str
+    info_hash: bytes
+    total_length: int
+    piece_length: int
+    num_pieces: int
+    completed_pieces: int
+    completed_length: int
+    num_inflight_piece: int
+    error: Optional[str] = None
+
+
+class ScanStats:
+    """
+    扫描进度 在扫描过程中实时更新
+    """
+
+    def __init__(self) -> None:
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def files_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.files / elapsed if elapsed else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(files={self.files}, errors={self.errors}, "
+            f"elapsed={self.elapsed:.3f}s, files_per_second={self.files_per_second:.1f}, "
+            f"bytes_per_second={self.bytes_per_second:.1f})"
+        )
+
+
+def find_control_files(root: Union[str, Path]) -> Iterator[Tuple[str, int]]:
+    """
+    递归查找.aria2文件
+    :param root: 根目录
+    :return: (路径, 文件大小)
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(CONTROL_FILE_SUFFIX) and entry.is_file():
+                        yield entry.path, entry.stat().st_size
+                except OSError:
+                    continue
+
+
+def summarize(path: str) -> ControlFileSummary:
+    """
+    解析一个控制文件 只解析头部 不展开inflight pieces
+    """
+    try:
+        with ControlFile.from_file(path, lazy=True) as control:
+            pieces = control.pieces
+            return ControlFileSummary(
+                path=path,
+                info_hash=control.info_hash,
+                total_length=control.total_length,
+                piece_length=control.piece_length,
+                num_pieces=control.num_pieces,
+                completed_pieces=pieces.count(),
+                completed_length=pieces.completed_length(
+                    control.piece_length, control.total_length
+                ),
+                num_inflight_piece=control.num_inflight_piece,
+            )
+    except (OSError, ValueError) as err:
+        return ControlFileSummary(path, b"", 0, 0, 0, 0, 0, 0, error=str(err))
+
+
+def _summarize_chunk(paths: List[str]) -> List[ControlFileSummary]:
+    return [summarize(path) for path in paths]
+
+
+def _chunks(
+    files: Iterable[Tuple[str, int]], chunk_size: int
+) -> Iterator[Tuple[List[str], int]]:
+    paths: List[str] = []
+    size = 0
+    for path, file_size in files:
+        paths.append(path)
+        size += file_size
+        if len(paths) >= chunk_size:
+            yield paths, size
+            paths, size = [], 0
+    if paths:
+        yield paths, size
+
+
+def scan_control_files(
+    root: Union[str, Path],
+    workers: Optional[int] = None,
+    executor: Union[Literal["process", "thread"], Executor] = "process",
+    chunk_size: int = 64,
+    stats: Optional[ScanStats] = None,
+) -> Iterator[ControlFileSummary]:
+    """
+    并行扫描目录下的所有.aria2文件 按完成顺序逐个产出摘要
+    同时在途的任务数有上限 内存占用不随文件数量增长
+    :param root: 根目录
+    :param workers: 进程/线程数 默认为cpu数
+    :param executor: process使用进程池 thread使用线程池 也可以传入现成的Executor
+    :param chunk_size: 每个任务解析的文件数 越大进程间通信越少
+    :param stats: 传入一个ScanStats以获取实时的吞吐量
+    """
+    if stats is None:
+        stats = ScanStats()
+    workers = workers or os.cpu_count() or 1
+    if isinstance(executor, Executor):
+        pool, owned = executor, False
+    elif executor == "thread":
+        pool, owned = ThreadPoolExecutor(workers), True
+    else:
+        pool, owned = ProcessPoolExecutor(workers), True
+    chunks = _chunks(find_control_files(root), chunk_size)
+    pending: Set[Future] = set()
+    sizes = {}
+    try:
+        while True:
+            while len(pending) < workers * 2:
+                try:
+                    paths, size = next(chunks)
+                except StopIteration:
+                    break
+                future = pool.submit(_summarize_chunk, paths)
+                sizes[future] = size
+                pending.add(future)
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results = future.result()
+                stats.files += len(results)
+                stats.bytes += sizes.pop(future)
+                for summary in results:
+                    if summary.error is not None:
+                        stats.errors += 1
+                    yield summary
+    finally:
+        stats.finished = time.perf_counter()
+        for future in pending:
+            future.cancel()
+        if owned:
+            pool.shutdown(wait=True)
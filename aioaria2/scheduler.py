@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+本模块提供rpc请求的调度 按优先级限制并发和速率
+
+aria2的rpc服务是单线程的 大量addUri会拖慢界面需要的tellStatus/pause
+同一个aria2的所有客户端可以共用一个RequestScheduler
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from aioaria2.exceptions import Aria2rpcException
+
+PRIORITY_CONTROL = 0  # pause remove changeOption等 用户的操作
+PRIORITY_READ = 1  # tellStatus等只读请求
+PRIORITY_BULK = 2  # addUri等批量任务
+
+PRIORITY_NAMES = {
+    PRIORITY_CONTROL: "control",
+    PRIORITY_READ: "read",
+    PRIORITY_BULK: "bulk",
+}
+
+BULK_METHODS = frozenset(
+    (
+        "aria2.addUri",
+        "aria2.addTorrent",
+        "aria2.addMetalink",
+        "aria2.purgeDownloadResult",
+        "aria2.saveSession",
+    )
+)
+
+
+class TokenBucket:
+    """
+    令牌桶 每秒补充rate个令牌 最多积累burst个
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def delay(self, cost: float = 1.0) -> float:
+        """
+        还要等多少秒才有cost个令牌 cost超过burst时按burst计算
+        """
+        self._refill()
+        return max(0.0, (min(cost, self.burst) - self.tokens) / self.rate)
+
+    async def acquire(self, cost: float = 1.0) -> None:
+        """
+        等到有cost个令牌 cost超过burst时等到桶满后取走全部令牌
+        """
+        cost = min(cost, self.burst)
+        while not self.try_acquire(cost):
+            await asyncio.sleep(self.delay(cost))
+
+
+class WaitStats:
+    """
+    一个优先级的排队统计
+    """
+
+    __slots__ = ("dispatched", "dropped", "total_wait", "max_wait")
+
+    def __init__(self) -> None:
+        self.dispatched = 0
+        self.dropped = 0  # 因为超过期限被丢弃的请求
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float) -> None:
+        self.dispatched += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.dispatched if self.dispatched else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(dispatched={self.dispatched}, dropped={self.dropped}, "
+            f"mean_wait={self.mean_wait:.6f}, max_wait={self.max_wait:.6f})"
+        )
+
+
+class _Entry:
+    __slots__ = ("priority", "seq", "cost", "enqueued", "future", "timer")
+
+    def __init__(
+        self, priority: int, seq: int, cost: float, future: asyncio.Future
+    ) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.enqueued = time.monotonic()
+        self.future = future
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def __lt__(self, other: "_Entry") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RequestScheduler:
+    """
+    按优先级调度请求 每个优先级有自己的并发上限 所有请求共用一个令牌桶
+    高优先级的请求先拿到令牌 只读请求排队超过期限后直接失败 而不是发出过时的查询
+
+        scheduler = RequestScheduler(rate=200, deadlines={PRIORITY_READ: 2.0})
+        client = Aria2HttpClient(url, scheduler=scheduler)
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[int, Optional[int]]] = None,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        deadlines: Optional[Dict[int, float]] = None,
+        priorities: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """
+        :param limits: 优先级 -> 同时在途的请求数上限 None表示不限制
+            默认control 8 read 8 bulk 2
+        :param rate: 每秒最多发出的请求数 batch和multicall按其中的调用数计算 None表示不限速
+        :param burst: 令牌桶容量 默认等于rate
+        :param deadlines: 优先级 -> 只读请求最多排队的秒数 超过后以Aria2rpcException失败
+        :param priorities: 方法名 -> 优先级 覆盖默认的分类 例如{"aria2.tellStatus": 0}
+        """
+        self.limits: Dict[int, Optional[int]] = {
+            PRIORITY_CONTROL: 8,
+            PRIORITY_READ: 8,
+            PRIORITY_BULK: 2,
+            **(limits or {}),
+        }
+        self.bucket = TokenBucket(rate, burst) if rate is not None else None
+        self.deadlines = deadlines or {}
+        self.priorities = priorities or {}
+        self.metrics: Any = None  # MetricsHooks 由客户端设置
+        self.stats: Dict[int, WaitStats] = {}
+        self._running: Dict[int, int] = {}
+        self._queue: List[_Entry] = []  # 堆
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None  # 等待令牌的定时器
+
+    def priority_of(self, req_obj: Dict[str, Any], idempotent: bool) -> int:
+        """
+        请求的优先级 multicall和batch取其中最低的
+        """
+        method = req_obj["method"]
+        priority = self.priorities.get(method)
+        if priority is not None:
+            return priority
+        if method == "system.multicall":
+            calls = req_obj["params"][0]
+            if not calls:
+                return PRIORITY_READ
+            return max(
+                self.priority_of({"method": call.get("methodName")}, idempotent)
+                for call in calls
+            )
+        if method in BULK_METHODS:
+            return PRIORITY_BULK
+        return PRIORITY_READ if idempotent else PRIORITY_CONTROL
+
+    def __len__(self) -> int:
+        """
+        排队中的请求数
+        """
+        return sum(not entry.future.done() for entry in self._queue)
+
+    def running(self, priority: int) -> int:
+        return self._running.get(priority, 0)
+
+    def _has_capacity(self, priority: int) -> bool:
+        limit = self.limits.get(priority)
+        return limit is None or self._running.get(priority, 0) < limit
+
+    def _stats(self, priority: int) -> WaitStats:
+        stats = self.stats.get(priority)
+        if stats is None:
+            stats = self.stats[priority] = WaitStats()
+        return stats
+
+    def record_dropped(self, priority: int) -> None:
+        """
+        记录一个因为超过期限而没有发出的请求 例如batch队列中过期的请求
+        """
+        self._stats(priority).dropped += 1
+
+    def _record(self, priority: int, wait: float) -> None:
+        self._stats(priority).record(wait)
+        if self.metrics is not None:
+            self.metrics.on_queue_wait(
+                PRIORITY_NAMES.get(priority, str(priority)), wait
+            )
+
+    async def run(
+        self,
+        req_obj: Dict[str, Any],
+        send: Callable[[], Awaitable[Any]],
+        idempotent: bool = False,
+        cost: float = 1.0,
+    ) -> Any:
+        """
+        等到轮到这个请求时调用send
+        :param req_obj: 用于分类的请求
+        :param send: 真正发送请求的函数
+        :param idempotent: 是否只读 只有只读请求会因为超过期限被丢弃
+        :param cost: 消耗的令牌数
+        """
+        priority = self.priority_of(req_obj, idempotent)
+        await self.acquire(priority, cost, idempotent)
+        try:
+            return await send()
+        finally:
+            self.release(priority)
+
+    async def acquire(
+        self, priority: int, cost: float = 1.0, droppable: bool = False
+    ) -> None:
+        """
+        占用priority的一个并发名额 用完后必须调用release
+        :param droppable: 排队超过deadlines中的期限时抛出Aria2rpcException
+        """
+        if self.bucket is not None:
+            cost = min(cost, self.bucket.burst)  # 否则永远等不到足够的令牌
+        if (
+            not self._queue
+            and self._has_capacity(priority)
+            and (self.bucket is None or self.bucket.try_acquire(cost))
+        ):
+            self._running[priority] = self._running.get(priority, 0) + 1
+            self._record(priority, 0.0)
+            return
+        loop = asyncio.get_running_loop()
+        entry = _Entry(priority, next(self._seq), cost, loop.create_future())
+        deadline = self.deadlines.get(priority) if droppable else None
+        if deadline is not None:
+            entry.timer = loop.call_later(deadline, self._expire, entry)
+        heapq.heappush(self._queue, entry)
+        self._pump()
+        try:
+            await entry.future
+        except asyncio.CancelledError:
+            if entry.future.done() and not entry.future.cancelled():
+                self.release(priority)  # 已经拿到名额时被取消
+            raise
+        finally:
+            if entry.timer is not None:
+                entry.timer.cancel()
+
+    def release(self, priority: int) -> None:
+        self._running[priority] -= 1
+        self._pump()
+
+    def _expire(self, entry: _Entry) -> None:
+        if entry.future.done():
+            return
+        self.record_dropped(entry.priority)
+        entry.future.set_exception(
+            Aria2rpcException(
+                f"request dropped after waiting {time.monotonic() - entry.enqueued:.3f}s in the scheduler"
+            )
+        )
+
+    def _pump(self) -> None:
+        """
+        按优先级放行排队的请求 直到没有名额或者没有令牌
+        """
+        queue = self._queue
+        skipped: List[_Entry] = []  # 所在优先级没有名额的请求
+        while queue:
+            entry = heapq.heappop(queue)
+            if entry.future.done():  # 已经过期或者被取消
+                continue
+            if not self._has_capacity(entry.priority):
+                skipped.append(entry)
+                continue
+            if self.bucket is not None and not self.bucket.try_acquire(entry.cost):
+                skipped.append(entry)  # 令牌留给优先级最高的请求
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(
+                        self.bucket.delay(entry.cost), self._on_refill
+                    )
+                break
+            self._running[entry.priority] = self._running.get(entry.priority, 0) + 1
+            self._record(entry.priority, time.monotonic() - entry.enqueued)
+            entry.future.set_result(None)
+        for entry in skipped:
+            heapq.heappush(queue, entry)
+
+    def _on_refill(self) -> None:
+        self._timer = None
+        self._pump()
+
+
+class RequestQueue(asyncio.Queue):
+    """
+    batch模式的请求队列 先进先出 记录每个请求入队的时间
+    """
+
+    def _init(self, maxsize: int) -> None:
+        self._queue: Deque[Tuple[float, Any]] = deque()
+        self._last_enqueued = 0.0
+
+    def _put(self, item: Any) -> None:
+        self._queue.append((time.monotonic(), item))
+
+    def _get(self) -> Any:
+        self._last_enqueued, item = self._queue.popleft()
+        return item
+
+    def oldest_wait(self) -> float:
+        """
+        最早入队的请求已经等了多少秒
+        """
+        return time.monotonic() - self._queue[0][0] if self._queue else 0.0
+
+    def drain(self) -> List[Tuple[float, Any]]:
+        """
+        取出全部请求
+        :return: [(等待的秒数, 请求), ...]
+        """
+        now = time.monotonic()
+        items = []
+        while not self.empty():
+            item = self.get_nowait()
+            items.append((now - self._last_enqueued, item))
+        return items
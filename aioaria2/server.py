@@ -5,8 +5,21 @@
 
 import asyncio
 import os
+import random
+import socket
 import subprocess
+import tempfile
 import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import aiohttp
+
+from aioaria2.exceptions import Aria2rpcException
+
+if TYPE_CHECKING:
+    from aioaria2.client import Aria2HttpClient
+    from aioaria2.cluster import Aria2Cluster, Placement
 
 # --------------------------#
 
@@ -38,13 +51,21 @@ ENCODING = "gbk"
 
 
 class SingletonType(type):
+    """
+    每个类各自只有一个实例 子类不会拿到父类的实例
+    类属性_singleton为False时不再是单例
+    """
+
     _instance_lock = threading.Lock()
 
     def __call__(cls, *args, **kwargs):
-        if not hasattr(cls, "_instance"):
+        if not getattr(cls, "_singleton", True):
+            return super().__call__(*args, **kwargs)
+        if "_instance" not in cls.__dict__:
             with cls._instance_lock:  # 加锁
-                cls._instance = super().__call__(*args, **kwargs)
-        return cls._instance
+                if "_instance" not in cls.__dict__:
+                    cls._instance = super().__call__(*args, **kwargs)
+        return cls.__dict__["_instance"]
 
 
 class Aria2Server(metaclass=SingletonType):
@@ -113,11 +134,130 @@ class AsyncAria2Server(Aria2Server):
 
     def __init__(self, *args: str, daemon=False):
         super().__init__(*args, daemon=daemon)
+        self.startup_latency: Optional[float] = None  # 从启动到rpc可用的秒数
+        self.version: Optional[Dict[str, Any]] = None  # 就绪时getVersion的结果
+        self._started_at = 0.0
+        self._ready_task: Optional[asyncio.Task] = None
 
-    async def start(self) -> None:  # type: ignore
+    async def start(self, ready: bool = False, timeout: float = 10.0) -> None:  # type: ignore
+        """
+        :param ready: 等到rpc可用再返回 参考wait_ready
+        :param timeout: 等待rpc的超时
+        """
+        if self._ready_task is not asyncio.current_task():
+            self._ready_task = None  # 上一次启动的结果 重启后不再适用
         program, *args = self.cmd
+        self._started_at = time.perf_counter()
         self.process = await asyncio.create_subprocess_exec(program, *args)  # type: ignore
         self._is_running = True
+        if ready:
+            await self._poll_ready(timeout=timeout)
+
+    def option(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """
+        命令行中的aria2参数 写在--conf-path里的参数取不到
+        :param name: 不带--的参数名 例如rpc-listen-port
+        """
+        prefix = f"--{name}="
+        for arg in reversed(self.cmd):
+            if arg.startswith(prefix):
+                return arg[len(prefix) :]
+        return default
+
+    @property
+    def rpc_url(self) -> str:
+        return f"http://127.0.0.1:{self.option('rpc-listen-port', '6800')}/jsonrpc"
+
+    async def wait_ready(
+        self,
+        url: Optional[str] = None,
+        token: Optional[str] = None,
+        timeout: float = 10.0,
+        client: Optional["Aria2HttpClient"] = None,
+    ) -> float:
+        """
+        轮询getVersion 间隔从5ms开始增长到100ms 一旦rpc可用就返回
+        :param url: rpc地址 默认根据--rpc-listen-port推断
+        :param token: rpc密码 默认取--rpc-secret
+        :param timeout: 超时 超时或者进程退出时抛出Aria2rpcException
+        :param client: 用现成的客户端轮询
+        :return: 从启动到rpc可用的秒数 也保存在startup_latency
+        """
+        if self._ready_task is not None:
+            return await asyncio.shield(self._ready_task)
+        if self.process is None:
+            raise Aria2rpcException(
+                "aria2 is not started, call start() or prewarm() first"
+            )
+        return await self._poll_ready(url, token, timeout, client)
+
+    def prewarm(
+        self,
+        url: Optional[str] = None,
+        token: Optional[str] = None,
+        timeout: float = 10.0,
+    ) -> asyncio.Task:
+        """
+        在后台启动aria2并等待rpc可用 程序的其他部分可以同时初始化
+        之后调用wait_ready会等待这个任务
+        :return: 结果为startup_latency的任务
+        """
+        if self._ready_task is None:
+            self._ready_task = asyncio.create_task(
+                self._start_ready(url, token, timeout)
+            )
+        return self._ready_task
+
+    async def _start_ready(
+        self, url: Optional[str], token: Optional[str], timeout: float
+    ) -> float:
+        await self.start()
+        return await self._poll_ready(url, token, timeout)
+
+    async def _poll_ready(
+        self,
+        url: Optional[str] = None,
+        token: Optional[str] = None,
+        timeout: float = 10.0,
+        client: Optional["Aria2HttpClient"] = None,
+    ) -> float:
+        own_client = client is None
+        if client is None:
+            from aioaria2.client import Aria2HttpClient
+
+            client = Aria2HttpClient(
+                url or self.rpc_url,
+                token=token if token is not None else self.option("rpc-secret"),
+            )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = 0.005
+        try:
+            while True:
+                if self.process.returncode is not None:
+                    raise Aria2rpcException(
+                        f"aria2 exited with code {self.process.returncode}",
+                        connection_error=True,
+                    )
+                try:
+                    self.version = await client.getVersion()  # type: ignore
+                    break
+                except Aria2rpcException as err:
+                    if not err.connection_error and err.__cause__ is None:
+                        break  # 有响应 只是被拒绝了 比如密码不对
+                except (aiohttp.ClientError, ValueError):
+                    pass
+                if loop.time() >= deadline:
+                    raise Aria2rpcException(
+                        f"aria2 rpc not ready after {timeout}s", connection_error=True
+                    )
+                await asyncio.sleep(delay)
+                delay = min(delay * 1.5, 0.1)
+        finally:
+            if own_client:
+                await client.close()
+        self.startup_latency = time.perf_counter() - self._started_at
+        return self.startup_latency
 
     async def wait(self) -> int:  # type: ignore
         code = await self.process.wait()  # type: ignore
@@ -141,4 +281,250 @@ class AsyncAria2Server(Aria2Server):
             await self.terminate()
 
 
-pass
+class _PooledAria2Server(AsyncAria2Server):
+    """
+    进程池里的aria2 端口各不相同 不需要单例
+    """
+
+    _singleton = False
+
+
+def _free_port(host: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class PoolMember:
+    """
+    进程池中的一个aria2 重启后端口和会话文件保持不变
+    """
+
+    def __init__(
+        self, index: int, port: int, session: str, client: "Aria2HttpClient"
+    ) -> None:
+        self.index = index
+        self.port = port
+        self.session = session  # 会话文件 重启时从这里恢复下载
+        self.client = client
+        self.server: Optional[AsyncAria2Server] = None
+        self.ready = asyncio.Event()
+        self.restarts = 0
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def url(self) -> str:
+        return self.client.url
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(index={self.index}, url={self.url!r}, "
+            f"ready={self.ready.is_set()}, restarts={self.restarts})"
+        )
+
+
+class AsyncAria2ServerPool:
+    """
+    一组由本进程管理的aria2 每个使用不同的rpc端口和会话文件
+    崩溃的aria2会按指数退避自动重启
+    """
+
+    def __init__(
+        self,
+        *args: str,
+        size: Optional[int] = None,
+        host: str = "127.0.0.1",
+        ports: Optional[List[int]] = None,
+        session_dir: Optional[str] = None,
+        token: Optional[str] = None,
+        daemon: bool = True,
+        restart: bool = True,
+        restart_interval: float = 0.5,
+        max_restart_interval: float = 30.0,
+        ready_timeout: float = 10.0,
+    ):
+        """
+        :param args: 启动aria2的命令行参数 rpc端口 会话文件和密码由进程池添加
+        :param size: aria2的数量 默认为cpu数
+        :param host: 客户端连接的地址
+        :param ports: 每个aria2的rpc端口 默认自动分配空闲端口
+        :param session_dir: 存放会话文件的目录 默认为临时目录
+        :param token: rpc密码
+        :param daemon: aria2随python解释器同生共死
+        :param restart: 崩溃后自动重启
+        :param restart_interval: 第一次重启前等待的秒数 之后指数增长
+        :param max_restart_interval: 重启间隔的上限 稳定运行超过这么久后间隔重新计算
+        :param ready_timeout: 等待rpc可用的超时
+        """
+        self.cmd = list(args)
+        self.size = size or (len(ports) if ports else os.cpu_count() or 1)
+        if ports is not None and len(ports) != self.size:
+            raise ValueError("len(ports) must equal size")
+        self.host = host
+        self.ports = ports
+        self.session_dir = session_dir
+        self.token = token
+        self.daemon = daemon
+        self.restart = restart
+        self.restart_interval = restart_interval
+        self.max_restart_interval = max_restart_interval
+        self.ready_timeout = ready_timeout
+        self.members: List[PoolMember] = []
+        self._closing = False
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._next = 0
+
+    def _args(self, member: PoolMember) -> List[str]:
+        args = [
+            "--enable-rpc=true",
+            f"--rpc-listen-port={member.port}",
+            f"--save-session={member.session}",
+            f"--input-file={member.session}",
+        ]
+        if self.token is not None:
+            args.append(f"--rpc-secret={self.token}")
+        return args
+
+    async def start(self) -> "AsyncAria2ServerPool":
+        """
+        启动所有aria2 等待它们的rpc可用
+        """
+        from aioaria2.client import Aria2HttpClient
+
+        if self.session_dir is None:
+            self.session_dir = tempfile.mkdtemp(prefix="aioaria2-")
+        os.makedirs(self.session_dir, exist_ok=True)
+        self._session = aiohttp.ClientSession()
+        for index in range(self.size):
+            port = self.ports[index] if self.ports else _free_port(self.host)
+            session = os.path.join(self.session_dir, f"aria2-{index}.session")
+            if not os.path.exists(session):  # --input-file不存在时aria2拒绝启动
+                open(session, "a").close()
+            client = Aria2HttpClient(
+                f"http://{self.host}:{port}/jsonrpc",
+                token=self.token,
+                client_session=self._session,
+            )
+            self.members.append(PoolMember(index, port, session, client))
+        for member in self.members:
+            member.task = asyncio.create_task(self._supervise(member))
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*[member.ready.wait() for member in self.members]),
+                self.ready_timeout,
+            )
+        except asyncio.TimeoutError:
+            await self.close()
+            raise Aria2rpcException("aria2 did not become ready", connection_error=True)
+        return self
+
+    async def _supervise(self, member: PoolMember) -> None:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while not self._closing:
+            member.server = _PooledAria2Server(
+                *self.cmd, *self._args(member), daemon=self.daemon
+            )
+            started = loop.time()
+            try:
+                await member.server.start()
+            except OSError:
+                pass
+            else:
+                try:
+                    await member.server.wait_ready(
+                        timeout=self.ready_timeout, client=member.client
+                    )
+                except Aria2rpcException:
+                    if member.server.returncode is None:  # 启动超时
+                        await member.server.kill()
+                    else:
+                        await member.server.wait()
+                else:
+                    member.ready.set()
+                    await member.server.wait()
+            member.ready.clear()
+            if self._closing or not self.restart:
+                return
+            if loop.time() - started > self.max_restart_interval:
+                attempt = 0  # 稳定运行了一段时间 不是连续崩溃
+            delay = min(
+                self.max_restart_interval,
+                self.restart_interval * 2 ** min(attempt, 32),
+            )
+            attempt += 1
+            member.restarts += 1
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    @property
+    def ready_clients(self) -> List["Aria2HttpClient"]:
+        """
+        rpc可用的aria2的客户端
+        """
+        return [member.client for member in self.members if member.ready.is_set()]
+
+    async def acquire(self, timeout: Optional[float] = None) -> "Aria2HttpClient":
+        """
+        轮流返回rpc可用的客户端 都不可用时等待
+        :param timeout: 等待的超时 默认为ready_timeout
+        """
+        ready = [member for member in self.members if member.ready.is_set()]
+        if not ready:
+            waiters = [
+                asyncio.create_task(member.ready.wait()) for member in self.members
+            ]
+            try:
+                done, _ = await asyncio.wait(
+                    waiters,
+                    timeout=self.ready_timeout if timeout is None else timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+            ready = [member for member in self.members if member.ready.is_set()]
+            if not ready:
+                raise Aria2rpcException("no aria2 is ready", connection_error=True)
+        self._next += 1
+        return ready[self._next % len(ready)].client
+
+    def cluster(self, placement: Optional["Placement"] = None) -> "Aria2Cluster":
+        """
+        以进程池中的所有aria2组成集群 节点名为序号
+        客户端仍由进程池管理 关闭集群不会关闭它们
+        """
+        from aioaria2.cluster import Aria2Cluster
+
+        return Aria2Cluster(
+            {str(member.index): member.client for member in self.members},
+            placement,
+            owns_clients=False,
+        )
+
+    async def close(self) -> None:
+        """
+        结束所有aria2 会话文件会被保存
+        """
+        self._closing = True
+        tasks = [member.task for member in self.members if member.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(
+            *[
+                member.server.terminate()
+                for member in self.members
+                if member.server is not None
+                and member.server.process is not None
+                and member.server.returncode is None
+            ],
+            return_exceptions=True,
+        )
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self) -> "AsyncAria2ServerPool":
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
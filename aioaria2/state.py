@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+本模块提供由websocket通知驱动的下载状态镜像
+"""
+import asyncio
+from collections import defaultdict
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    DefaultDict,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+)
+
+from aioaria2.client import MAX_RESULTS, RECONNECT_EVENT
+
+if TYPE_CHECKING:
+    from aioaria2.client import Aria2WebsocketClient
+
+"""
+状态变化的回调函数 (cache, gid, old, new) old为None表示新出现 new为None表示已从aria2中消失
+"""
+ChangeCallBack = Callable[
+    ["DownloadStateCache", str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]],
+    Awaitable[Any],
+]
+
+NOTIFICATIONS = (
+    "aria2.onDownloadStart",
+    "aria2.onDownloadPause",
+    "aria2.onDownloadStop",
+    "aria2.onDownloadComplete",
+    "aria2.onDownloadError",
+    "aria2.onBtDownloadComplete",
+)
+
+
+class DownloadStateCache:
+    """
+    下载状态的本地镜像
+    先用一次multicall取得全部快照 之后只刷新收到通知的gid
+    """
+
+    def __init__(
+        self,
+        client: "Aria2WebsocketClient",
+        keys: Optional[List[str]] = None,
+        debounce: float = 0.05,
+        active_interval: Optional[float] = None,
+    ):
+        """
+        :param client: 已连接的normal模式websocket客户端 batch和format模式拿不到multicall的结果
+        :param keys: 只缓存这些key 参考tellStatus 为空表示全部 gid和status总会被包含
+        :param debounce: 收到通知后等待多久再刷新 窗口内的通知合并为一次multicall
+        :param active_interval: 如果设置 每隔这么多秒用一次tellActive刷新活动下载的进度
+        """
+        if client.mode != "normal":
+            raise ValueError(
+                f"DownloadStateCache needs a normal mode client, got {client.mode!r}"
+            )
+        self.client = client
+        if keys:
+            keys = list(dict.fromkeys(["gid", "status", *keys]))
+        self.keys = keys
+        self.debounce = debounce
+        self.active_interval = active_interval
+        self._downloads: Dict[str, Dict[str, Any]] = {}
+        self._by_status: DefaultDict[str, Set[str]] = defaultdict(set)
+        self._dirty: Set[str] = set()
+        self._refresh_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._active_task: Optional[asyncio.Task] = None
+        self.listeners: List[ChangeCallBack] = []
+
+    # ----------------------查询----------------------------
+
+    def __len__(self) -> int:
+        return len(self._downloads)
+
+    def __contains__(self, gid: str) -> bool:
+        return gid in self._downloads
+
+    def __getitem__(self, gid: str) -> Dict[str, Any]:
+        return self._downloads[gid]
+
+    def get(self, gid: str, default: Any = None) -> Any:
+        return self._downloads.get(gid, default)
+
+    def by_status(self, status: str) -> Set[str]:
+        """
+        取得某种状态的所有gid
+        :param status: active waiting paused error complete removed
+        """
+        return self._by_status.get(status, set())
+
+    @property
+    def dirty(self) -> Set[str]:
+        return set(self._dirty)
+
+    # ----------------------生命周期----------------------------
+
+    async def start(self) -> "DownloadStateCache":
+        """
+        注册通知回调并取得完整快照
+        """
+        for method in NOTIFICATIONS:
+            self.client.register(self._on_notification, method)
+        self.client.register(self._on_reconnect, RECONNECT_EVENT)
+        await self.seed()
+        if self.active_interval is not None:
+            self._active_task = asyncio.create_task(self._poll_active())
+        return self
+
+    async def close(self) -> None:
+        for method in NOTIFICATIONS:
+            self.client.unregister(self._on_notification, method)
+        self.client.unregister(self._on_reconnect, RECONNECT_EVENT)
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+        tasks = list(self._tasks)
+        if self._active_task is not None:
+            tasks.append(self._active_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __aenter__(self) -> "DownloadStateCache":
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    def on_change(self, func: ChangeCallBack) -> ChangeCallBack:
+        """
+        注册状态变化回调 推荐作为装饰器使用
+        """
+        self.listeners.append(func)
+        return func
+
+    # ----------------------同步----------------------------
+
+    def _params(self, *params: Any) -> List[Any]:
+        return [*params, self.keys] if self.keys else list(params)
+
+    async def seed(self) -> None:
+        """
+        用一次multicall取得active waiting stopped的完整快照 替换现有的缓存
+        """
+        results = await self.client.multicall(
+            [
+                {"methodName": "aria2.tellActive", "params": self._params()},
+                {
+                    "methodName": "aria2.tellWaiting",
+                    "params": self._params(0, MAX_RESULTS),
+                },
+                {
+                    "methodName": "aria2.tellStopped",
+                    "params": self._params(0, MAX_RESULTS),
+                },
+            ]
+        )
+        seen: Dict[str, Dict[str, Any]] = {}
+        for result in results:
+            if isinstance(result, list):
+                for status in result[0]:
+                    seen[status["gid"]] = status
+        changes = [
+            (gid, old, None) for gid, old in self._downloads.items() if gid not in seen
+        ]
+        for gid, status in seen.items():
+            old = self._downloads.get(gid)
+            if old != status:
+                changes.append((gid, old, status))
+        self._downloads.clear()
+        self._by_status.clear()
+        self._dirty.clear()
+        for gid, status in seen.items():
+            self._set(gid, status)
+        await self._emit(changes)
+
+    async def refresh(self, gids: Optional[Iterable[str]] = None) -> None:
+        """
+        刷新指定的gid 默认刷新所有收到通知的gid
+        :param gids: 要刷新的gid 为None时刷新dirty集合
+        """
+        if gids is None:
+            gids, self._dirty = self._dirty, set()
+        gids = list(gids)
+        if not gids:
+            return
+        try:
+            results = await self.client.multicall(
+                [
+                    {"methodName": "aria2.tellStatus", "params": self._params(gid)}
+                    for gid in gids
+                ]
+            )
+        except Exception:
+            self._dirty.update(gids)  # 下次再试
+            raise
+        changes = []
+        for gid, result in zip(gids, results):
+            old = self._downloads.get(gid)
+            if isinstance(result, list):
+                new = result[0]
+                self._set(gid, new)
+            else:  # {'faultCode':1,'faultString':'GID xxx is not found'}
+                new = None
+                self._discard(gid)
+            if old != new:
+                changes.append((gid, old, new))
+        await self._emit(changes)
+
+    async def refresh_active(self) -> None:
+        """
+        用一次tellActive刷新所有活动下载 进度类字段的变化不会产生通知
+        """
+        active = await self.client.tellActive(self.keys)
+        changes = []
+        for status in active:
+            gid = status["gid"]
+            old = self._downloads.get(gid)
+            self._set(gid, status)
+            if old != status:
+                changes.append((gid, old, status))
+        # 不再活动但没收到通知的下载
+        gone = self.by_status("active") - {status["gid"] for status in active}
+        self._dirty.update(gone)
+        await self._emit(changes)
+        if gone:
+            await self.refresh()
+
+    def _set(self, gid: str, status: Dict[str, Any]) -> None:
+        old = self._downloads.get(gid)
+        if old is not None and old.get("status") != status.get("status"):
+            self._by_status[old.get("status")].discard(gid)  # type: ignore
+        self._downloads[gid] = status
+        self._by_status[status.get("status")].add(gid)  # type: ignore
+
+    def _discard(self, gid: str) -> None:
+        old = self._downloads.pop(gid, None)
+        if old is not None:
+            self._by_status[old.get("status")].discard(gid)  # type: ignore
+
+    async def _emit(self, changes: list) -> None:
+        if not changes or not self.listeners:
+            return
+        await asyncio.gather(
+            *[
+                func(self, gid, old, new)
+                for gid, old, new in changes
+                for func in self.listeners
+            ]
+        )
+
+    async def _on_notification(self, client: Any, data: Dict[str, Any]) -> None:
+        for param in data.get("params", []):
+            self._dirty.add(param["gid"])
+        if self._refresh_handle is None:
+            self._refresh_handle = asyncio.get_running_loop().call_later(
+                self.debounce, self._schedule_refresh
+            )
+
+    async def _on_reconnect(self, client: Any, data: Dict[str, Any]) -> None:
+        # 断线期间可能错过了进度变化 重新取一次完整快照
+        try:
+            await self.seed()
+        except Exception:
+            pass
+
+    def _schedule_refresh(self) -> None:
+        self._refresh_handle = None
+        task = asyncio.create_task(self._refresh_dirty())
+        self._tasks.add(task)  # add a strong ref
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh_dirty(self) -> None:
+        try:
+            await self.refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+
+    async def _poll_active(self) -> None:
+        while True:
+            await asyncio.sleep(self.active_interval)  # type: ignore
+            try:
+                await self.refresh_active()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
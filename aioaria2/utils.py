@@ -4,17 +4,30 @@
 """
 import asyncio
 import base64
+import binascii
 import contextvars
 import json
+import os
 import sys
 from functools import partial, wraps
-from typing import Any, Awaitable, Callable, Dict, Generator, Optional
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Union,
+)
 
 import aiofiles
 
 from aioaria2.exceptions import Aria2rpcException
 
 JSON_ENCODING = "utf-8"
+B64_CHUNK_SIZE = 3 * 256 * 1024  # 3的倍数 每块的编码结果可以直接拼接
 DEFAULT_JSON_DECODER = json.loads
 DEFAULT_JSON_ENCODER = json.dumps
 
@@ -26,59 +39,129 @@ def __init__():
 class ResultStore:
     """
     websocket 结果缓存类
+    每个连接持有一个实例 id空间和未完成的请求互不干扰
     """
 
-    _id = 1  # jsonrpc的id
-    _futures: Dict[int, asyncio.Future] = {}  # 暂存id对应的未来对象
+    def __init__(self) -> None:
+        self._id = 1  # jsonrpc的id
+        self._futures: Dict[Any, asyncio.Future] = {}  # 暂存id对应的未来对象
 
-    @classmethod
-    def get_id(cls) -> int:
+    def __len__(self) -> int:
+        return len(self._futures)
+
+    def get_id(self) -> int:
         """
         jsonrpc的自增id 默认的id生成工厂函数
         :return:
         """
-        s = cls._id
-        cls._id = (cls._id + 1) % sys.maxsize
+        s = self._id
+        self._id = (self._id + 1) % sys.maxsize
         return s
 
-    @classmethod
-    def add_result(cls, result: Dict[str, Any]) -> None:
+    def register(self, identity: Any) -> asyncio.Future:
+        """
+        在发送请求之前登记一个future 这样即使响应先于fetch到达也不会丢失
+        :param identity: jsonrpc请求的id
+        :return:
+        """
+        future = self._futures.get(identity)
+        if future is None or future.done():
+            future = asyncio.get_running_loop().create_future()
+            self._futures[identity] = future
+        return future
+
+    def discard(self, identity: Any) -> None:
+        """
+        放弃一个已登记的请求 比如发送失败的时候
+        """
+        future = self._futures.pop(identity, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    def add_result(self, result: Dict[str, Any]) -> bool:
         """
         收到websocket消息的时候,用这个类存储结果 表示一次特定的请求返回了
+        没有人等待的响应会被直接丢弃
         :param result: jsonrpc的回复格式 {'id':int,'jsonrpc','2.0','result':xxx}
-        :return:
+        :return: 是否有请求在等待这个结果
+        """
+        future = self._futures.get(result.get("id"))
+        if future is None or future.done():
+            return False
+        future.set_result(result)
+        return True
+
+    def fail_all(self, exc: BaseException) -> None:
         """
-        if isinstance(result, dict):
-            future = cls._futures.get(result["id"])
-            if not future or future.done():
-                # 没有这个future fetch没有被调用 future=None
-                future = asyncio.get_running_loop().create_future()
-                cls._futures[result["id"]] = future
-            future.set_result(result)
-
-    @classmethod
+        连接断开时 让所有未完成的请求立即失败
+        :param exc: 设置给每个future的异常
+        """
+        futures, self._futures = self._futures, {}
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(exc)
+
     async def fetch(
-        cls, identity: int, timeout: Optional[float] = None
+        self, identity: Any, timeout: Optional[float] = None
     ) -> Dict[str, Any]:
         """
-        返回暂存在本类中的结果
+        返回暂存在本类中的结果 调用前必须先register
         :param identity: jsonrpc返回的id
         :param timeout: 等待结果超时
         :return: 返回完整的jsonrpc 返回数据而不是仅仅有result字段 判断在后续来处理
         """
-        if cls._futures.get(identity):  # 已经存在这个id的future了 不用创建了
-            future = cls._futures[identity]
-        else:
-            future = (
-                asyncio.get_running_loop().create_future()
-            )  # todo 可能会导致Future泄漏吗?
-            cls._futures[identity] = future
+        future = self._futures.get(identity)
+        if future is None:
+            future = self.register(identity)
+        handle = None
+        if timeout is not None:
+            handle = asyncio.get_running_loop().call_later(
+                timeout, _set_timeout, future
+            )
         try:
-            return await asyncio.wait_for(future, timeout)
-        except asyncio.TimeoutError:
-            raise Aria2rpcException("jsonrpc over websocket call timeout") from None
+            return await future
         finally:
-            del cls._futures[identity]
+            if handle is not None:
+                handle.cancel()
+            if self._futures.get(identity) is future:
+                del self._futures[identity]
+
+
+def _set_timeout(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_exception(Aria2rpcException("jsonrpc over websocket call timeout"))
+
+
+def unpack_batch(
+    req_objs: List[Dict[str, Any]], responses: Any
+) -> List[Union[Any, Aria2rpcException]]:
+    """
+    按id把jsonrpc batch的响应数组分配回每个请求
+    :param req_objs: 发送的请求数组
+    :param responses: aria2返回的响应数组
+    :return: 与req_objs顺序一致的结果 失败的请求对应一个Aria2rpcException实例
+    """
+    if not isinstance(responses, list):
+        # 整个batch都被拒绝了 比如解析错误
+        exc = Aria2rpcException(f"unexpected result: {responses}")
+        return [exc] * len(req_objs)
+    by_id = {
+        response.get("id"): response
+        for response in responses
+        if isinstance(response, dict)
+    }
+    results: List[Union[Any, Aria2rpcException]] = []
+    for req_obj in req_objs:
+        response = by_id.get(req_obj["id"])
+        if response is None:
+            results.append(
+                Aria2rpcException(f"no response for request {req_obj['id']}")
+            )
+        elif "result" in response:
+            results.append(response["result"])
+        else:
+            results.append(Aria2rpcException(f"unexpected result: {response}"))
+    return results
 
 
 def run_sync(func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
@@ -132,6 +215,110 @@ async def b64encode_file(path: str) -> str:
         return str(base64.b64encode(await handle.read()), JSON_ENCODING)
 
 
+def b64encoded_length(size: int) -> int:
+    """
+    size字节的数据base64编码后的长度
+    """
+    return (size + 2) // 3 * 4
+
+
+def iter_b64encode_file(
+    path: str, chunk_size: int = B64_CHUNK_SIZE, size: Optional[int] = None
+) -> Generator[bytes, None, None]:
+    """
+    分块读取文件并base64编码 拼接起来与一次性编码的结果相同
+    :param chunk_size: 必须是3的倍数
+    :param size: 文件应有的字节数 打开后的大小不同或者读取过程中文件变化时抛出ValueError
+    """
+    with open(path, "rb") as handle:
+        if size is not None and os.fstat(handle.fileno()).st_size != size:
+            raise ValueError(f"{path} changed while reading")
+        remaining = size
+        while True:
+            if remaining is not None:
+                chunk = handle.read(min(chunk_size, remaining))
+            else:
+                chunk = handle.read(chunk_size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield binascii.b2a_base64(chunk, newline=False)
+        if remaining or (size is not None and handle.read(1)):
+            raise ValueError(f"{path} changed while reading")
+
+
+async def aiter_b64_payload(
+    prefix: bytes,
+    path: str,
+    suffix: bytes,
+    chunk_size: int = B64_CHUNK_SIZE,
+    size: Optional[int] = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    依次产出prefix 文件的base64编码 suffix 读取和编码在线程池中进行
+    适合作为http请求体
+    :param size: 见iter_b64encode_file 用来保证产出的长度与Content-Length一致
+    """
+    loop = asyncio.get_running_loop()
+    chunks = iter_b64encode_file(path, chunk_size, size)
+    future: Optional[asyncio.Future] = None
+    try:
+        yield prefix
+        while True:
+            future = loop.run_in_executor(None, next, chunks, None)
+            # 被取消时线程里的next还在运行 不能让取消传到future上
+            chunk = await asyncio.shield(future)
+            if chunk is None:
+                break
+            yield chunk
+        yield suffix
+    finally:
+        if future is not None and not future.done():
+            await asyncio.wait([future])  # 生成器正在执行时不能关闭
+        chunks.close()
+
+
+def build_b64_payload(
+    prefix: bytes, path: str, suffix: bytes, chunk_size: int = B64_CHUNK_SIZE
+) -> bytearray:
+    """
+    把prefix 文件的base64编码 suffix写进一块预先分配好的内存 适合作为websocket帧
+    这个函数会阻塞 应当在线程池中调用
+    """
+    with open(path, "rb") as handle:
+        size = os.fstat(handle.fileno()).st_size
+        payload = bytearray(len(prefix) + b64encoded_length(size) + len(suffix))
+        view = memoryview(payload)
+        view[: len(prefix)] = prefix
+        offset = len(prefix)
+        raw = bytearray(chunk_size)
+        raw_view = memoryview(raw)
+        while True:
+            count = handle.readinto(raw)
+            if not count:
+                break
+            encoded = binascii.b2a_base64(raw_view[:count], newline=False)
+            if offset + len(encoded) + len(suffix) > len(payload):
+                raise ValueError(f"{path} changed while reading")
+            view[offset : offset + len(encoded)] = encoded
+            offset += len(encoded)
+        if offset + len(suffix) != len(payload):
+            raise ValueError(f"{path} changed while reading")
+        view[offset:] = suffix
+        view.release()
+        raw_view.release()
+    return payload
+
+
+def read_b64encode_file(path: str) -> str:
+    """
+    同步读取文件并base64编码 供线程池使用
+    """
+    with open(path, "rb") as handle:
+        return str(base64.b64encode(handle.read()), JSON_ENCODING)
+
+
 def get_status(response: Dict) -> Any:
     """
     Process a status response.
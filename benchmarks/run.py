@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+客户端热路径的基准测试
+
+    python benchmarks/run.py
+    python benchmarks/run.py --output baseline.json
+    python benchmarks/run.py --compare baseline.json  # 有退化时退出码为1
+
+测量http和websocket客户端在normal/batch模式下的每秒调用数 p50/p99延迟
+每个在途请求占用的内存 以及websocket通知的吞吐量
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aioaria2  # noqa: E402
+from aioaria2.codec import get_default_codec  # noqa: E402
+from tests.mock_aria2 import MockAria2  # noqa: E402
+
+GID = "2089b05ecca3d829"
+KEYS = ["gid", "status", "totalLength", "completedLength", "downloadSpeed"]
+
+# 指标名 -> 数值越大越好
+HIGHER_IS_BETTER = {
+    "calls_per_second": True,
+    "notifications_per_second": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "bytes_per_pending_call": False,
+}
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, max(0, round(q * len(samples)) - 1))
+    return samples[index]
+
+
+async def _measure_calls(
+    call: Callable[[], Awaitable[Any]], calls: int, concurrency: int
+) -> Dict[str, float]:
+    """
+    concurrency个worker一共发起calls次调用
+    """
+    latencies: List[float] = []
+    remaining = calls
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "calls_per_second": calls / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def _measure_batches(
+    client: Any, calls: int, batch_size: int
+) -> Dict[str, float]:
+    """
+    batch模式 每batch_size个调用用process_queue发送一次 延迟按batch计
+    """
+    latencies: List[float] = []
+    start = time.perf_counter()
+    for offset in range(0, calls, batch_size):
+        batch_start = time.perf_counter()
+        for _ in range(min(batch_size, calls - offset)):
+            await client.tellStatus(GID, KEYS)
+        await client.process_queue()
+        latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+    return {
+        "calls_per_second": calls / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def bench_http(server: MockAria2, args: argparse.Namespace) -> Dict:
+    async with aioaria2.Aria2HttpClient(server.url, token="bench") as client:
+        await client.getVersion()  # 预热连接
+        return await _measure_calls(
+            lambda: client.tellStatus(GID, KEYS), args.calls, args.concurrency
+        )
+
+
+async def bench_http_batch(server: MockAria2, args: argparse.Namespace) -> Dict:
+    async with aioaria2.Aria2HttpClient(
+        server.url, mode="batch", token="bench"
+    ) as client:
+        return await _measure_batches(client, args.calls, args.batch_size)
+
+
+async def bench_websocket(server: MockAria2, args: argparse.Namespace) -> Dict:
+    async with await aioaria2.Aria2WebsocketClient.new(
+        server.url, token="bench"
+    ) as client:
+        await client.getVersion()
+        return await _measure_calls(
+            lambda: client.tellStatus(GID, KEYS), args.calls, args.concurrency
+        )
+
+
+async def bench_websocket_batch(server: MockAria2, args: argparse.Namespace) -> Dict:
+    async with await aioaria2.Aria2WebsocketClient.new(
+        server.url, mode="batch", token="bench"
+    ) as client:
+        return await _measure_batches(client, args.calls, args.batch_size)
+
+
+async def bench_pending_memory(server: MockAria2, args: argparse.Namespace) -> Dict:
+    """
+    服务器暂不回复 测量pending个在途请求(包括各自的任务)一共分配的内存
+    """
+    async with await aioaria2.Aria2WebsocketClient.new(
+        server.url, token="bench"
+    ) as client:
+        await client.getVersion()
+        server.pause()
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        tasks = [
+            asyncio.create_task(client.tellStatus(GID, KEYS))
+            for _ in range(args.pending)
+        ]
+        while len(client._results) < args.pending:
+            await asyncio.sleep(0.001)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        server.release()
+        await asyncio.gather(*tasks)
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {"bytes_per_pending_call": allocated / args.pending}
+
+
+async def bench_notifications(server: MockAria2, args: argparse.Namespace) -> Dict:
+    async with await aioaria2.Aria2WebsocketClient.new(
+        server.url, notification_workers=4
+    ) as client:
+        received = 0
+        done = asyncio.Event()
+
+        @client.onDownloadComplete
+        async def on_complete(client, data):
+            nonlocal received
+            received += 1
+            if received == args.notifications:
+                done.set()
+
+        start = time.perf_counter()
+        await server.notify_many(args.notifications)
+        await done.wait()
+        elapsed = time.perf_counter() - start
+    return {"notifications_per_second": args.notifications / elapsed}
+
+
+BENCHMARKS: Dict[str, Callable[[MockAria2, argparse.Namespace], Awaitable]] = {
+    "http": bench_http,
+    "http_batch": bench_http_batch,
+    "websocket": bench_websocket,
+    "websocket_batch": bench_websocket_batch,
+    "websocket_pending_memory": bench_pending_memory,
+    "websocket_notifications": bench_notifications,
+}
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, float]] = {}
+    names = args.only or list(BENCHMARKS)
+    for name in names:
+        best: Optional[Dict[str, float]] = None
+        for _ in range(args.repeat):
+            # 每次用新的服务器 互不影响
+            server = MockAria2("bench", args.latency, args.result_size)
+            server.record = False  # 不保存收到的请求 以免影响内存的测量
+            async with server:
+                result = await BENCHMARKS[name](server, args)
+            if best is None:
+                best = result
+            else:  # 取每个指标最好的一次 减少噪声
+                best = {
+                    key: (max if HIGHER_IS_BETTER[key] else min)(best[key], value)
+                    for key, value in result.items()
+                }
+        results[name] = best  # type: ignore
+        print(f"{name:<28}{format_result(best)}", file=sys.stderr)  # type: ignore
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "aioaria2": aioaria2.__version__,
+            "codec": get_default_codec().name,
+        },
+        "parameters": {
+            key: getattr(args, key)
+            for key in (
+                "calls",
+                "concurrency",
+                "batch_size",
+                "pending",
+                "notifications",
+                "latency",
+                "result_size",
+                "repeat",
+            )
+        },
+        "results": results,
+    }
+
+
+def format_result(result: Dict[str, float]) -> str:
+    return "  ".join(f"{key}={value:,.2f}" for key, value in result.items())
+
+
+def compare(
+    baseline: Dict[str, Any], report: Dict[str, Any], threshold: float
+) -> List[str]:
+    """
+    和之前的报告对比 返回退化超过threshold的指标
+    """
+    lines = []
+    regressions = []
+    for name, result in report["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            continue
+        for key, value in result.items():
+            if key not in old or not old[key]:
+                continue
+            change = (value - old[key]) / old[key]
+            worse = -change if HIGHER_IS_BETTER[key] else change
+            mark = ""
+            if worse > threshold:
+                mark = "  REGRESSION"
+                regressions.append(f"{name}.{key}")
+            lines.append(
+                f"{name + '.' + key:<52}{old[key]:>14,.2f}{value:>14,.2f}{change:>+9.1%}{mark}"
+            )
+    print(f"{'metric':<52}{'baseline':>14}{'current':>14}{'change':>9}")
+    print("\n".join(lines))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="aioaria2 client benchmarks")
+    parser.add_argument("--calls", type=int, default=5000, help="calls per benchmark")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--pending", type=int, default=2000)
+    parser.add_argument("--notifications", type=int, default=20000)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="server side delay per request"
+    )
+    parser.add_argument(
+        "--result-size", type=int, default=0, help="extra bytes in tellStatus results"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="keep the best run")
+    parser.add_argument(
+        "--only", nargs="*", choices=list(BENCHMARKS), help="benchmarks to run"
+    )
+    parser.add_argument("--output", help="write the report as json")
+    parser.add_argument("--compare", help="baseline report to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change counted as a regression",
+    )
+    args = parser.parse_args(argv)
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"regressions: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
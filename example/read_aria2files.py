@@ -5,13 +5,23 @@ Copyright (c) 2008-2023 synodriver <diguohuangjiajinweijun@gmail.com>
 from io import BytesIO
 
 from aioaria2 import ControlFile, DHTFile
+from aioaria2.scanner import ScanStats, scan_control_files
 
-data = ControlFile.from_file("180P_225K_242958531.webm.aria2")
-print(data)
-# do something with .aria2 file
-data.save(BytesIO())
+# the scanner uses a process pool, on spawn based platforms (windows/macos)
+# every worker imports this script again, so keep the entry point guarded
+if __name__ == "__main__":
+    data = ControlFile.from_file("180P_225K_242958531.webm.aria2")
+    print(data)
+    # do something with .aria2 file
+    data.save(BytesIO())
 
-dht = DHTFile.from_file("dht.dat")  # or dht6.dat
-print(dht)
-# do something with dht file
-dht.save(BytesIO())
+    dht = DHTFile.from_file("dht.dat")  # or dht6.dat
+    print(dht)
+    # do something with dht file
+    dht.save(BytesIO())
+
+    # scan a whole download volume
+    stats = ScanStats()
+    for summary in scan_control_files("/downloads", stats=stats):
+        print(summary.path, summary.completed_length, summary.total_length)
+    print(stats)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+测试用的假aria2c 用MockAria2提供rpc 只认识进程池传入的参数
+
+python -m tests.fake_aria2c --rpc-listen-port=6800 --rpc-secret=admin
+"""
+import asyncio
+import sys
+
+from tests.mock_aria2 import MockAria2
+
+
+async def main(argv):
+    options = dict(arg[2:].split("=", 1) for arg in argv if "=" in arg)
+    if "fake-exit-code" in options:  # 模拟启动失败
+        sys.exit(int(options["fake-exit-code"]))
+    server = MockAria2(token=options.get("rpc-secret"))
+    server.downloads = {}
+    await asyncio.sleep(float(options.get("fake-startup-delay", 0)))
+    await server.start(int(options["rpc-listen-port"]))
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
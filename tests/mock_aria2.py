@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+进程内的aria2 jsonrpc模拟服务器 测试和基准测试共用
+
+同时提供http和websocket接口 只实现用到的方法
+可以设置每个请求的延迟和响应大小 也可以批量推送通知
+"""
+import asyncio
+import base64
+
+from aiohttp import WSMsgType, web
+
+from aioaria2.codec import get_default_codec
+
+STATUS = {  # downloads为None时tellStatus返回的状态
+    "status": "active",
+    "totalLength": "1073741824",
+    "completedLength": "536870912",
+    "downloadSpeed": "10485760",
+    "uploadSpeed": "0",
+    "connections": "16",
+    "dir": "/downloads",
+}
+
+
+class MockAria2:
+    def __init__(self, token=None, latency=0.0, result_size=0, host="127.0.0.1"):
+        """
+        :param token: rpc密码 设置后每个调用都必须带上
+        :param latency: 每个请求在回复前等待的秒数 模拟繁忙的aria2
+        :param result_size: tellStatus结果中额外填充的字节数 模拟大的响应
+        """
+        self.token = token
+        self.latency = latency
+        self.host = host
+        self.codec = get_default_codec()
+        self.record = True  # 为False时不保存requests 基准测试用
+        self.requests = []  # 收到的每个http请求体/websocket帧
+        self.websockets = []
+        self.hold = False  # True时websocket请求不回复
+        self.downloads = None  # gid -> status 为None时tellStatus对任何gid都返回STATUS
+        self.status = dict(STATUS, padding="x" * result_size) if result_size else STATUS
+        self.uploads = []  # addTorrent/addMetalink收到的(文件内容, 其他参数)
+        self.faults = set()  # 这些方法直接返回错误
+        self._released = asyncio.Event()  # 见pause
+        self._released.set()
+        self._gids = 0
+        self._tasks = set()
+        self.app = web.Application(client_max_size=64 << 20)
+        self.app.router.add_post("/jsonrpc", self.handle_http)
+        self.app.router.add_get("/jsonrpc", self.handle_ws)
+        self.runner = None
+        self.url = None
+
+    async def start(self, port=0):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{self.host}:{port}/jsonrpc"
+        return self
+
+    async def close(self):
+        self.release()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for ws in self.websockets:
+            await ws.close()
+        await self.runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def pause(self):
+        """
+        websocket请求等到release()之后才回复 用来测量在途请求的内存
+        """
+        self._released.clear()
+
+    def release(self):
+        self._released.set()
+
+    def new_gid(self):
+        self._gids += 1
+        return f"{id(self) & 0xFFFFFFFF:08x}{self._gids:08x}"
+
+    def call(self, method, params):
+        if self.token is not None and method != "system.multicall":
+            assert params[0] == f"token:{self.token}", params
+            params = params[1:]
+        if method in self.faults:
+            raise ValueError(f"{method} failed")
+        if method == "aria2.getVersion":
+            return {"version": "1.37.0", "enabledFeatures": []}
+        if method == "aria2.tellStatus":
+            if self.downloads is None:
+                return self.project(dict(self.status, gid=params[0]), params[1:])
+            if params[0] not in self.downloads:
+                raise ValueError(f"GID {params[0]} is not found")
+            return self.project(self.downloads[params[0]], params[1:])
+        if method in ("aria2.tellActive", "aria2.tellWaiting", "aria2.tellStopped"):
+            wanted = {
+                "aria2.tellActive": ("active",),
+                "aria2.tellWaiting": ("waiting", "paused"),
+                "aria2.tellStopped": ("complete", "error", "removed"),
+            }[method]
+            keys = params[2:] if method != "aria2.tellActive" else params
+            selected = [d for d in self.downloads.values() if d["status"] in wanted]
+            if method != "aria2.tellActive":
+                selected = selected[params[0] : params[0] + params[1]]
+            return [self.project(d, keys) for d in selected]
+        if method == "aria2.addUri":
+            gid = self.new_gid()
+            if self.downloads is not None:
+                self.downloads[gid] = {
+                    "gid": gid,
+                    "status": "active",
+                    "uri": params[0][0],
+                }
+            return gid
+        if method in ("aria2.addTorrent", "aria2.addMetalink"):
+            self.uploads.append((base64.b64decode(params[0]), params[1:]))
+            gid = f"{len(self.uploads):016x}"
+            return gid if method == "aria2.addTorrent" else [gid]
+        if method == "aria2.getGlobalStat":
+            downloads = self.downloads if self.downloads is not None else {}
+
+            def count(*statuses):
+                return str(sum(d["status"] in statuses for d in downloads.values()))
+
+            return {
+                "downloadSpeed": "0",
+                "uploadSpeed": "0",
+                "numActive": count("active"),
+                "numWaiting": count("waiting", "paused"),
+                "numStopped": count("complete", "error", "removed"),
+                "numStoppedTotal": count("complete", "error", "removed"),
+            }
+        if method == "aria2.pauseAll":
+            for d in self.downloads.values():
+                if d["status"] in ("active", "waiting"):
+                    d["status"] = "paused"
+            return "OK"
+        if method == "system.multicall":
+            results = []
+            for m in params[0]:
+                try:
+                    results.append([self.call(m["methodName"], m.get("params", []))])
+                except ValueError as err:
+                    results.append({"faultCode": 1, "faultString": str(err)})
+            return results
+        raise KeyError(method)
+
+    @staticmethod
+    def project(download, keys):
+        if not keys:
+            return dict(download)
+        return {k: v for k, v in download.items() if k in keys[0]}
+
+    def respond(self, req):
+        try:
+            return {
+                "id": req["id"],
+                "jsonrpc": "2.0",
+                "result": self.call(req["method"], req["params"]),
+            }
+        except (KeyError, ValueError) as err:
+            return {
+                "id": req["id"],
+                "jsonrpc": "2.0",
+                "error": {"code": 1, "message": str(err)},
+            }
+
+    def dispatch(self, body):
+        data = self.codec.loads(body)
+        if self.record:
+            self.requests.append(data)
+        if isinstance(data, list):
+            return [self.respond(req) for req in data]
+        return self.respond(data)
+
+    async def handle_http(self, request):
+        body = await request.read()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(
+            body=self.codec.dumps(self.dispatch(body)), content_type="application/json"
+        )
+
+    async def reply(self, ws, data):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        await self._released.wait()
+        if not ws.closed:
+            await ws.send_bytes(self.codec.dumps(self.dispatch(data)))
+
+    async def handle_ws(self, request):
+        ws = web.WebSocketResponse(max_msg_size=64 << 20)
+        await ws.prepare(request)
+        self.websockets.append(ws)
+        async for msg in ws:
+            if msg.type not in (WSMsgType.TEXT, WSMsgType.BINARY) or self.hold:
+                continue
+            if not self.latency and self._released.is_set():
+                await ws.send_bytes(self.codec.dumps(self.dispatch(msg.data)))
+                continue
+            task = asyncio.create_task(self.reply(ws, msg.data))  # 延迟回复时并发处理
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return ws
+
+    async def notify(self, method, gid):
+        frame = self.codec.dumps(
+            {"jsonrpc": "2.0", "method": method, "params": [{"gid": gid}]}
+        )
+        for ws in self.websockets:
+            if not ws.closed:
+                await ws.send_bytes(frame)
+
+    async def notify_many(self, count, method="aria2.onDownloadComplete", gids=1024):
+        """
+        向所有websocket连接推送count条通知 gid在gids个之间轮换
+        """
+        frames = [
+            self.codec.dumps(
+                {"jsonrpc": "2.0", "method": method, "params": [{"gid": f"{i:016x}"}]}
+            )
+            for i in range(min(count, gids))
+        ]
+        for i in range(count):
+            frame = frames[i % len(frames)]
+            for ws in self.websockets:
+                if not ws.closed:
+                    await ws.send_bytes(frame)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import unittest
+from io import BytesIO
+
+from aioaria2 import ControlFile
+from aioaria2 import bitfield as bitfield_module
+from aioaria2.bitfield import Bitfield
+from aioaria2.parser import InFlightPiece
+
+
+class TestBitfield(unittest.TestCase):
+    def check(self):
+        bf = Bitfield("f0c1", 14)  # 11110000 110000|01
+        self.assertEqual(len(bf), 14)
+        self.assertEqual(bf.count(), 6)
+        self.assertTrue(bf[0])
+        self.assertFalse(bf[4])
+        self.assertFalse(bf[-1])
+        self.assertEqual(bf.ranges(), [(0, 4), (8, 10)])
+        self.assertEqual(bf.ranges(False), [(4, 8), (10, 14)])
+        self.assertEqual(bf.missing(), [4, 5, 6, 7, 10, 11, 12, 13])
+        big = Bitfield(b"\xff" * 1000 + b"\x80", 8001)
+        self.assertTrue(big.is_complete())
+        self.assertEqual(big.ranges(), [(0, 8001)])
+        self.assertEqual(big.completed_length(1024, 8000 * 1024 + 10), 8000 * 1024 + 10)
+        self.assertEqual(Bitfield(b"\xfe", 8).completed_length(10, 75), 70)
+        self.assertEqual(
+            Bitfield.from_status({"bitfield": "80", "numPieces": "2"}).count(), 1
+        )
+
+    def test_numpy(self):
+        if bitfield_module.np is None:
+            self.skipTest("numpy not installed")
+        self.check()
+
+    def test_pure_python(self):
+        np = bitfield_module.np
+        bitfield_module.np = None
+        try:
+            self.check()
+        finally:
+            bitfield_module.np = np
+
+    def test_control_file(self):
+        piece = InFlightPiece(
+            index=3, length=40000, piece_bitfield_length=1, piece_bitfield=b"\xc0"
+        )
+        data = ControlFile(
+            version=1,
+            ext=b"\x00\x00\x00\x00",
+            info_hash_length=0,
+            info_hash=b"",
+            piece_length=1 << 20,
+            total_length=(4 << 20) - 100,
+            upload_length=0,
+            bitfield_length=1,
+            bitfield=b"\xd0",
+            num_inflight_piece=1,
+            inflight_pieces=[piece],
+        )
+        self.assertEqual(data.num_pieces, 4)
+        self.assertEqual(data.pieces.missing(), [2])
+        self.assertEqual(data.completed_length, (3 << 20) - 100)
+        self.assertEqual(piece.completed_length, 32768)
+        s = BytesIO()
+        data.save(s)
+        s.seek(0)
+        self.assertEqual(ControlFile.from_file(s), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,811 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import aiohttp
+
+import aioaria2
+from aioaria2.events import EventStream
+from tests.mock_aria2 import MockAria2
+
+
+class LoggingHttpClient(aioaria2.Aria2HttpClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = []
+
+    async def send_request(self, req_obj):
+        self.sent.append(req_obj["method"])
+        return await super().send_request(req_obj)
+
+
+class SendRequestOnlyClient(aioaria2.client._Aria2BaseClient):
+    """
+    只实现了send_request的后端
+    """
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server = server
+
+    async def send_request(self, req_obj):
+        response = self.server.dispatch(json.dumps(req_obj))
+        if "error" in response:
+            raise aioaria2.Aria2rpcException(response["error"]["message"])
+        return response["result"]
+
+
+class TestHttpClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2(token="admin").start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def test_batch(self):
+        async with aioaria2.Aria2HttpClient(
+            self.server.url, mode="batch", token="admin"
+        ) as client:
+            await client.tellStatus("a")
+            await client.jsonrpc("noSuchMethod")
+            await client.getVersion()
+            results = await client.process_queue()
+            self.assertEqual(len(self.server.requests), 1)
+            self.assertEqual(len(self.server.requests[0]), 3)
+            self.assertEqual(results[0]["gid"], "a")
+            self.assertIsInstance(results[1], aioaria2.Aria2rpcException)
+            self.assertEqual(results[2]["version"], "1.37.0")
+            self.assertEqual(await client.process_queue(), [])
+
+    async def test_override_send_request(self):
+        with tempfile.NamedTemporaryFile(delete=False) as handle:
+            handle.write(b"torrent")
+        self.addCleanup(os.unlink, handle.name)
+        async with LoggingHttpClient(self.server.url, token="admin") as client:
+            await client.getVersion()
+            await client.tellStatus("a")
+            snapshot = await client.snapshot(["a", "b"], ["gid"])
+            self.assertEqual(snapshot["b"]["gid"], "b")
+            await client.add_torrent(handle.name)
+            self.assertEqual(
+                client.sent,
+                [
+                    "aria2.getVersion",
+                    "aria2.tellStatus",
+                    "system.multicall",
+                    "aria2.addTorrent",
+                ],
+            )
+            self.assertEqual(self.server.uploads[-1][0], b"torrent")
+
+    async def test_send_request_only(self):
+        client = SendRequestOnlyClient(self.server, self.server.url, token="admin")
+        self.assertEqual((await client.getVersion())["version"], "1.37.0")
+        self.assertEqual((await client.tellStatus("a"))["gid"], "a")
+
+    async def test_coalesce(self):
+        async with aioaria2.Aria2HttpClient(
+            self.server.url, token="admin", coalesce_window=0.01, coalesce_max=30
+        ) as client:
+            results = await asyncio.gather(
+                *[client.tellStatus(str(i)) for i in range(50)],
+                client.jsonrpc("noSuchMethod"),
+                return_exceptions=True,
+            )
+            self.assertEqual(
+                [r["gid"] for r in results[:50]], [str(i) for i in range(50)]
+            )
+            self.assertIsInstance(results[50], aioaria2.Aria2rpcException)
+            self.assertEqual([len(r) for r in self.server.requests], [30, 21])
+
+    async def test_iter_waiting(self):
+        self.server.downloads = {
+            str(i): {"gid": str(i), "status": "waiting"} for i in range(25)
+        }
+        async with aioaria2.Aria2HttpClient(self.server.url, token="admin") as client:
+            gids = [s["gid"] async for s in client.iter_waiting(["gid"], page_size=10)]
+            self.assertEqual(gids, [str(i) for i in range(25)])
+            gids = [
+                s["gid"] async for s in client.iter_stopped(page_size=10, prefetch=True)
+            ]
+            self.assertEqual(gids, [])
+            async for s in client.iter_waiting(
+                page_size=10, min_page_size=10, prefetch=True
+            ):
+                break
+            self.assertEqual(s["gid"], "0")
+
+    async def test_compiled_request(self):
+        async with aioaria2.Aria2HttpClient(self.server.url, token="admin") as client:
+            keys = ["gid", "status"]
+            params = ["a", keys]
+            self.assertEqual(
+                await client.jsonrpc("tellStatus", params),
+                {"gid": "a", "status": "active"},
+            )
+            self.assertEqual(params, ["a", ["gid", "status"]])  # 没有插入token
+            await client.getVersion()
+            self.assertEqual(
+                self.server.requests,
+                [
+                    {
+                        "jsonrpc": "2.0",
+                        "method": "aria2.tellStatus",
+                        "params": ["token:admin", "a", ["gid", "status"]],
+                        "id": 1,
+                    },
+                    {
+                        "jsonrpc": "2.0",
+                        "method": "aria2.getVersion",
+                        "params": ["token:admin"],
+                        "id": 2,
+                    },
+                ],
+            )
+            # token改变后重新生成模板 特殊字符也能正确编码
+            client.token = self.server.token = 'a%s"b'
+            client.identity = lambda: "id-%d"
+            await client.getVersion()
+            self.assertEqual(self.server.requests[-1]["id"], "id-%d")
+            client.token = self.server.token = None
+            await client.tellStatus("b")
+            self.assertEqual(self.server.requests[-1]["params"], ["b"])
+
+    async def test_multicall_not_mutated(self):
+        async with aioaria2.Aria2HttpClient(self.server.url, token="admin") as client:
+            calls = [
+                {"methodName": "aria2.tellStatus", "params": ["a"]},
+                {"methodName": "aria2.getVersion"},
+            ]
+            results = await client.multicall(calls)
+            self.assertEqual(results[0][0]["gid"], "a")
+            self.assertEqual(
+                calls,
+                [
+                    {"methodName": "aria2.tellStatus", "params": ["a"]},
+                    {"methodName": "aria2.getVersion"},
+                ],
+            )
+
+
+class FileUploadMixin:
+    async def make_client(self):
+        raise NotImplementedError
+
+    def make_file(self, size):
+        handle = tempfile.NamedTemporaryFile(delete=False)
+        with handle:
+            handle.write(os.urandom(size))
+        self.addCleanup(os.unlink, handle.name)
+        return handle.name
+
+    async def test_add_torrent(self):
+        client = await self.make_client()
+        async with client:
+            for size in (0, 1, 2, 3, 1 << 20, (1 << 20) + 1):
+                path = self.make_file(size)
+                gid = await client.add_torrent(
+                    path, ["http://a/b"], {"dir": "/tmp/中文"}, 1
+                )
+                data, params = self.server.uploads[-1]
+                with open(path, "rb") as handle:
+                    self.assertEqual(data, handle.read())
+                self.assertEqual(params, [["http://a/b"], {"dir": "/tmp/中文"}, 1])
+                self.assertEqual(gid, f"{len(self.server.uploads):016x}")
+
+    async def test_add_metalink(self):
+        client = await self.make_client()
+        async with client:
+            path = self.make_file(1000)
+            gids = await client.add_metalink(path)
+            self.assertEqual(len(gids), 1)
+            self.assertEqual(self.server.uploads[-1][1], [])
+
+
+class TestSnapshot(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2(token="admin").start()
+        self.server.downloads = {
+            gid: {"gid": gid, "status": "active", "totalLength": "100"}
+            for gid in ("a", "b", "c")
+        }
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def test_http(self):
+        async with aioaria2.Aria2HttpClient(self.server.url, token="admin") as client:
+            params = ["gid", "status"]
+            snapshot = await client.snapshot(
+                ["a", "b", "a", "missing"], params, global_stat=True
+            )
+            self.assertEqual(len(self.server.requests), 1)
+            self.assertEqual(
+                snapshot.statuses,
+                {
+                    "a": {"gid": "a", "status": "active"},
+                    "b": {"gid": "b", "status": "active"},
+                },
+            )
+            self.assertEqual(snapshot["a"]["status"], "active")
+            self.assertIn("missing", snapshot.errors)
+            self.assertEqual(snapshot.global_stat["numActive"], "3")
+            self.assertEqual(params, ["gid", "status"])
+            # 第二次使用缓存的片段 结果一样
+            again = await client.snapshot(["c"], ["gid", "status"])
+            self.assertEqual(again.statuses, {"c": {"gid": "c", "status": "active"}})
+            self.assertIsNone(again.global_stat)
+            self.assertEqual(len(client._templates), 1)
+
+    async def test_chunks(self):
+        async with aioaria2.Aria2HttpClient(self.server.url, token="admin") as client:
+            snapshot = await client.snapshot(
+                ["a", "b", "c"], global_stat=True, chunk_size=2
+            )
+            self.assertEqual(len(self.server.requests), 2)
+            self.assertEqual(sorted(snapshot.statuses), ["a", "b", "c"])
+            self.assertEqual(snapshot["c"]["totalLength"], "100")
+            self.assertEqual(snapshot.global_stat["numActive"], "3")
+            self.assertEqual(len(await client.snapshot([])), 0)
+            self.assertEqual(len(self.server.requests), 2)
+
+    async def test_global_stat_fault(self):
+        self.server.faults.add("aria2.getGlobalStat")
+        async with aioaria2.Aria2HttpClient(self.server.url, token="admin") as client:
+            snapshot = await client.snapshot(["a", "b"], global_stat=True)
+            self.assertIsNone(snapshot.global_stat)
+            self.assertEqual(sorted(snapshot.statuses), ["a", "b"])
+            error = snapshot.errors[aioaria2.client.SNAPSHOT_GLOBAL_STAT]
+            self.assertIsInstance(error, aioaria2.Aria2rpcException)
+            self.assertIn("aria2.getGlobalStat failed", str(error))
+            self.assertEqual(len(snapshot.errors), 1)
+
+    def test_plain_gid(self):
+        from aioaria2.client import _is_plain_gid
+
+        self.assertTrue(_is_plain_gid("2089b05ecca3d829"))
+        self.assertFalse(_is_plain_gid(""))
+        self.assertFalse(_is_plain_gid('a"b'))
+        self.assertFalse(_is_plain_gid("\u00e9"))
+        self.assertFalse(_is_plain_gid("é"))
+
+    async def test_websocket(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, token="admin"
+        ) as client:
+            snapshot = await client.snapshot(["a", "b"], ["status"])
+            self.assertEqual(
+                snapshot.statuses,
+                {"a": {"status": "active"}, "b": {"status": "active"}},
+            )
+
+
+class TestBulkAdd(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2(token="admin").start()
+        self.client = aioaria2.Aria2HttpClient(self.server.url, token="admin")
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.paths = []
+        for i in range(10):
+            path = os.path.join(self.dir.name, f"{i}.torrent")
+            with open(path, "wb") as handle:
+                handle.write(bytes([i]) * 300)
+            self.paths.append(path)
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        await self.server.close()
+
+    async def test_add_torrents(self):
+        paths = list(self.paths)
+        paths.insert(3, os.path.join(self.dir.name, "missing.torrent"))
+        results = [
+            r
+            async for r in self.client.add_torrents(
+                paths, options={"dir": "/tmp"}, batch_bytes=1500, in_flight=2
+            )
+        ]
+        self.assertEqual(len(results), 11)
+        self.assertIsInstance(results[3], aioaria2.Aria2rpcException)
+        del results[3]
+        self.assertTrue(all(isinstance(r, str) for r in results))
+        # 按输入顺序 每个请求最多放得下3个种子
+        contents = [data for data, _ in self.server.uploads]
+        self.assertEqual(contents, [bytes([i]) * 300 for i in range(10)])
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.server.uploads[0][1], [[], {"dir": "/tmp"}])
+
+    async def test_async_iterable(self):
+        async def paths():
+            for path in self.paths:
+                yield path
+
+        results = [r async for r in self.client.add_metalinks(paths(), max_calls=4)]
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(isinstance(r, list) for r in results))
+        self.assertEqual(len(self.server.requests), 3)
+
+    async def test_stop_early(self):
+        reads = []
+
+        def slow_read(path):
+            time.sleep(0.05)
+            reads.append(path)
+            return base64.b64encode(b"x").decode()
+
+        with mock.patch("aioaria2.client.read_b64encode_file", slow_read):
+            results = self.client.add_torrents(self.paths, workers=1, max_calls=1)
+            await results.__anext__()
+            await results.aclose()
+            started = len(reads)
+            await asyncio.sleep(0.3)
+        # 最多读完正在读取的那个文件 排队的文件不再读取
+        self.assertLessEqual(len(reads), started + 1)
+        self.assertLess(len(reads), len(self.paths))
+
+
+class TestHttpUpload(FileUploadMixin, unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2(token="admin").start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def make_client(self):
+        return aioaria2.Aria2HttpClient(self.server.url, token="admin")
+
+
+class TestWebsocketUpload(FileUploadMixin, unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2(token="admin").start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def make_client(self):
+        return await aioaria2.Aria2WebsocketClient.new(self.server.url, token="admin")
+
+
+class TestWebsocketClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2(token="admin").start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def test_separate_id_space(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, token="admin"
+        ) as c1, await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, token="admin"
+        ) as c2:
+            results = await asyncio.gather(
+                *[c1.tellStatus(str(i)) for i in range(20)],
+                *[c2.tellStatus(str(i)) for i in range(20)],
+            )
+            self.assertEqual(
+                [r["gid"] for r in results], [str(i) for i in range(20)] * 2
+            )
+            self.assertEqual(c1.identity(), c2.identity())
+            self.assertEqual(len(c1._results), 0)
+
+    async def test_pending_fail_on_close(self):
+        client = await aioaria2.Aria2WebsocketClient.new(self.server.url, token="admin")
+        self.server.hold = True
+        task = asyncio.create_task(client.getVersion())
+        await asyncio.sleep(0.1)
+        await self.server.websockets[0].close()
+        with self.assertRaises(aioaria2.Aria2rpcException) as cm:
+            await asyncio.wait_for(task, 2)
+        self.assertTrue(cm.exception.connection_error)
+        await client.close()
+
+    async def test_batch(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, mode="batch", token="admin"
+        ) as client:
+            for gid in "abc":
+                await client.tellStatus(gid)
+            await client.jsonrpc("noSuchMethod")
+            results = await client.process_queue()
+            self.assertEqual(len(self.server.requests), 1)
+            self.assertEqual([r["gid"] for r in results[:3]], list("abc"))
+            self.assertIsInstance(results[3], aioaria2.Aria2rpcException)
+
+    async def test_coalesce(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, token="admin", coalesce_window=0
+        ) as client:
+            results = await asyncio.gather(
+                *[client.tellStatus(str(i)) for i in range(10)]
+            )
+            self.assertEqual([r["gid"] for r in results], [str(i) for i in range(10)])
+            self.assertEqual(len(self.server.requests), 1)
+
+    async def test_close_coalesced(self):
+        self.server.hold = True
+        client = await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, token="admin", coalesce_window=0
+        )
+        calls = [asyncio.ensure_future(client.tellStatus(str(i))) for i in range(3)]
+        await asyncio.sleep(0.1)
+        self.assertEqual(len(client._coalesce_tasks), 1)
+        await client.close()
+        self.assertEqual(len(client._coalesce_tasks), 0)
+        results = await asyncio.wait_for(
+            asyncio.gather(*calls, return_exceptions=True), 1
+        )
+        for result in results:
+            self.assertIsInstance(result, aioaria2.Aria2rpcException)
+
+    async def test_unsolicited_response_ignored(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, token="admin"
+        ) as client:
+            await client.handle_event({"id": 12345, "jsonrpc": "2.0", "result": "OK"})
+            self.assertEqual(len(client._results), 0)
+
+
+class RecordingClient(aioaria2.Aria2WebsocketClient):
+    async def handle_event(self, data):
+        self.seen.append(data)
+        await super().handle_event(data)
+
+
+class TestNotificationDispatch(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2().start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def test_ordered_per_gid(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, notification_workers=2
+        ) as client:
+            received = []
+            running = set()
+            done = asyncio.Event()
+
+            @client.onDownloadStart
+            async def on_start(client, data):
+                gid = data["params"][0]["gid"]
+                self.assertNotIn(gid, running)  # 同一个gid不会并发处理
+                running.add(gid)
+                await asyncio.sleep(0.01 if gid == "a" else 0)
+                running.discard(gid)
+                received.append(gid)
+                # 回调里可以继续请求 响应不经过worker
+                await client.tellStatus(gid)
+                if len(received) == 6:
+                    done.set()
+
+            for gid in "aabbab":
+                await self.server.notify("aria2.onDownloadStart", gid)
+            await asyncio.wait_for(done.wait(), 2)
+            self.assertEqual(sorted(received), list("aaabbb"))
+            self.assertEqual(len(client._pending_tasks), 0)
+
+    async def test_override_handle_event(self):
+        async with await RecordingClient.new(self.server.url) as client:
+            client.seen = []
+            await client.getVersion()
+            self.assertIn("result", client.seen[0])
+        async with await aioaria2.Aria2WebsocketClient.new(self.server.url) as client:
+            self.assertFalse(client._responses_to_handler)
+
+    async def test_coalesce(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, notification_workers=1, notification_coalesce=10
+        ) as client:
+            received = []
+
+            @client.onDownloadComplete
+            async def on_complete(client, data):
+                received.append(data["params"][0]["gid"])
+
+            for gid in "aabab":
+                await self.server.notify("aria2.onDownloadComplete", gid)
+            await self.server.notify("aria2.onDownloadStart", "a")
+            await client.getVersion()  # 通知都已经读到了
+            await asyncio.sleep(0.05)
+            self.assertEqual(received, ["a", "b"])
+            self.assertEqual(client._dispatcher.coalesced, 3)
+
+
+class TestEventStream(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2().start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def test_filter(self):
+        async with await aioaria2.Aria2WebsocketClient.new(self.server.url) as client:
+            stream = client.events(types=["onDownloadComplete"], gids=["a", "b"])
+            await self.server.notify("aria2.onDownloadComplete", "a")
+            await self.server.notify("aria2.onDownloadStart", "a")
+            await self.server.notify("aria2.onDownloadComplete", "c")
+            await self.server.notify("aria2.onDownloadComplete", "b")
+            received = []
+            async for event in stream:
+                received.append(event["params"][0]["gid"])
+                if len(received) == 2:
+                    break
+            self.assertEqual(received, ["a", "b"])
+            stream.close()
+            self.assertEqual(client.streams, [])
+
+    async def test_drop_oldest(self):
+        async with await aioaria2.Aria2WebsocketClient.new(self.server.url) as client:
+            stream = client.events(maxsize=2)
+            for gid in "abc":
+                await self.server.notify("aria2.onDownloadStart", gid)
+            await client.getVersion()
+            self.assertEqual(stream.dropped, 1)
+            self.assertEqual(
+                [(await stream.get())["params"][0]["gid"] for _ in "bc"], ["b", "c"]
+            )
+
+    async def test_coalesce(self):
+        async with await aioaria2.Aria2WebsocketClient.new(self.server.url) as client:
+            stream = client.events(maxsize=2, overflow="coalesce")
+            await self.server.notify("aria2.onDownloadStart", "a")
+            await self.server.notify("aria2.onDownloadStart", "b")
+            await self.server.notify("aria2.onDownloadComplete", "a")
+            await client.getVersion()
+            self.assertEqual(stream.coalesced, 1)
+            self.assertEqual(stream.dropped, 0)
+            first = await stream.get()
+            self.assertEqual(first["method"], "aria2.onDownloadComplete")
+            self.assertEqual(first["params"][0]["gid"], "a")
+            self.assertEqual((await stream.get())["params"][0]["gid"], "b")
+
+    async def test_coalesce_only_when_full(self):
+        async with await aioaria2.Aria2WebsocketClient.new(self.server.url) as client:
+            stream = client.events(overflow="coalesce")
+            await self.server.notify("aria2.onDownloadStart", "a")
+            await self.server.notify("aria2.onDownloadComplete", "a")
+            await client.getVersion()
+            self.assertEqual(len(stream), 2)
+            self.assertEqual(stream.coalesced, 0)
+            self.assertEqual((await stream.get())["method"], "aria2.onDownloadStart")
+            self.assertEqual((await stream.get())["method"], "aria2.onDownloadComplete")
+        # 没有gid的通知不合并
+        stream = EventStream(maxsize=1, overflow="coalesce")
+        await stream.put({"method": "aria2.onDownloadStart", "params": []})
+        await stream.put({"method": "aria2.onDownloadStop", "params": []})
+        self.assertEqual((stream.coalesced, stream.dropped), (0, 1))
+        self.assertEqual((await stream.get())["method"], "aria2.onDownloadStop")
+
+    async def test_block(self):
+        async with await aioaria2.Aria2WebsocketClient.new(self.server.url) as client:
+            stream = client.events(maxsize=1, overflow="block")
+            await self.server.notify("aria2.onDownloadStart", "a")
+            await self.server.notify("aria2.onDownloadStart", "b")
+            version = asyncio.create_task(client.getVersion())
+            await asyncio.sleep(0.05)
+            self.assertFalse(version.done())  # 读取暂停 响应也被挡住
+            self.assertEqual((await stream.get())["params"][0]["gid"], "a")
+            await asyncio.wait_for(version, 2)
+            self.assertEqual((await stream.get())["params"][0]["gid"], "b")
+            self.assertEqual(stream.dropped, 0)
+
+    async def test_close_client(self):
+        client = await aioaria2.Aria2WebsocketClient.new(self.server.url)
+        stream = client.events()
+        await self.server.notify("aria2.onDownloadStart", "a")
+        await client.getVersion()
+        await client.close()
+        self.assertEqual([e["params"][0]["gid"] async for e in stream], ["a"])
+
+    async def test_pool(self):
+        async with await aioaria2.Aria2WebsocketPool.new(
+            self.server.url, size=2
+        ) as pool:
+            async with pool.events(types=["aria2.onDownloadStop"]) as stream:
+                await self.server.notify("aria2.onDownloadStop", "a")
+                event = await asyncio.wait_for(stream.get(), 2)
+                self.assertEqual(event["params"][0]["gid"], "a")
+            self.assertEqual(pool.streams, [])
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            EventStream(overflow="newest")  # type: ignore
+
+
+class TestWebsocketPool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2(token="admin").start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def test_spread_requests(self):
+        async with await aioaria2.Aria2WebsocketPool.new(
+            self.server.url, token="admin", size=3
+        ) as pool:
+            self.assertEqual(len(self.server.websockets), 4)
+            results = await asyncio.gather(
+                *[pool.tellStatus(str(i)) for i in range(30)]
+            )
+            self.assertEqual([r["gid"] for r in results], [str(i) for i in range(30)])
+            self.assertEqual(len({r["id"] for r in self.server.requests}), 30)
+            self.assertEqual(pool.outstanding, [0, 0, 0])
+
+    async def test_least_outstanding(self):
+        async with await aioaria2.Aria2WebsocketPool.new(
+            self.server.url, token="admin", size=2
+        ) as pool:
+            self.server.hold = True
+            tasks = [asyncio.create_task(pool.getVersion()) for _ in range(4)]
+            await asyncio.sleep(0.1)
+            self.assertEqual(pool.outstanding, [2, 2])
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def test_notification(self):
+        async with await aioaria2.Aria2WebsocketPool.new(
+            self.server.url, token="admin", size=2
+        ) as pool:
+            received = []
+
+            @pool.onDownloadStart
+            async def on_start(client, data):
+                received.append((client, data["params"][0]["gid"]))
+
+            await self.server.notify("aria2.onDownloadStart", "abc")
+            await asyncio.sleep(0.1)
+            self.assertEqual(received, [(pool, "abc")])
+
+    async def test_shared_session(self):
+        async with await aioaria2.Aria2WebsocketPool.new(
+            self.server.url, token="admin", size=2
+        ) as pool:
+            await pool.connections[0].close()
+            self.assertFalse(pool._client_session.closed)
+            result = await pool.connections[1].getVersion()
+            self.assertEqual(result["version"], "1.37.0")
+        self.assertTrue(pool._client_session.closed)
+        async with aiohttp.ClientSession() as session:
+            client = await aioaria2.Aria2WebsocketClient.new(
+                self.server.url, token="admin", client_session=session
+            )
+            await client.close()
+            self.assertFalse(session.closed)
+
+    async def test_async_with_connects(self):
+        with self.assertWarns(UserWarning):  # 与Aria2WebsocketClient一样不推荐直接创建
+            pool = aioaria2.Aria2WebsocketPool(self.server.url, token="admin", size=2)
+        async with pool:
+            self.assertEqual(len(pool.connections), 2)
+            self.assertEqual((await pool.getVersion())["version"], "1.37.0")
+        self.assertTrue(pool.closed)
+
+    async def test_closed(self):
+        pool = await aioaria2.Aria2WebsocketPool.new(
+            self.server.url, token="admin", size=1
+        )
+        self.assertFalse(pool.closed)
+        await pool.close()
+        self.assertTrue(pool.closed)
+        with self.assertRaises(aioaria2.Aria2rpcException):
+            await pool.getVersion()
+
+
+class TestWebsocketReconnect(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2(token="admin").start()
+        self.server.downloads = {"a": {"gid": "a", "status": "active"}}
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def drop(self):
+        await self.server.websockets[-1].close()
+
+    async def test_reconnect(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, token="admin", auto_reconnect=True, reconnect_interval=0.01
+        ) as client:
+            await self.drop()
+            result = await client.getVersion()
+            self.assertEqual(result["version"], "1.37.0")
+            self.assertEqual(client.reconnects, 1)
+            self.assertEqual(len(self.server.websockets), 2)
+
+    async def test_replay_idempotent(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, token="admin", auto_reconnect=True, reconnect_interval=0.01
+        ) as client:
+            self.server.hold = True
+            read = asyncio.create_task(client.getVersion())
+            write = asyncio.create_task(client.pause("a"))
+            await asyncio.sleep(0.05)
+            self.server.hold = False
+            await self.drop()
+            self.assertEqual((await read)["version"], "1.37.0")
+            with self.assertRaises(aioaria2.Aria2rpcException) as cm:
+                await write
+            self.assertTrue(cm.exception.connection_error)
+
+    async def test_fail_fast(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url,
+            token="admin",
+            auto_reconnect=True,
+            reconnect_interval=0.01,
+            replay=False,
+        ) as client:
+            self.server.hold = True
+            read = asyncio.create_task(client.getVersion())
+            await asyncio.sleep(0.05)
+            self.server.hold = False
+            await self.drop()
+            with self.assertRaises(aioaria2.Aria2rpcException):
+                await read
+
+    async def test_timeout_resend(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url,
+            token="admin",
+            auto_reconnect=True,
+            reconnect_interval=0.01,
+            max_replays=1,
+        ) as client:
+            client.kw["timeout"] = 0.05
+            sent = []
+            send_payload = client._send_payload
+
+            async def counting(payload):
+                sent.append(json.loads(payload)["method"])
+                await send_payload(payload)
+
+            client._send_payload = counting
+            self.server.hold = True
+            with self.assertRaises(aioaria2.Aria2rpcException):
+                await client.pause("a")  # 可能已经执行 不能重发
+            with self.assertRaises(aioaria2.Aria2rpcException):
+                await client.getVersion()
+            self.assertEqual(
+                sent, ["aria2.pause", "aria2.getVersion", "aria2.getVersion"]
+            )
+
+    async def test_resync(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url,
+            token="admin",
+            auto_reconnect=True,
+            reconnect_interval=0.01,
+            resync=True,
+        ) as client:
+            received = []
+            reconnected = asyncio.Event()
+
+            @client.onDownloadComplete
+            async def on_complete(client, data):
+                received.append(data)
+
+            @client.onReconnect
+            async def on_reconnect(client, data):
+                reconnected.set()
+
+            self.server.downloads["a"]["status"] = "complete"
+            self.server.downloads["b"] = {"gid": "b", "status": "waiting"}
+            await self.drop()
+            await asyncio.wait_for(reconnected.wait(), 2)
+            self.assertEqual(len(received), 1)
+            self.assertEqual(received[0]["params"], [{"gid": "a"}])
+            self.assertTrue(received[0]["synthesized"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+
+import aioaria2
+from aioaria2.cluster import ConsistentHash, LeastActive
+from tests.mock_aria2 import MockAria2
+
+
+class TestCluster(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.servers = [await MockAria2().start() for _ in range(3)]
+        for i, server in enumerate(self.servers):
+            # node0 node1 node2分别有0 1 2个活动下载
+            server.downloads = {
+                f"x{j}": {"gid": f"x{j}", "status": "active"} for j in range(i)
+            }
+        self.cluster = aioaria2.Aria2Cluster(
+            {
+                f"node{i}": aioaria2.Aria2HttpClient(server.url)
+                for i, server in enumerate(self.servers)
+            },
+            timeout=2,
+        )
+
+    async def asyncTearDown(self) -> None:
+        await self.cluster.close()
+        for server in self.servers:
+            await server.close()
+
+    async def test_least_active(self):
+        self.cluster.placement = LeastActive(ttl=60)
+        gids = [await self.cluster.addUri([f"http://a/{i}"]) for i in range(3)]
+        # 负载为0 1 2 前两个下载放到node0 第三个放到node0或node1
+        self.assertEqual(self.cluster.node_of(gids[0]), "node0")
+        self.assertEqual(self.cluster.node_of(gids[1]), "node0")
+        self.assertIn(self.cluster.node_of(gids[2]), ("node0", "node1"))
+        status = await self.cluster.tellStatus(gids[0])
+        self.assertEqual(status["uri"], "http://a/0")
+
+    async def test_consistent_hash(self):
+        self.cluster.placement = ConsistentHash()
+        gid1 = await self.cluster.addUri(["http://a/same"])
+        gid2 = await self.cluster.addUri(["http://a/same"])
+        self.assertEqual(self.cluster.node_of(gid1), self.cluster.node_of(gid2))
+
+    async def test_scatter(self):
+        active = await self.cluster.tellActive(["gid"])
+        self.assertFalse(active.partial)
+        self.assertEqual(len(active.merged()), 3)
+        self.assertEqual(self.cluster.node_of("x1"), "node2")
+        stat = await self.cluster.getGlobalStat()
+        self.assertEqual(stat.total()["numActive"], 3)
+        await self.cluster.pauseAll()
+        stat = await self.cluster.getGlobalStat()
+        self.assertEqual(stat.total()["numWaiting"], 3)
+
+    async def test_partial(self):
+        self.cluster.nodes["dead"] = aioaria2.Aria2HttpClient(
+            "http://127.0.0.1:1/jsonrpc"
+        )
+        stat = await self.cluster.getGlobalStat()
+        self.assertTrue(stat.partial)
+        self.assertEqual(set(stat.results), {"node0", "node1", "node2"})
+        self.assertIsInstance(stat.errors["dead"], aioaria2.Aria2rpcException)
+
+    async def test_locate(self):
+        self.assertIsNone(self.cluster.node_of("x0"))
+        status = await self.cluster.tellStatus("x0")
+        self.assertEqual(status["gid"], "x0")
+        self.assertIn(self.cluster.node_of("x0"), ("node1", "node2"))
+
+    async def test_owns_clients(self):
+        client = aioaria2.Aria2HttpClient(self.servers[0].url)
+        async with aioaria2.Aria2Cluster([client], owns_clients=False) as cluster:
+            self.assertFalse((await cluster.getVersion()).partial)
+        self.assertFalse(client.client_session.closed)
+        await client.close()
+        self.assertTrue(client.client_session.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
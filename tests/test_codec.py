@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import aioaria2
+from aioaria2.codec import CallableCodec, JsonCodec, get_codec, get_default_codec
+from tests.mock_aria2 import MockAria2
+
+
+class TestCodec(unittest.TestCase):
+    def test_json(self):
+        codec = JsonCodec()
+        data = codec.dumps({"method": "aria2.addUri", "params": [["http://例子"]]})
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(codec.loads(data)["params"], [["http://例子"]])
+        self.assertEqual(codec.loads(data.decode()), codec.loads(data))
+
+    def test_callable(self):
+        codec = CallableCodec(json.loads, json.dumps)
+        self.assertEqual(codec.dumps([1, 2]), b"[1, 2]")
+        self.assertEqual(codec.loads(b"[1, 2]"), [1, 2])
+        self.assertFalse(codec.accepts_bytes)
+        self.assertTrue(CallableCodec(None, json.dumps).accepts_bytes)
+
+    def test_get_codec(self):
+        codec = JsonCodec()
+        self.assertIs(get_codec(codec, json.loads), codec)
+        self.assertIsInstance(get_codec(None, json.loads), CallableCodec)
+        self.assertIs(get_codec(), get_default_codec())
+
+
+def str_loads(data):
+    assert isinstance(data, str), type(data)  # 旧的loads只接受str
+    return json.loads(data)
+
+
+class TestClientCodec(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2().start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def test_str_loads(self):
+        async with aioaria2.Aria2HttpClient(self.server.url, loads=str_loads) as client:
+            self.assertEqual((await client.getVersion())["version"], "1.37.0")
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, loads=str_loads
+        ) as client:
+            self.assertNotIn("decode_text", client.kw)
+            self.assertEqual((await client.getVersion())["version"], "1.37.0")
+
+    async def test_loads_dumps_attributes(self):
+        async with aioaria2.Aria2HttpClient(self.server.url) as client:
+            self.assertEqual(client.loads(b'{"a":1}'), {"a": 1})
+            self.assertEqual(json.loads(client.dumps({"a": 1})), {"a": 1})
+            await client.getVersion()
+            client.loads = str_loads
+            client.dumps = json.dumps
+            self.assertIsInstance(client.codec, CallableCodec)
+            self.assertEqual((await client.getVersion())["version"], "1.37.0")
+            self.assertEqual(client.dumps([1, 2]), b"[1, 2]")
+            self.assertIs(client.codec._loads, str_loads)
+
+
+if __name__ == "__main__":
+    unittest.main()
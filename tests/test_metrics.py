@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import tempfile
+import unittest
+
+import aioaria2
+from aioaria2.events import NotificationDispatcher
+from aioaria2.metrics import Histogram, MetricsCollector
+from tests.mock_aria2 import MockAria2
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe(self):
+        histogram = Histogram((1, 2, 4))
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.sum, 16)
+        self.assertEqual(
+            histogram.cumulative(), [(1, 2), (2, 3), (4, 4), (float("inf"), 5)]
+        )
+        self.assertEqual(histogram.quantile(0.5), 2)
+        self.assertEqual(histogram.quantile(1), 4)
+
+    def test_prometheus(self):
+        metrics = MetricsCollector(latency_buckets=(0.1, 1))
+        metrics.on_request_start("aria2.tellStatus")
+        metrics.on_request_end("aria2.tellStatus", 0.05, False)
+        metrics.on_request_start("aria2.tellStatus")
+        metrics.on_request_end("aria2.tellStatus", 2, True)
+        metrics.on_reconnect()
+        text = metrics.to_prometheus()
+        self.assertIn("# TYPE aioaria2_request_duration_seconds histogram", text)
+        self.assertIn(
+            'aioaria2_request_duration_seconds_bucket{method="aria2.tellStatus",le="0.1"} 1',
+            text,
+        )
+        self.assertIn(
+            'aioaria2_request_duration_seconds_bucket{method="aria2.tellStatus",le="+Inf"} 2',
+            text,
+        )
+        self.assertIn(
+            'aioaria2_request_duration_seconds_count{method="aria2.tellStatus"} 2', text
+        )
+        self.assertIn(
+            'aioaria2_request_errors_total{method="aria2.tellStatus"} 1', text
+        )
+        self.assertIn('aioaria2_requests_in_flight{method="aria2.tellStatus"} 0', text)
+        self.assertIn("aioaria2_reconnects_total 1", text)
+        self.assertNotIn("queue_depth", text)  # 没有数据的指标不导出
+
+
+class PeakCollector(MetricsCollector):
+    def __init__(self) -> None:
+        super().__init__()
+        self.peak = 0
+
+    def on_pending(self, delta: int) -> None:
+        super().on_pending(delta)
+        self.peak = max(self.peak, self.gauges["pending_responses"][""])
+
+
+class TestClientMetrics(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2().start()
+        self.metrics = PeakCollector()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def test_http(self):
+        async with aioaria2.Aria2HttpClient(
+            self.server.url, metrics=self.metrics
+        ) as client:
+            await client.getVersion()
+            await client.getVersion()
+            with self.assertRaises(aioaria2.Aria2rpcException):
+                await client.jsonrpc("noSuchMethod")
+        latency = self.metrics.histogram("request_duration_seconds", "aria2.getVersion")
+        self.assertEqual(latency.count, 2)
+        self.assertEqual(
+            self.metrics.counters["request_errors_total"]["aria2.noSuchMethod"], 1
+        )
+        self.assertEqual(
+            self.metrics.histogram("request_bytes", "aria2.getVersion").count, 2
+        )
+        self.assertEqual(self.metrics.histogram("received_bytes").count, 3)
+        self.assertEqual(
+            self.metrics.gauges["requests_in_flight"]["aria2.getVersion"], 0
+        )
+
+    async def test_batch_queue_depth(self):
+        async with aioaria2.Aria2HttpClient(
+            self.server.url, mode="batch", metrics=self.metrics
+        ) as client:
+            await client.getVersion()
+            await client.getVersion()
+            self.assertEqual(self.metrics.gauges["queue_depth"][""], 2)
+            await client.process_queue()
+            self.assertEqual(self.metrics.gauges["queue_depth"][""], 0)
+        self.assertEqual(self.metrics.histogram("request_bytes", "batch").count, 1)
+
+    async def test_websocket(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, metrics=self.metrics
+        ) as client:
+            handled = asyncio.Event()
+
+            @client.onDownloadStart
+            async def on_start(client, data):
+                handled.set()
+
+            await asyncio.gather(client.getVersion(), client.getVersion())
+            self.assertEqual(self.metrics.peak, 2)
+            self.assertEqual(self.metrics.gauges["pending_responses"][""], 0)
+            await self.server.notify("aria2.onDownloadStart", "a")
+            await asyncio.wait_for(handled.wait(), 2)
+        lag = self.metrics.histogram(
+            "notification_lag_seconds", "aria2.onDownloadStart"
+        )
+        self.assertEqual(lag.count, 1)
+
+    async def test_cancelled_is_not_error(self):
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, metrics=self.metrics
+        ) as client:
+            self.server.hold = True
+            task = asyncio.ensure_future(client.getVersion())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertEqual(
+            self.metrics.counters["request_errors_total"]["aria2.getVersion"], 0
+        )
+        self.assertEqual(
+            self.metrics.gauges["requests_in_flight"]["aria2.getVersion"], 0
+        )
+
+    async def test_direct_calls(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "a.torrent")
+        with open(path, "wb") as handle:
+            handle.write(b"torrent")
+        async with aioaria2.Aria2HttpClient(
+            self.server.url, metrics=self.metrics
+        ) as client:
+            await client.add_torrent(path)
+            [r async for r in client.add_torrents([path, path])]
+            [s async for s in client.get_statuses(["a", "b"])]
+        latency = self.metrics.histogram
+        self.assertEqual(
+            latency("request_duration_seconds", "aria2.addTorrent").count, 1
+        )
+        self.assertEqual(
+            latency("request_duration_seconds", "system.multicall").count, 2
+        )
+
+    async def test_dispatcher_timestamps_only_with_lag(self):
+        async def handler(data):
+            pass
+
+        data = {"method": "aria2.onDownloadStart", "params": [{"gid": "a"}]}
+        dispatcher = NotificationDispatcher(handler, workers=1)
+        dispatcher.put_nowait(data)
+        self.assertIs(dispatcher._queues[0].get_nowait(), data)
+        dispatcher = NotificationDispatcher(handler, workers=1, on_lag=print)
+        dispatcher.put_nowait(data)
+        self.assertIs(dispatcher._queues[0].get_nowait()[1], data)
+
+    async def test_pool_shares_collector(self):
+        async with await aioaria2.Aria2WebsocketPool.new(
+            self.server.url, size=2, metrics=self.metrics
+        ) as pool:
+            await asyncio.gather(*[pool.getVersion() for _ in range(4)])
+        latency = self.metrics.histogram("request_duration_seconds", "aria2.getVersion")
+        self.assertEqual(latency.count, 4)  # 只在连接池这一层计时
+        self.assertEqual(
+            self.metrics.histogram("request_bytes", "aria2.getVersion").count, 4
+        )
+        self.assertEqual(self.metrics.gauges["pending_responses"][""], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,60 @@
 # -*- coding: utf-8 -*-
+import os
+import tempfile
 from io import BytesIO
+from ipaddress import IPv4Address, IPv6Address
 from os.path import dirname, join
 from unittest import TestCase
 
 from aioaria2 import ControlFile, DHTFile
+from aioaria2 import parser as parser_module
+from aioaria2.parser import InFlightPiece, LazyInFlightPieces, NodeInfo, NodeTable
+
+
+def make_control_file(version=1):
+    return ControlFile(
+        version=version,
+        ext=b"\x00\x00\x00\x01",
+        info_hash_length=20,
+        info_hash=bytes(range(20)),
+        piece_length=1 << 20,
+        total_length=(10 << 20) + 1,
+        upload_length=123,
+        bitfield_length=2,
+        bitfield=b"\xff\x00",
+        num_inflight_piece=2,
+        inflight_pieces=[
+            InFlightPiece(
+                index=8,
+                length=1 << 20,
+                piece_bitfield_length=8,
+                piece_bitfield=b"\xf0" * 8,
+            ),
+            InFlightPiece(
+                index=10, length=1, piece_bitfield_length=1, piece_bitfield=b"\x00"
+            ),
+        ],
+    )
+
+
+def make_node(i, v6=False):
+    if v6:
+        return NodeInfo(
+            18, (IPv6Address(f"2001:db8::{i + 1:x}"), 6881 + i), bytes([i]) * 20
+        )
+    return NodeInfo(6, (IPv4Address(f"10.0.0.{i + 1}"), 6881 + i), bytes([i]) * 20)
+
+
+def make_dht_file(nodes):
+    return DHTFile(
+        mgc=b"\xa1\xa2",
+        fmt=b"\x02",
+        ver=b"\x00\x03",
+        mtime=1700000000,
+        localnode_id=b"\x01" * 20,
+        num_node=len(nodes),
+        nodes=nodes,
+    )
 
 
 class Testarser(TestCase):
@@ -15,6 +66,59 @@ class Testarser(TestCase):
             s.getvalue(), open("180P_225K_242958531.webm.aria2", "rb").read()
         )
 
+    def test_ControlFile_buffer(self):
+        for version in (0, 1):
+            s = BytesIO()
+            make_control_file(version).save(s)
+            data = s.getvalue()
+            parsed = ControlFile.from_buffer(data)
+            self.assertIsInstance(parsed.bitfield, memoryview)
+            self.assertEqual(parsed.bitfield, b"\xff\x00")
+            self.assertEqual(parsed.inflight_pieces[0].piece_bitfield, b"\xf0" * 8)
+            out = BytesIO()
+            parsed.save(out)
+            self.assertEqual(out.getvalue(), data)
+
+    def test_ControlFile_stream_position(self):
+        s = BytesIO()
+        make_control_file().save(s)
+        end = s.tell()
+        s.write(b"trailing")
+        s.seek(0)
+        self.assertEqual(ControlFile.from_file(s), make_control_file())
+        self.assertEqual(s.tell(), end)
+
+    def test_ControlFile_mmap_lazy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = join(tmp, "file.aria2")
+            with open(path, "wb") as f:
+                make_control_file().save(f)
+            parsed = ControlFile.from_file(path, lazy=True)
+            self.assertIsInstance(parsed.inflight_pieces, LazyInFlightPieces)
+            self.assertFalse(parsed.inflight_pieces.loaded)
+            self.assertEqual(len(parsed.inflight_pieces), 2)
+            self.assertEqual(parsed.info_hash, bytes(range(20)))
+            self.assertEqual(parsed, make_control_file())
+            self.assertTrue(parsed.inflight_pieces.loaded)
+            self.assertEqual(parsed.inflight_pieces[1].index, 10)
+            self.assertIsNone(parsed.inflight_pieces._mapping)  # 解析完就关闭了
+            # 不lazy时bitfield是拷贝 不持有映射
+            parsed = ControlFile.from_file(path)
+            self.assertIsInstance(parsed.bitfield, bytes)
+            self.assertIsInstance(parsed.inflight_pieces[0].piece_bitfield, bytes)
+            with ControlFile.from_file(path, lazy=True) as parsed:
+                self.assertEqual(parsed.info_hash, bytes(range(20)))
+            self.assertEqual(parsed.bitfield, make_control_file().bitfield)
+            with self.assertRaises(ValueError):
+                parsed.inflight_pieces[0]
+            with open(path, "r+b") as f:
+                f.truncate(30)
+            with self.assertRaises(ValueError):
+                ControlFile.from_file(path)
+            open(join(tmp, "empty.aria2"), "wb").close()
+            with self.assertRaises(ValueError):
+                ControlFile.from_file(join(tmp, "empty.aria2"))
+
     def test_DHTFile(self):
         s = BytesIO()
         data = DHTFile.from_file(join(dirname(__file__), "dht.dat"))
@@ -32,3 +136,43 @@ class Testarser(TestCase):
             len(s.getvalue()),
             len(open(join(dirname(__file__), "dht6.dat"), "rb").read()),
         )
+
+    def test_DHTFile_buffer(self):
+        for v6 in (False, True):
+            nodes = [make_node(i, v6) for i in range(5)]
+            s = BytesIO()
+            make_dht_file(nodes).save(s)
+            self.assertEqual(len(s.getvalue()), 56 + 56 * 5)
+            self.assertEqual(DHTFile.from_buffer(s.getvalue()), make_dht_file(nodes))
+            lazy = DHTFile.from_buffer(s.getvalue(), lazy=True)
+            self.assertIsInstance(lazy.nodes, NodeTable)
+            self.assertEqual(lazy.nodes, nodes)
+            self.assertEqual(lazy.nodes.peer(2), nodes[2].compact_peer_info)
+            out = BytesIO()
+            lazy.save(out)
+            self.assertEqual(out.getvalue(), s.getvalue())
+
+    def check_node_table(self):
+        table = NodeTable.from_nodes([make_node(i) for i in range(4)])
+        other = NodeTable.from_nodes([make_node(1, True), make_node(7)])
+        merged = table.merge(other)
+        self.assertEqual(len(merged), 5)
+        self.assertEqual(merged.node_ids(), [bytes([i]) * 20 for i in (0, 2, 3, 1, 7)])
+        self.assertEqual(merged[3], make_node(1, True))
+        self.assertEqual(merged[-1], make_node(7))
+        self.assertEqual(table[1:3], [make_node(1), make_node(2)])
+        self.assertEqual(table[::2], [make_node(0), make_node(2)])
+        self.assertIs(table.dedupe(), table)
+
+    def test_NodeTable(self):
+        if parser_module.np is None:
+            self.skipTest("numpy not installed")
+        self.check_node_table()
+
+    def test_NodeTable_pure_python(self):
+        np = parser_module.np
+        parser_module.np = None
+        try:
+            self.check_node_table()
+        finally:
+            parser_module.np = np
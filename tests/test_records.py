@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import sys
+import unittest
+
+from aioaria2 import DownloadStatus, FileInfo, GlobalStat
+from aioaria2.records import decode_record
+
+STATUS = {
+    "bitfield": "0000000000",
+    "completedLength": "901120",
+    "connections": "1",
+    "dir": "/downloads",
+    "downloadSpeed": "15158",
+    "files": [
+        {
+            "index": "1",
+            "length": "34896138",
+            "completedLength": "34896138",
+            "path": "/downloads/file",
+            "selected": "true",
+            "uris": [{"status": "used", "uri": "http://example.org/file"}],
+        }
+    ],
+    "gid": "2089b05ecca3d829",
+    "numPieces": "34",
+    "pieceLength": "1048576",
+    "status": "active",
+    "totalLength": "34896138",
+    "uploadLength": "0",
+    "uploadSpeed": "0",
+}
+
+
+class TestRecords(unittest.TestCase):
+    def test_status(self):
+        status = DownloadStatus.from_dict(STATUS)
+        self.assertEqual(status.completedLength, 901120)
+        self.assertEqual(status.completedLength, 901120)  # 已缓存
+        self.assertEqual(status.gid, "2089b05ecca3d829")
+        self.assertIsNone(status.errorCode)
+        self.assertIsNone(status.seeder)
+        self.assertIsInstance(status.files[0], FileInfo)
+        self.assertIs(status.files[0].selected, True)
+        self.assertEqual(status.files[0].length, 34896138)
+        self.assertNotIn("errorCode", status.as_dict())
+        self.assertEqual(status, DownloadStatus.from_dict(STATUS))
+        self.assertFalse(hasattr(status, "__dict__"))
+        self.assertLess(sys.getsizeof(status), sys.getsizeof(STATUS))
+
+    def test_decode(self):
+        data = (
+            b'{"id":1,"jsonrpc":"2.0","result":{"downloadSpeed":"10","numActive":"2"}}'
+        )
+        stat = decode_record(data, GlobalStat)
+        self.assertEqual(stat.numActive, 2)
+        self.assertIsNone(stat.numWaiting)
+        self.assertEqual(len(decode_record(b"[{}, {}]", GlobalStat)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
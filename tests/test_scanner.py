@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+from os.path import join
+
+from aioaria2.scanner import ScanStats, scan_control_files
+from tests.test_parser import make_control_file
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        for i in range(10):
+            path = join(self.tmp.name, str(i % 3), f"{i}.webm.aria2")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                make_control_file().save(f)
+        with open(join(self.tmp.name, "broken.aria2"), "wb") as f:
+            f.write(b"\x00\x01")
+        with open(join(self.tmp.name, "not_a_control_file.webm"), "wb") as f:
+            f.write(b"\x00\x01")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def check(self, executor):
+        stats = ScanStats()
+        results = list(
+            scan_control_files(self.tmp.name, 2, executor, chunk_size=3, stats=stats)
+        )
+        self.assertEqual(len(results), 11)
+        self.assertEqual(stats.files, 11)
+        self.assertEqual(stats.errors, 1)
+        self.assertGreater(stats.bytes, 0)
+        self.assertGreater(stats.files_per_second, 0)
+        ok = [r for r in results if r.error is None]
+        self.assertEqual(len(ok), 10)
+        self.assertEqual(ok[0].num_pieces, 11)
+        self.assertEqual(ok[0].completed_pieces, 8)
+        self.assertEqual(ok[0].completed_length, 8 << 20)
+        self.assertEqual(ok[0].num_inflight_piece, 2)
+        self.assertEqual(ok[0].info_hash, bytes(range(20)))
+
+    def test_thread(self):
+        self.check("thread")
+
+    def test_process(self):
+        self.check("process")
+
+
+if __name__ == "__main__":
+    unittest.main()
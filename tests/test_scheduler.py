@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import tempfile
+import unittest
+
+import aioaria2
+from aioaria2.metrics import MetricsCollector
+from aioaria2.scheduler import (
+    PRIORITY_BULK,
+    PRIORITY_CONTROL,
+    PRIORITY_READ,
+    RequestQueue,
+    RequestScheduler,
+    TokenBucket,
+)
+from tests.mock_aria2 import MockAria2
+
+
+def _req(method, *params):
+    return {"method": method, "params": list(params)}
+
+
+class TestRequestScheduler(unittest.IsolatedAsyncioTestCase):
+    def test_priority_of(self):
+        scheduler = RequestScheduler(priorities={"aria2.getVersion": PRIORITY_CONTROL})
+        self.assertEqual(
+            scheduler.priority_of(_req("aria2.tellStatus"), True), PRIORITY_READ
+        )
+        self.assertEqual(scheduler.priority_of(_req("aria2.pause"), False), 0)
+        self.assertEqual(
+            scheduler.priority_of(_req("aria2.addUri"), False), PRIORITY_BULK
+        )
+        self.assertEqual(
+            scheduler.priority_of(_req("aria2.getVersion"), True), PRIORITY_CONTROL
+        )
+        calls = [{"methodName": "aria2.tellStatus"}, {"methodName": "aria2.addUri"}]
+        self.assertEqual(
+            scheduler.priority_of(_req("system.multicall", calls), False),
+            PRIORITY_BULK,
+        )
+
+    async def test_priority_order(self):
+        # 令牌只够发一个请求 补充后先给优先级高的
+        scheduler = RequestScheduler(rate=100, burst=1)
+        order = []
+
+        async def send(name):
+            order.append(name)
+
+        first = asyncio.create_task(
+            scheduler.run(_req("aria2.tellStatus"), lambda: send("first"), True)
+        )
+        await asyncio.sleep(0)
+        read = asyncio.create_task(
+            scheduler.run(_req("aria2.tellStatus"), lambda: send("read"), True)
+        )
+        bulk = asyncio.create_task(
+            scheduler.run(_req("aria2.addUri"), lambda: send("bulk"), False)
+        )
+        control = asyncio.create_task(
+            scheduler.run(_req("aria2.pause"), lambda: send("control"), False)
+        )
+        await asyncio.sleep(0)
+        self.assertEqual(len(scheduler), 3)
+        await asyncio.gather(first, read, bulk, control)
+        self.assertEqual(order, ["first", "control", "read", "bulk"])
+        self.assertEqual(scheduler.running(PRIORITY_READ), 0)
+        self.assertEqual(scheduler.stats[PRIORITY_READ].dispatched, 2)
+
+    async def test_limit_does_not_block_other_priorities(self):
+        scheduler = RequestScheduler(limits={PRIORITY_READ: 1})
+        gate = asyncio.Event()
+        order = []
+
+        async def send(name):
+            order.append(name)
+            await gate.wait()
+
+        first = asyncio.create_task(
+            scheduler.run(_req("aria2.tellStatus"), lambda: send("first"), True)
+        )
+        await asyncio.sleep(0)
+        read = asyncio.create_task(
+            scheduler.run(_req("aria2.tellStatus"), lambda: send("read"), True)
+        )
+        control = asyncio.create_task(
+            scheduler.run(_req("aria2.pause"), lambda: send("control"), False)
+        )
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        self.assertEqual(order, ["first", "control"])
+        self.assertEqual(len(scheduler), 1)
+        gate.set()
+        await asyncio.gather(first, read, control)
+        self.assertEqual(order, ["first", "control", "read"])
+
+    async def test_concurrency_limit(self):
+        scheduler = RequestScheduler(limits={PRIORITY_BULK: 2})
+        running = peak = 0
+
+        async def send():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(
+            *[scheduler.run(_req("aria2.addUri"), send) for _ in range(6)]
+        )
+        self.assertEqual(peak, 2)
+        self.assertEqual(scheduler.stats[PRIORITY_BULK].dispatched, 6)
+
+    async def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, burst=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.assertGreater(bucket.delay(), 0)
+        scheduler = RequestScheduler(rate=100, burst=1)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async def send():
+            return None
+
+        await asyncio.gather(
+            *[scheduler.run(_req("aria2.tellStatus"), send, True) for _ in range(5)]
+        )
+        self.assertGreaterEqual(loop.time() - start, 0.03)
+        self.assertGreater(scheduler.stats[PRIORITY_READ].max_wait, 0)
+
+    async def test_deadline(self):
+        scheduler = RequestScheduler(
+            limits={PRIORITY_READ: 1}, deadlines={PRIORITY_READ: 0.01}
+        )
+        gate = asyncio.Event()
+        sent = []
+
+        async def send(name):
+            sent.append(name)
+            await gate.wait()
+
+        first = asyncio.create_task(
+            scheduler.run(_req("aria2.tellStatus"), lambda: send("first"), True)
+        )
+        await asyncio.sleep(0)
+        with self.assertRaises(aioaria2.Aria2rpcException):
+            await scheduler.run(_req("aria2.tellStatus"), lambda: send("stale"), True)
+        self.assertEqual(scheduler.stats[PRIORITY_READ].dropped, 1)
+        gate.set()
+        await first
+        self.assertEqual(sent, ["first"])
+        self.assertEqual(scheduler.running(PRIORITY_READ), 0)
+
+    async def test_cancel_while_queued(self):
+        scheduler = RequestScheduler(limits={PRIORITY_READ: 1})
+        gate = asyncio.Event()
+
+        async def send():
+            await gate.wait()
+
+        first = asyncio.create_task(scheduler.run(_req("aria2.tellStatus"), send, True))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(
+            scheduler.run(_req("aria2.tellStatus"), send, True)
+        )
+        await asyncio.sleep(0)
+        queued.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await queued
+        gate.set()
+        await first
+        self.assertEqual(scheduler.running(PRIORITY_READ), 0)
+        self.assertEqual(len(scheduler), 0)
+
+
+class TestRequestQueue(unittest.IsolatedAsyncioTestCase):
+    async def test_drain(self):
+        queue = RequestQueue()
+        queue.put_nowait("a")
+        await asyncio.sleep(0.01)
+        queue.put_nowait("b")
+        self.assertGreaterEqual(queue.oldest_wait(), 0.01)
+        (wait_a, a), (wait_b, b) = queue.drain()
+        self.assertEqual((a, b), ("a", "b"))
+        self.assertGreater(wait_a, wait_b)
+        self.assertTrue(queue.empty())
+        self.assertEqual(queue.oldest_wait(), 0)
+
+
+class TestClientScheduler(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2().start()
+        self.metrics = MetricsCollector()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def test_http(self):
+        scheduler = RequestScheduler(limits={PRIORITY_READ: 1})
+        async with aioaria2.Aria2HttpClient(
+            self.server.url, metrics=self.metrics, scheduler=scheduler
+        ) as client:
+            results = await asyncio.gather(
+                *[client.tellStatus(f"{i:016x}") for i in range(3)]
+            )
+            await client.snapshot(["0000000000000001"])
+        self.assertEqual([r["gid"] for r in results], [f"{i:016x}" for i in range(3)])
+        self.assertIs(scheduler.metrics, self.metrics)
+        self.assertEqual(scheduler.stats[PRIORITY_READ].dispatched, 4)
+        self.assertEqual(self.metrics.histogram("queue_wait_seconds", "read").count, 4)
+
+    async def test_batch_deadline(self):
+        scheduler = RequestScheduler(deadlines={PRIORITY_READ: 0.01})
+        async with aioaria2.Aria2HttpClient(
+            self.server.url, mode="batch", metrics=self.metrics, scheduler=scheduler
+        ) as client:
+            self.assertIsInstance(client.queue, RequestQueue)
+            await client.tellStatus("0000000000000001")
+            await asyncio.sleep(0.02)
+            await client.getVersion()
+            stale, version = await client.process_queue()
+        self.assertIsInstance(stale, aioaria2.Aria2rpcException)
+        self.assertEqual(version["version"], "1.37.0")
+        self.assertEqual(len(self.server.requests), 1)  # 过期的请求没有发出
+        self.assertEqual(scheduler.stats[PRIORITY_READ].dropped, 1)
+        self.assertEqual(self.metrics.histogram("queue_wait_seconds", "batch").count, 2)
+
+    async def test_file_uploads(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(directory.name, f"{i}.torrent"))
+            with open(paths[-1], "wb") as handle:
+                handle.write(bytes([i]) * 100)
+        scheduler = RequestScheduler(limits={PRIORITY_BULK: 1})
+        async with aioaria2.Aria2HttpClient(
+            self.server.url, metrics=self.metrics, scheduler=scheduler
+        ) as client:
+            await client.add_torrent(paths[0])
+        # 合并窗口不影响直接发送的multicall
+        async with aioaria2.Aria2HttpClient(
+            self.server.url,
+            metrics=self.metrics,
+            scheduler=scheduler,
+            coalesce_window=0,
+        ) as client:
+            results = [r async for r in client.add_torrents(paths, max_calls=2)]
+        self.assertEqual(len(results), 3)
+        self.assertEqual(scheduler.stats[PRIORITY_BULK].dispatched, 3)
+        self.assertTrue(all(isinstance(r, dict) for r in self.server.requests))
+        self.assertEqual(
+            self.metrics.histogram(
+                "request_duration_seconds", "aria2.addTorrent"
+            ).count,
+            1,
+        )
+        self.assertEqual(
+            self.metrics.histogram(
+                "request_duration_seconds", "system.multicall"
+            ).count,
+            2,
+        )
+
+    async def test_resync_fetch(self):
+        self.server.downloads = {}
+        scheduler = RequestScheduler()
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, auto_reconnect=True, resync=True, scheduler=scheduler
+        ):
+            pass
+        self.assertEqual(scheduler.stats[PRIORITY_READ].dispatched, 1)
+
+    async def test_websocket(self):
+        scheduler = RequestScheduler(rate=1000)
+        async with await aioaria2.Aria2WebsocketClient.new(
+            self.server.url, scheduler=scheduler
+        ) as client:
+            await asyncio.gather(*[client.getVersion() for _ in range(3)])
+        self.assertEqual(scheduler.stats[PRIORITY_READ].dispatched, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
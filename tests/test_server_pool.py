@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sys
+import tempfile
+import unittest
+
+import aioaria2
+from aioaria2.server import AsyncAria2ServerPool, _free_port
+
+FAKE_ARIA2C = (sys.executable, "-m", "tests.fake_aria2c")
+
+
+class TestSingleton(unittest.TestCase):
+    def test_subclass_has_own_instance(self):
+        class A(aioaria2.Aria2Server):
+            pass
+
+        class B(A):
+            pass
+
+        a = A("aria2c")
+        self.assertIs(A("aria2c"), a)
+        self.assertIsNot(B("aria2c"), a)
+        self.assertIsInstance(B("aria2c"), B)
+
+
+class _Server(aioaria2.AsyncAria2Server):
+    _singleton = False
+
+
+class TestReadiness(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.port = _free_port("127.0.0.1")
+
+    async def test_start_ready(self):
+        server = _Server(
+            *FAKE_ARIA2C,
+            f"--rpc-listen-port={self.port}",
+            "--rpc-secret=admin",
+            "--fake-startup-delay=0.3",
+        )
+        await server.start(ready=True)
+        try:
+            self.assertGreaterEqual(server.startup_latency, 0.3)
+            self.assertEqual(server.version["version"], "1.37.0")
+        finally:
+            await server.terminate()
+
+    async def test_prewarm(self):
+        server = _Server(*FAKE_ARIA2C, f"--rpc-listen-port={self.port}")
+        task = server.prewarm()
+        await asyncio.sleep(0)  # 其他初始化
+        latency = await server.wait_ready()
+        self.assertIs(await task, latency)
+        self.assertEqual(server.startup_latency, latency)
+        await server.terminate()
+
+    async def test_restart_after_prewarm(self):
+        server = _Server(*FAKE_ARIA2C, f"--rpc-listen-port={self.port}")
+        first = await server.prewarm()
+        await server.terminate()
+        await server.start()
+        self.assertIsNone(server._ready_task)
+        second = await server.wait_ready()
+        self.assertIsNot(second, first)
+        self.assertEqual(server.startup_latency, second)
+        await server.terminate()
+
+    async def test_exit_before_ready(self):
+        server = _Server(*FAKE_ARIA2C, "--fake-exit-code=1")
+        with self.assertRaises(aioaria2.Aria2rpcException) as cm:
+            await server.start(ready=True)
+        self.assertIn("exited with code 1", cm.exception.msg)
+        await server.wait()
+
+    async def test_wait_ready_before_start(self):
+        server = _Server(*FAKE_ARIA2C, f"--rpc-listen-port={self.port}")
+        with self.assertRaises(aioaria2.Aria2rpcException) as cm:
+            await server.wait_ready()
+        self.assertIn("not started", cm.exception.msg)
+
+
+class TestServerPool(unittest.IsolatedAsyncioTestCase):
+    async def test_pool(self):
+        with tempfile.TemporaryDirectory() as session_dir:
+            async with AsyncAria2ServerPool(
+                *FAKE_ARIA2C,
+                size=2,
+                token="admin",
+                session_dir=session_dir,
+                restart_interval=0.01,
+            ) as pool:
+                self.assertEqual(len(pool.ready_clients), 2)
+                self.assertEqual(len({m.port for m in pool.members}), 2)
+                clients = {await pool.acquire() for _ in range(4)}
+                self.assertEqual(len(clients), 2)
+                for client in clients:
+                    self.assertEqual((await client.getVersion())["version"], "1.37.0")
+                stat = await pool.cluster().getGlobalStat()
+                self.assertFalse(stat.partial)
+
+                # 崩溃后自动重启 端口不变
+                member = pool.members[0]
+                member.server.process.kill()
+                await asyncio.sleep(0.1)
+                await asyncio.wait_for(member.ready.wait(), 10)
+                self.assertEqual(member.restarts, 1)
+                await member.client.getVersion()
+            self.assertTrue(all(m.server.returncode is not None for m in pool.members))
+
+    async def test_close_cluster(self):
+        async with AsyncAria2ServerPool(
+            *FAKE_ARIA2C, size=2, token="admin", restart=False
+        ) as pool:
+            async with pool.cluster() as cluster:
+                self.assertFalse((await cluster.getVersion()).partial)
+            client = await pool.acquire()
+            await client.close()
+            self.assertFalse(pool._session.closed)
+            for member in pool.members:
+                self.assertEqual(
+                    (await member.client.getVersion())["version"], "1.37.0"
+                )
+            stat = await pool.cluster().getGlobalStat()
+            self.assertFalse(stat.partial)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+
+import aioaria2
+from tests.mock_aria2 import MockAria2
+
+
+class TestDownloadStateCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = await MockAria2().start()
+        self.server.downloads = {
+            "a": {"gid": "a", "status": "active", "completedLength": "1"},
+            "b": {"gid": "b", "status": "waiting", "completedLength": "0"},
+            "c": {"gid": "c", "status": "complete", "completedLength": "9"},
+        }
+        self.client = await aioaria2.Aria2WebsocketClient.new(self.server.url)
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        await self.server.close()
+
+    async def test_seed_and_refresh(self):
+        changes = []
+        async with aioaria2.DownloadStateCache(
+            self.client, keys=["completedLength"], debounce=0.01
+        ) as cache:
+
+            @cache.on_change
+            async def _(cache, gid, old, new):
+                changes.append((gid, old and old["status"], new and new["status"]))
+
+            self.assertEqual(len(cache), 3)
+            self.assertEqual(cache.by_status("waiting"), {"b"})
+            self.assertEqual(cache["c"]["completedLength"], "9")
+
+            self.server.requests.clear()
+            self.server.downloads["b"]["status"] = "active"
+            del self.server.downloads["c"]
+            await self.server.notify("aria2.onDownloadStart", "b")
+            await self.server.notify("aria2.onDownloadStop", "c")
+            for _ in range(100):
+                if len(changes) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(
+                sorted(changes), [("b", "waiting", "active"), ("c", "complete", None)]
+            )
+            self.assertEqual(cache.by_status("active"), {"a", "b"})
+            self.assertNotIn("c", cache)
+            # 两个通知合并为一次multicall 且只查询了dirty的gid
+            self.assertEqual(len(self.server.requests), 1)
+            self.assertEqual(len(self.server.requests[0]["params"][0]), 2)
+
+    async def test_refresh_active(self):
+        cache = await aioaria2.DownloadStateCache(self.client).start()
+        self.server.downloads["a"]["completedLength"] = "5"
+        await cache.refresh_active()
+        self.assertEqual(cache["a"]["completedLength"], "5")
+        await cache.close()
+
+    async def test_normal_mode_only(self):
+        for mode in ("batch", "format"):
+            async with await aioaria2.Aria2WebsocketClient.new(
+                self.server.url, mode=mode
+            ) as client:
+                with self.assertRaises(ValueError):
+                    aioaria2.DownloadStateCache(client)
+
+
+if __name__ == "__main__":
+    unittest.main()
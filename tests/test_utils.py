@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import base64
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from aioaria2.utils import (
+    aiter_b64_payload,
+    b64encoded_length,
+    build_b64_payload,
+    iter_b64encode_file,
+)
+
+
+class TestB64(unittest.TestCase):
+    def setUp(self) -> None:
+        handle = tempfile.NamedTemporaryFile(delete=False)
+        with handle:
+            handle.write(os.urandom(100))
+        self.path = handle.name
+        with open(self.path, "rb") as handle:
+            self.expected = base64.b64encode(handle.read())
+
+    def tearDown(self) -> None:
+        os.unlink(self.path)
+
+    def test_length(self):
+        for size in range(10):
+            self.assertEqual(
+                b64encoded_length(size), len(base64.b64encode(b"x" * size))
+            )
+
+    def test_chunks(self):
+        for chunk_size in (3, 6, 99, 300):
+            self.assertEqual(
+                b"".join(iter_b64encode_file(self.path, chunk_size)), self.expected
+            )
+
+    def test_size_changed(self):
+        self.assertEqual(
+            b"".join(iter_b64encode_file(self.path, 12, size=100)), self.expected
+        )
+        for size in (99, 101):
+            with self.assertRaises(ValueError):
+                b"".join(iter_b64encode_file(self.path, 12, size=size))
+        chunks = iter_b64encode_file(self.path, 12, size=100)
+        next(chunks)
+        with open(self.path, "ab") as handle:
+            handle.write(b"more")
+        with self.assertRaises(ValueError):
+            b"".join(chunks)
+        with open(self.path, "wb") as handle:  # 比读取缓冲区大
+            handle.write(os.urandom(30000))
+        chunks = iter_b64encode_file(self.path, 12, size=30000)
+        next(chunks)
+        os.truncate(self.path, 50)
+        with self.assertRaises(ValueError):
+            b"".join(chunks)
+
+    def test_build(self):
+        payload = build_b64_payload(b'["', self.path, b'"]', 9)
+        self.assertEqual(bytes(payload), b'["' + self.expected + b'"]')
+
+    def test_aiter(self):
+        async def collect():
+            return b"".join(
+                [chunk async for chunk in aiter_b64_payload(b"<", self.path, b">", 12)]
+            )
+
+        self.assertEqual(asyncio.run(collect()), b"<" + self.expected + b">")
+
+    def test_aiter_cancel(self):
+        def slow_chunks(path, chunk_size, size):
+            while True:
+                time.sleep(0.2)
+                yield b"x"
+
+        async def consume():
+            async for _ in aiter_b64_payload(b"<", self.path, b">"):
+                pass
+
+        async def cancel():
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.1)  # next()正在线程中运行
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch("aioaria2.utils.iter_b64encode_file", slow_chunks):
+            asyncio.run(cancel())
+
+
+if __name__ == "__main__":
+    unittest.main()